@@ -0,0 +1,78 @@
+"""
+批量公司背调基准测试：对比“每家公司单独启动浏览器、逐个分析”与 profile_many（共享浏览器池并发分析）的吞吐量。
+
+测试完全在本地进行：
+- 生成若干静态公司网站，每个网站由独立端口的 HTTP 服务器提供（即不同的站点，用于验证单站点并发限制）；
+- 启动一个兼容 OpenAI 接口的假 LLM 服务，模拟固定延迟，第一轮要求继续爬取产品页，第二轮返回最终结果。
+
+需要安装 crawl4ai 及其浏览器（playwright install）。用法：
+
+    python bench/bench_profile_many.py --companies 20 --concurrency 8 --pool-size 2
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from fakes import start_fake_llm, build_sites  # noqa: E402
+
+
+async def bench_serial(urls, profiler_kwargs):
+    from iterative_analysis import ai_company_profiler_iterative
+    start = time.perf_counter()
+    for url in urls:
+        await ai_company_profiler_iterative(url, **profiler_kwargs)
+    return time.perf_counter() - start
+
+
+async def bench_profile_many(urls, concurrency, pool_size, profiler_kwargs):
+    from batch_profiler import profile_many
+    start = time.perf_counter()
+    async for _url, _analysis in profile_many(urls, max_concurrency=concurrency, pool_size=pool_size,
+                                              **profiler_kwargs):
+        pass
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="profile_many 基准测试")
+    parser.add_argument('--companies', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="假 LLM 服务每次响应的延迟（秒）")
+    parser.add_argument('--skip-serial', action='store_true', help="跳过逐个分析的对照组")
+    args = parser.parse_args()
+
+    llm_server = start_fake_llm(latency=args.llm_latency)
+    os.environ["DASHSCOPE_MAX_CONCURRENCY"] = str(args.concurrency)
+    os.environ["LLM_CACHE_BYPASS"] = "1"  # 各公司的 prompt 高度相似，避免缓存命中影响结果
+    os.environ["CRAWL_CACHE_BYPASS"] = "1"  # 两组测试爬取相同的页面，避免第二组命中页面缓存
+
+    profiler_kwargs = {"max_crawls": 3, "incremental": True}
+    with tempfile.TemporaryDirectory() as root:
+        os.environ["CRAWL_CACHE_DIR"] = os.path.join(root, 'crawl_cache')
+        urls, servers = build_sites(root, args.companies)
+        try:
+            results = {}
+            if not args.skip_serial:
+                results['serial'] = asyncio.run(bench_serial(urls, profiler_kwargs))
+            results['profile_many'] = asyncio.run(
+                bench_profile_many(urls, args.concurrency, args.pool_size, profiler_kwargs)
+            )
+        finally:
+            for server in servers:
+                server.shutdown()
+            llm_server.shutdown()
+
+    print(f"\n公司数: {args.companies}  并发: {args.concurrency}  浏览器池: {args.pool_size}")
+    for name, elapsed in results.items():
+        print(f"{name:>14}: {elapsed:8.2f} 秒  {args.companies / elapsed:8.2f} 家/秒")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+表格读写基准测试：对比 pandas.read_excel / to_excel 与 table_io 在各格式下读写大批量联系人名单的耗时。
+
+用法：
+
+    python bench/bench_table_io.py --rows 100000
+    python bench/bench_table_io.py --rows 100000 --formats csv jsonl --skip-pandas
+
+Parquet 需要安装 pyarrow（pip install -e .[parquet]），未安装时自动跳过。
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from table_io import iter_chunks, write_table  # noqa: E402
+
+FORMATS = ('xlsx', 'csv', 'jsonl', 'parquet')
+
+
+def make_rows(count):
+    return [{
+        'id': i + 1,
+        '公司名称': f"示例公司{i // 5}",
+        '姓名': f"Contact {i}",
+        '职务': "Purchasing Manager",
+        '邮箱': f"contact{i}@company{i // 5}.example.com",
+        '简介': "Steel and foundry supplier focused on refractory linings and furnace maintenance services.",
+    } for i in range(count)]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def read_all(path):
+    return sum(len(chunk) for chunk in iter_chunks(path, chunk_size=5000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="表格读写基准测试")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS))
+    parser.add_argument('--skip-pandas', action='store_true', help="不运行 pandas 对照组（Excel 大表非常慢）")
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if not args.skip_pandas:
+            import pandas as pd
+            path = os.path.join(workdir, 'pandas.xlsx')
+            write_seconds, _ = timed(lambda: pd.DataFrame(rows).to_excel(path, index=False))
+            read_seconds, df = timed(lambda: pd.read_excel(path))
+            results.append(('pandas xlsx', write_seconds, read_seconds, len(df)))
+
+        for fmt in args.formats:
+            path = os.path.join(workdir, f'contacts.{fmt}')
+            try:
+                write_seconds, _ = timed(lambda: write_table(path, rows))
+            except ImportError as e:
+                print(f"跳过 {fmt}: {e}")
+                continue
+            read_seconds, count = timed(lambda: read_all(path))
+            results.append((f"table_io {fmt}", write_seconds, read_seconds, count))
+
+    print(f"\n{'方式':<18}{'写入(s)':>10}{'读取(s)':>10}{'行数':>10}")
+    for name, write_seconds, read_seconds, count in results:
+        print(f"{name:<18}{write_seconds:>10.2f}{read_seconds:>10.2f}{count:>10}")
+
+
+if __name__ == '__main__':
+    main()
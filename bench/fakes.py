@@ -0,0 +1,255 @@
+"""
+基准测试用的本地替身服务：兼容 OpenAI 接口的假 LLM、aiosmtpd 邮件接收端、静态公司网站。
+
+所有服务都只监听 127.0.0.1 的随机端口，不访问外部网络，也不消耗任何 API 配额。
+"""
+import os
+import re
+import json
+import time
+import random
+import socket
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler, SimpleHTTPRequestHandler
+
+SITE_PAGES = {
+    "index.html": "<h1>{name}</h1><p>{name} 是一家工业自动化设备制造商，为中小型工厂提供整线解决方案。</p>"
+                  "<a href='catalog.html'>产品目录</a>",
+    "catalog.html": "<h1>{name} 产品目录</h1><ul><li>伺服电机</li><li>PLC 控制器</li><li>视觉检测系统</li></ul>",
+}
+
+EMAIL_BODY = (
+    "Dear {name},\n\nI came across your company and was impressed by your work in industrial materials. "
+    "Our refractory raw materials help manufacturers reduce furnace downtime and cut energy costs, "
+    "and many customers in your industry have seen measurable gains in lining life within one quarter. "
+    "We supply high-purity alumina, magnesia and silicon carbide with consistent quality, flexible packaging "
+    "and reliable lead times, backed by detailed test reports for every batch. "
+    "Please visit our website for the full product list. Are there any products your company needs? "
+    "If so, please share the name, specifications and the estimated order quantity, and I will prepare "
+    "a tailored quotation together with samples for your evaluation. Our technical team can also review your "
+    "current lining design and operating temperatures, and suggest a material combination that fits your "
+    "process and budget. We have supported steel, cement and glass producers for more than ten years.\n\n"
+    "Best regards,\nChloe"
+)
+
+# 不合格的输出（占位符 + 字数不足），用于验证质检只重新生成这部分联系人
+BAD_EMAIL_BODY = "Dear [Contact Name],\n\nWe sell refractory materials. Let me know if you are interested.\n\nBest regards,\nChloe"
+
+# 模型常在结果之后附加的说明文字；流式解析拿到完整结果后会提前停止，不再生成这部分
+TRAILING_NOTE = (
+    "Note: Feel free to adjust the tone, the product details and the call to action to better match the "
+    "recipient. You may also want to add a short reference to a recent project or certification, and to "
+    "personalise the subject line further before sending. Let me know if you would like alternative versions."
+)
+
+
+def serve(handler, port=0):
+    """在后台线程中启动 HTTP 服务器。"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """
+    兼容 OpenAI chat.completions 的假 LLM 服务，按 prompt 内容返回对应格式的结果：
+    批量生成返回 JSON 数组，背调分析先要求爬取 catalog.html、看到产品目录后返回最终结果，其余返回一封开发信。
+    与真实模型一样，结果前后常带有说明文字。
+
+    请求带 stream=true 时以 SSE 分块返回，总延迟均匀分布在各块之间；客户端中途断开时停止输出。
+    """
+
+    latency = 0.2
+    jitter = 0.0
+    rate_429 = 0.0
+    tail_rate = 0.0
+    tail_latency = 0.0
+    completion_tokens = 300
+    bad_rate = 0.0
+    cancelled_streams = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _email_body(self, name):
+        return BAD_EMAIL_BODY if random.random() < self.bad_rate else EMAIL_BODY.format(name=name)
+
+    def _reply(self, prompt):
+        if "JSON array" in prompt:
+            ids = re.findall(r'"id":\s*"([^"]+)"', prompt.split("Clients:", 1)[-1])
+            emails = json.dumps([{"id": i, "subject": "Cutting furnace downtime",
+                                  "body": self._email_body(f"client {i}")} for i in ids])
+            return f"Here are the emails:\n{emails}\n\n{TRAILING_NOTE}"
+        if "final_analysis" in prompt or "company_summary" in prompt:
+            if "产品目录" in prompt and "伺服电机" in prompt:
+                return self._with_note(json.dumps({"status": "DONE", "final_analysis": {
+                    "company_summary": "工业自动化设备制造商", "target_market": "中小型工厂",
+                    "potential_pain_points": ["产线效率低"]}}, ensure_ascii=False))
+            if "status" in prompt:
+                return self._with_note(json.dumps({"status": "CONTINUE", "summary_so_far": "工业自动化设备制造商",
+                                                   "next_url_path": "catalog.html"}, ensure_ascii=False))
+            return self._with_note(json.dumps({"company_summary": "工业自动化设备制造商",
+                                               "potential_pain_points": ["产线效率低"]}, ensure_ascii=False))
+        name = re.search(r'Contact Name:\s*(.+)', prompt)
+        email = self._email_body(name.group(1) if name else 'Sir')
+        return f"Subject: Cutting furnace downtime\n\n{email}\n\n{TRAILING_NOTE}"
+
+    @staticmethod
+    def _with_note(payload):
+        return f"```json\n{payload}\n```\n\n{TRAILING_NOTE}"
+
+    def _stream(self, body, content, delay, prompt_tokens):
+        """以 SSE 分块返回结果；完整输出后按 stream_options.include_usage 附加用量。"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        pieces = re.findall(r'\S*\s*', content)
+        pieces = [''.join(pieces[i:i + 8]) for i in range(0, len(pieces), 8)]
+        base = {"id": "bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get('model')}
+        events = [dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": piece},
+                                       "finish_reason": None}]) for piece in pieces if piece]
+        events.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (body.get('stream_options') or {}).get('include_usage'):
+            completion_tokens = len(content) // 4
+            events.append(dict(base, choices=[], usage={
+                "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}))
+        try:
+            for event in events:
+                time.sleep(delay / len(events))
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            FakeLLMHandler.cancelled_streams += 1  # 客户端提前结束了流式输出
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if random.random() < self.rate_429:
+            self.send_response(429)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Retry-After', '0.5')
+            self.end_headers()
+            self.wfile.write(b'{"error": {"message": "rate limited", "type": "rate_limit_error"}}')
+            return
+
+        prompt = "\n".join(str(m.get('content', '')) for m in body.get('messages', []))
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if random.random() < self.tail_rate:
+            delay = self.tail_latency  # 模拟服务端偶发的长尾延迟
+        prompt_tokens = len(prompt) // 4
+        if body.get('stream'):
+            self._stream(body, self._reply(prompt), max(0.0, delay), prompt_tokens)
+            return
+        time.sleep(max(0.0, delay))
+        payload = json.dumps({
+            "id": "bench", "object": "chat.completion", "created": int(time.time()), "model": body.get('model'),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": self._reply(prompt)}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": self.completion_tokens,
+                      "total_tokens": prompt_tokens + self.completion_tokens},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_fake_llm(latency=0.2, jitter=0.0, rate_429=0.0, completion_tokens=300, tail_rate=0.0, tail_latency=0.0,
+                   bad_rate=0.0):
+    """
+    启动假 LLM 服务，并把混元和通义千问的 base URL 都指向它。
+
+    :param latency: 每次响应的平均延迟（秒）。
+    :param jitter: 延迟的随机抖动范围（秒）。
+    :param rate_429: 返回 429 的请求比例。
+    :param completion_tokens: 每次响应报告的输出 token 数。
+    :param tail_rate: 出现长尾延迟的请求比例。
+    :param tail_latency: 长尾请求的延迟（秒）。
+    :param bad_rate: 返回不合格邮件（占位符、字数不足）的比例。
+    """
+    handler = type('ConfiguredFakeLLMHandler', (FakeLLMHandler,), {
+        'latency': latency, 'jitter': jitter, 'rate_429': rate_429, 'completion_tokens': completion_tokens,
+        'tail_rate': tail_rate, 'tail_latency': tail_latency, 'bad_rate': bad_rate,
+    })
+    server = serve(handler)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["HUNYUAN_BASE_URL"] = base_url
+    os.environ["DASHSCOPE_BASE_URL"] = base_url
+    os.environ.setdefault("HUNYUAN_API_KEY", "bench")
+    os.environ.setdefault("DASHSCOPE_API_KEY", "bench")
+    return server
+
+
+class QuietStaticHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def build_sites(root, count, separate_hosts=True):
+    """
+    生成 count 个静态公司网站，返回 (首页网址列表, 服务器列表)。
+
+    :param separate_hosts: 为 True 时每个网站由独立端口的服务器提供（即不同的站点）；
+                           为 False 时所有网站作为子目录由同一个服务器提供，适合上万家公司的规模。
+    """
+    urls, servers = [], []
+    for i in range(count):
+        site_dir = os.path.join(root, f"company_{i}")
+        os.makedirs(site_dir, exist_ok=True)
+        for filename, html in SITE_PAGES.items():
+            with open(os.path.join(site_dir, filename), 'w', encoding='utf-8') as f:
+                f.write(f"<html><body>{html.format(name=f'示例公司{i}')}</body></html>")
+        if separate_hosts:
+            server = serve(partial(QuietStaticHandler, directory=site_dir))
+            servers.append(server)
+            urls.append(f"http://127.0.0.1:{server.server_address[1]}/index.html")
+    if not separate_hosts:
+        server = serve(partial(QuietStaticHandler, directory=root))
+        servers.append(server)
+        urls = [f"http://127.0.0.1:{server.server_address[1]}/company_{i}/index.html" for i in range(count)]
+    return urls, servers
+
+
+class SMTPSink:
+    """
+    基于 aiosmtpd 的本地邮件接收端：接收并计数所有邮件，不做投递。
+
+    启动后设置好发送端所需的 .env 变量（明文、免登录、不限速）。
+    """
+
+    def __init__(self):
+        from aiosmtpd.controller import Controller
+
+        sink = self
+        self.received = 0
+
+        class Handler:
+            async def handle_DATA(self, server, session, envelope):
+                sink.received += 1
+                return '250 OK'
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        self.controller = Controller(Handler(), hostname='127.0.0.1', port=self.port)
+
+    def start(self):
+        self.controller.start()
+        os.environ.update({
+            'SENDER_EMAIL': 'bench@example.com',
+            'SMTP_SERVER': '127.0.0.1',
+            'SMTP_PORT': str(self.port),
+            'SMTP_SSL': 'false',
+            'SMTP_STARTTLS': 'false',
+            'SMTP_SKIP_LOGIN': 'true',
+            'SENDER_RATE_PER_MINUTE': '0',
+        })
+        return self
+
+    def stop(self):
+        self.controller.stop()
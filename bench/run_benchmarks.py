@@ -0,0 +1,307 @@
+"""
+离线端到端基准测试：在本地替身服务（假 LLM、aiosmtpd 邮件接收端、静态公司网站）上驱动
+process_contacts、ai_company_profiler_iterative 和 send_generated_emails，不消耗任何 API 配额。
+
+每个场景和规模在独立的子进程中运行，报告成功与失败的条数、吞吐量（成功条数/秒）、单条延迟 p50/p95/p99 以及峰值内存（RSS）。
+用法：
+
+    python bench/run_benchmarks.py --scales 100 1000 --scenarios generate send
+    python bench/run_benchmarks.py --output bench_results.json
+    python bench/run_benchmarks.py --baseline bench_results.json   # 吞吐量下降超过阈值时以非零状态退出
+
+profile 场景需要安装 crawl4ai 及其浏览器；send 场景需要 aiosmtpd（pip install -e .[bench]）。
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from fakes import start_fake_llm, build_sites, SMTPSink, EMAIL_BODY  # noqa: E402
+
+SCENARIOS = ('generate', 'profile', 'send')
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）；Linux 上 ru_maxrss 单位为 KB，macOS 上为字节。"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+# 公司简介模板：同一模板生成的简介只有成立年份不同，模拟名单中大量近似的同类公司
+PROFILE_TEMPLATES = (
+    "Steel and foundry supplier focused on refractory linings for blast furnaces and ladles.",
+    "Distributor of refractory bricks, castables and insulation materials for cement kilns.",
+    "Glass manufacturer operating float lines and regenerative furnaces across three plants.",
+    "Ceramic tile producer using roller kilns, sourcing alumina and zirconia raw materials.",
+    "Non-ferrous metals smelter producing copper and aluminium ingots for export markets.",
+    "Engineering contractor installing and maintaining industrial furnace linings.",
+)
+
+
+def write_contacts(path, count, contacts_per_company=5):
+    import pandas as pd
+
+    def profile(company):
+        return f"{PROFILE_TEMPLATES[company % len(PROFILE_TEMPLATES)]} Founded in {1980 + company % 40}."
+
+    pd.DataFrame([{
+        '公司名称': f"示例公司{i // contacts_per_company}",
+        '姓名': f"Contact {i}",
+        '职务': "Purchasing Manager",
+        '邮箱': f"contact{i}@company{i // contacts_per_company}.example.com",
+        '简介': profile(i // contacts_per_company),
+    } for i in range(count)]).to_excel(path, index=False)
+
+
+def write_generated_emails(path, count):
+    import pandas as pd
+    pd.DataFrame([{
+        'id': i + 1,
+        '邮箱': f"contact{i}@company{i % 50}.example.com",
+        '开发信主题': "Cutting furnace downtime",
+        '开发信内容': EMAIL_BODY.format(name=f"Contact {i}"),
+    } for i in range(count)]).to_excel(path, index=False)
+
+
+def run_generate(scale, args, workdir, latencies):
+    from generate_email import (
+        create_email_generation_chain, create_batch_email_generation_chain, create_personalization_chain,
+        process_contacts
+    )
+    from metrics import get_metrics
+    from result_store import ResultStore
+
+    contacts_path = os.path.join(workdir, 'contacts.xlsx')
+    store_path = os.path.join(workdir, 'generated.jsonl')
+    write_contacts(contacts_path, scale)
+    kwargs = {}
+    if args.batch_size > 1:
+        kwargs['batch_chain'] = create_batch_email_generation_chain(args.batch_size)
+        kwargs['batch_size'] = args.batch_size
+    if args.reuse_similar:
+        kwargs['personalize_chain'] = create_personalization_chain()
+
+    start = time.perf_counter()
+    asyncio.run(process_contacts(
+        filepath=contacts_path,
+        chain=create_email_generation_chain(),
+        max_concurrency=args.concurrency,
+        output_filename=os.path.join(workdir, 'generated.xlsx'),
+        store_path=store_path,
+        **kwargs
+    ))
+    elapsed = time.perf_counter() - start
+    # 单次 LLM 调用的耗时取自运行指标，流式调用计到停止生成为止
+    latencies.extend(get_metrics().samples('llm_call_seconds'))
+    return elapsed, len(ResultStore(store_path).completed_keys())
+
+
+def run_profile(scale, args, workdir, latencies):
+    from batch_profiler import CrawlerPool
+    from iterative_analysis import ai_company_profiler_iterative
+
+    urls, servers = build_sites(os.path.join(workdir, 'sites'), scale, separate_hosts=False)
+
+    succeeded = 0
+
+    async def profile_all():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        async with CrawlerPool(size=args.pool_size) as pool:
+            async def profile(url):
+                nonlocal succeeded
+                async with semaphore:
+                    async with pool.lease() as crawler:
+                        start = time.perf_counter()
+                        analysis = await ai_company_profiler_iterative(url, max_crawls=3, incremental=True,
+                                                                       crawler=crawler)
+                        latencies.append(time.perf_counter() - start)
+                        # 失败时返回 {"error": ...}，不计入成功
+                        succeeded += bool(analysis) and not (isinstance(analysis, dict) and 'error' in analysis)
+
+            await asyncio.gather(*(profile(url) for url in urls))
+
+    try:
+        start = time.perf_counter()
+        asyncio.run(profile_all())
+        return time.perf_counter() - start, succeeded
+    finally:
+        for server in servers:
+            server.shutdown()
+
+
+def run_send(scale, args, workdir, latencies):
+    import smtp_sender
+    from send_email import send_generated_emails
+
+    emails_path = os.path.join(workdir, 'emails.xlsx')
+    write_generated_emails(emails_path, scale)
+
+    original_send = smtp_sender.AsyncEmailSender.send
+
+    async def timed_send(self, *send_args, **send_kwargs):
+        start = time.perf_counter()
+        try:
+            return await original_send(self, *send_args, **send_kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    smtp_sender.AsyncEmailSender.send = timed_send
+    sink = SMTPSink().start()
+    try:
+        start = time.perf_counter()
+        send_generated_emails(filepath=emails_path, outbox_path=os.path.join(workdir, 'outbox.sqlite'))
+        elapsed = time.perf_counter() - start
+    finally:
+        sink.stop()
+    return elapsed, sink.received
+
+
+def run_child(scenario, scale, args):
+    """在当前进程中运行一个场景，并以一行 JSON 输出结果。"""
+    from metrics import get_metrics
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ.update({
+            "LLM_CACHE_BYPASS": "1",
+            "CRAWL_CACHE_BYPASS": "1",
+            "CRAWL_CACHE_DIR": os.path.join(workdir, 'crawl_cache'),
+            "SUPPRESSION_DB": os.path.join(workdir, 'suppression.sqlite'),
+            "HUNYUAN_MAX_CONCURRENCY": str(args.concurrency),
+            "DASHSCOPE_MAX_CONCURRENCY": str(args.concurrency),
+            "SEND_CONCURRENCY": str(args.concurrency),
+            "SMTP_POOL_SIZE": str(args.concurrency),
+        })
+        llm_server = start_fake_llm(latency=args.llm_latency, jitter=args.llm_jitter, rate_429=args.rate_429,
+                                    completion_tokens=args.completion_tokens, tail_rate=args.llm_tail_rate,
+                                    tail_latency=args.llm_tail_latency, bad_rate=args.llm_bad_rate)
+        latencies = []
+        try:
+            runner = {'generate': run_generate, 'profile': run_profile, 'send': run_send}[scenario]
+            elapsed, succeeded = runner(scale, args, workdir, latencies)
+        finally:
+            llm_server.shutdown()
+
+    print(RESULT_PREFIX + json.dumps({
+        'scenario': scenario,
+        'scale': scale,
+        'seconds': round(elapsed, 3),
+        'succeeded': succeeded,
+        'failed': scale - succeeded,
+        # 只按成功处理的条数计算吞吐量，失败的联系人不计入
+        'per_second': round(succeeded / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'prompt_tokens': int(get_metrics().total('llm_tokens_total', kind='prompt')),
+        'completion_tokens': int(get_metrics().total('llm_tokens_total', kind='completion')),
+        'regenerations': int(get_metrics().total('quality_regenerations_total')),
+    }))
+
+
+def child_args(args):
+    return [
+        '--concurrency', str(args.concurrency), '--batch-size', str(args.batch_size),
+        '--pool-size', str(args.pool_size), '--llm-latency', str(args.llm_latency),
+        '--llm-jitter', str(args.llm_jitter), '--rate-429', str(args.rate_429),
+        '--completion-tokens', str(args.completion_tokens),
+        '--llm-tail-rate', str(args.llm_tail_rate), '--llm-tail-latency', str(args.llm_tail_latency),
+        '--llm-bad-rate', str(args.llm_bad_rate), *(['--reuse-similar'] if args.reuse_similar else []),
+    ]
+
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    """与基线结果比较吞吐量，返回退化的条目列表。"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['scenario'], r['scale']): r for r in json.load(f)}
+    regressions = []
+    for result in results:
+        base = baseline.get((result['scenario'], result['scale']))
+        if base and result['per_second'] < base['per_second'] * (1 - tolerance):
+            regressions.append((result, base))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端基准测试")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--scales', nargs='+', type=int, default=[100, 1000, 10000])
+    parser.add_argument('--concurrency', type=int, default=16, help="生成/背调/发送的并发数")
+    parser.add_argument('--batch-size', type=int, default=1, help="generate 场景的批量生成大小")
+    parser.add_argument('--pool-size', type=int, default=2, help="profile 场景的浏览器池大小")
+    parser.add_argument('--llm-latency', type=float, default=0.05, help="假 LLM 每次响应的平均延迟（秒）")
+    parser.add_argument('--llm-jitter', type=float, default=0.02, help="假 LLM 延迟的随机抖动（秒）")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="假 LLM 返回 429 的比例")
+    parser.add_argument('--completion-tokens', type=int, default=300, help="假 LLM 报告的输出 token 数")
+    parser.add_argument('--llm-tail-rate', type=float, default=0.0, help="假 LLM 出现长尾延迟的请求比例")
+    parser.add_argument('--llm-tail-latency', type=float, default=3.0, help="假 LLM 长尾请求的延迟（秒）")
+    parser.add_argument('--llm-bad-rate', type=float, default=0.0, help="假 LLM 返回不合格邮件的比例（验证质检重新生成）")
+    parser.add_argument('--reuse-similar', action='store_true', help="generate 场景启用相似公司复用")
+    parser.add_argument('--output', help="把结果写入 JSON 文件，可作为之后比较的基线")
+    parser.add_argument('--baseline', help="与之前保存的基线结果比较吞吐量")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="允许的吞吐量下降比例")
+    parser.add_argument('--verbose', action='store_true', help="显示被测程序的日志输出")
+    parser.add_argument('--child', nargs=2, metavar=('SCENARIO', 'SCALE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]), args)
+        return
+
+    results = []
+    for scenario in args.scenarios:
+        for scale in args.scales:
+            print(f"运行 {scenario} × {scale} ...", flush=True)
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', scenario, str(scale), *child_args(args)],
+                stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL, text=True
+            )
+            lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+            if proc.returncode != 0 or not lines:
+                print(f"  {scenario} × {scale} 运行失败（退出码 {proc.returncode}），可加 --verbose 查看日志。")
+                continue
+            result = json.loads(lines[-1][len(RESULT_PREFIX):])
+            if result['failed']:
+                print(f"  警告：{scenario} × {scale} 中有 {result['failed']} 条处理失败，吞吐量只计成功的 "
+                      f"{result['succeeded']} 条。")
+            results.append(result)
+
+    print(f"\n{'场景':<10}{'规模':>8}{'成功':>8}{'失败':>8}{'耗时(s)':>10}{'条/秒':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"
+          f"{'峰值RSS(MB)':>14}{'输入token':>12}{'输出token':>12}{'重新生成':>10}")
+    for r in results:
+        print(f"{r['scenario']:<10}{r['scale']:>8}{r['succeeded']:>8}{r['failed']:>8}{r['seconds']:>10}{r['per_second']:>10}{r['p50_ms']:>10}"
+              f"{r['p95_ms']:>10}{r['p99_ms']:>10}{r['peak_rss_mb']:>14}{r.get('prompt_tokens', 0):>12}{r.get('completion_tokens', 0):>12}"
+              f"{r.get('regenerations', 0):>10}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        for result, base in regressions:
+            print(f"性能退化: {result['scenario']} × {result['scale']} 吞吐量 {result['per_second']} 条/秒，"
+                  f"基线 {base['per_second']} 条/秒")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
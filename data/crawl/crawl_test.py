@@ -1,9 +1,14 @@
+import os
+import sys
 import asyncio
-from crawl4ai import *
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
+from crawl_cache import CachedCrawler
 
 
 async def main():
-    async with AsyncWebCrawler() as crawler:
+    # 经过页面缓存爬取：重复运行时直接读取缓存，设置 CRAWL_CACHE_OFFLINE=1 可完全离线运行
+    async with CachedCrawler() as crawler:
         result = await crawler.arun(
             url="https://eitrawmaterials.eu",
         )
@@ -0,0 +1,159 @@
+import asyncio
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+from logger import logger
+from crawl_cache import get_crawl_cache
+from iterative_analysis import ai_company_profiler_iterative
+
+
+class CrawlerPool:
+    """
+    长期存活的浏览器池：启动时一次性创建 size 个 AsyncWebCrawler，各公司的分析任务共享这些浏览器，
+    不再为每家公司单独启动一个无头浏览器。每个浏览器可以同时处理多个页面，租用时选择当前负载最低的一个。
+    """
+
+    def __init__(self, size=2, crawler_factory=None):
+        self.size = size
+        self.crawler_factory = crawler_factory
+        self._crawlers = []
+        self._active = []
+
+    async def __aenter__(self):
+        if get_crawl_cache().offline:
+            logger.info("页面缓存处于离线模式，不启动浏览器。")
+            return self
+        if self.crawler_factory is None:
+            from crawl4ai import AsyncWebCrawler  # 加载较慢，真正需要启动浏览器时才导入
+            self.crawler_factory = AsyncWebCrawler
+        for _ in range(self.size):
+            crawler = self.crawler_factory()
+            await crawler.start()
+            self._crawlers.append(crawler)
+            self._active.append(0)
+        logger.info(f"浏览器池已启动，共 {self.size} 个浏览器实例。")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        for crawler in self._crawlers:
+            try:
+                await crawler.close()
+            except Exception as e:
+                logger.warning(f"关闭浏览器实例时出错: {e}")
+        self._crawlers.clear()
+        self._active.clear()
+        return False
+
+    @asynccontextmanager
+    async def lease(self):
+        """租用当前负载最低的浏览器实例；离线模式下没有浏览器，返回 None。"""
+        if not self._crawlers:
+            yield None
+            return
+        index = min(range(len(self._crawlers)), key=lambda i: self._active[i])
+        self._active[index] += 1
+        try:
+            yield self._crawlers[index]
+        finally:
+            self._active[index] -= 1
+
+
+async def profile_many(urls, max_concurrency=8, per_host_limit=1, pool_size=2, **profiler_kwargs):
+    """
+    批量分析多家公司：共享一个浏览器池，在全局并发上限和单个站点并发上限内同时分析多家公司，
+    每完成一家就立即产出结果，无需等待整批结束。
+
+    用法::
+
+        async for url, analysis in profile_many(urls, incremental=True):
+            ...
+
+    :param urls: 公司网址的可迭代对象（可以是惰性生成器）。
+    :param max_concurrency: 同时分析的公司数上限。
+    :param per_host_limit: 同一站点（域名+端口）同时进行的分析数上限，避免对单个网站造成压力。
+    :param pool_size: 浏览器池中的浏览器实例数。
+    :param profiler_kwargs: 透传给 ai_company_profiler_iterative 的参数（如 max_crawls、incremental）。
+    """
+    results = asyncio.Queue()
+    url_iter = iter(urls)
+    finished = object()
+    active = defaultdict(int)      # 站点 -> 正在分析的网址数
+    deferred = defaultdict(deque)  # 站点 -> 因站点并发已满而暂缓的网址
+    ready = deque()                # 已为其预留站点名额、可以直接分析的暂缓网址
+    max_deferred = max_concurrency * 50
+    counts = {'deferred': 0}
+    changed = asyncio.Condition()
+
+    def host_of(url):
+        return urlparse(url).netloc.lower()
+
+    async def next_url():
+        """
+        取下一个可以立即分析的网址：站点并发已满的网址先放到该站点的暂缓队列，继续取后面的网址，
+        worker 不会为等待某个站点而空占名额；该站点有网址完成时再把暂缓的网址交给空闲的 worker。
+        暂缓的网址过多（名单中大量网址属于同一站点）时才等待。
+        """
+        async with changed:
+            while True:
+                if ready:
+                    return ready.popleft()
+                if counts['deferred'] >= max_deferred:
+                    await changed.wait()
+                    continue
+                url = next(url_iter, None)
+                if url is None:
+                    return None  # 剩余的暂缓网址由正在分析同一站点的 worker 完成后接手
+                host = host_of(url)
+                if active[host] < per_host_limit:
+                    active[host] += 1
+                    return url
+                deferred[host].append(url)
+                counts['deferred'] += 1
+
+    async def release(url):
+        async with changed:
+            host = host_of(url)
+            if deferred[host]:
+                ready.append(deferred[host].popleft())  # 名额直接转给该站点暂缓的下一个网址
+                counts['deferred'] -= 1
+                if not deferred[host]:
+                    del deferred[host]
+            else:
+                active[host] -= 1
+                if not active[host]:
+                    del active[host]
+            changed.notify_all()
+
+    async with CrawlerPool(size=pool_size) as pool:
+        async def worker():
+            # 所有 worker 共享同一个网址迭代器，按需取用，不会预先为全部网址创建任务
+            while (url := await next_url()) is not None:
+                try:
+                    async with pool.lease() as crawler:
+                        try:
+                            analysis = await ai_company_profiler_iterative(url, crawler=crawler, **profiler_kwargs)
+                        except Exception as e:
+                            logger.error(f"分析 {url} 时发生错误: {e}")
+                            analysis = {"error": f"分析时发生异常: {e}"}
+                finally:
+                    await release(url)
+                await results.put((url, analysis))
+
+        async def run_workers():
+            try:
+                await asyncio.gather(*(worker() for _ in range(max_concurrency)))
+            finally:
+                await results.put(finished)
+
+        runner = asyncio.create_task(run_workers())
+        try:
+            while True:
+                item = await results.get()
+                if item is finished:
+                    break
+                yield item
+            await runner
+        finally:
+            if not runner.done():
+                runner.cancel()
+                await asyncio.gather(runner, return_exceptions=True)
@@ -0,0 +1,337 @@
+"""
+分片执行的活动（campaign）：把联系人名单切成若干分片，作为任务写入共享的 SQLite 任务队列（job_queue），
+由任意数量的 worker 进程领取执行。worker 可以是同一台机器上的多个进程，也可以是挂载了同一共享存储的多台机器。
+
+    python src/cli.py submit contacts.csv --campaign spring --send
+    python src/cli.py worker --processes 4
+    python src/cli.py status
+    python src/cli.py collect --campaign spring -o generated.csv
+
+每个进程有自己的事件循环，pandas 处理、prompt 渲染、浏览器和日志不再挤在同一个 CPU 核上；
+各进程通过 RATE_LIMIT_DB 共用同一份 RPM/TPM 配额和 SMTP 账户/域名限速，整体请求速率和发信速率不会超过配置的限额。
+"""
+import os
+import uuid
+import socket
+import asyncio
+import multiprocessing
+from datetime import datetime
+from logger import logger
+from metrics import get_metrics, export_metrics
+from job_queue import JobQueue, log_queue_summary
+from table_io import iter_chunks, open_writer
+
+
+def campaign_dir(queue_path, campaign) -> str:
+    """活动的工作目录（分片文件、结果存储、发件箱），与队列文件放在一起，多台机器看到的路径一致。"""
+    return os.path.join(os.path.dirname(os.path.abspath(queue_path)), campaign)
+
+
+def _write_shards(rows_iter, shard_dir, prefix, shard_size):
+    """把行按 shard_size 切成 JSONL 分片文件，返回 [(分片路径, 该分片第一行的序号)]。"""
+    os.makedirs(shard_dir, exist_ok=True)
+    shards = []
+    writer = None
+    count = 0
+    for row in rows_iter:
+        if count % shard_size == 0:
+            if writer:
+                writer.close()
+            path = os.path.join(shard_dir, f"{prefix}-{len(shards):05d}.jsonl")
+            writer = open_writer(path)
+            shards.append((path, count))
+        writer.write(row)
+        count += 1
+    if writer:
+        writer.close()
+    return shards
+
+
+def submit_campaign(queue, contacts_path, campaign, shard_size=500, send=False) -> int:
+    """
+    清洗联系人名单并按分片提交生成任务。
+
+    清洗（去重、退订名单等）在提交时对整份名单做一次，分片之间不会出现重复的联系人；分片的结果 id 连续编号。
+
+    :param send: 为 True 时每个分片生成完毕后自动提交对应的发送任务。
+    :return: 提交的任务数。
+    """
+    from contact_hygiene import ContactHygiene, get_suppression_list
+
+    hygiene = ContactHygiene(get_suppression_list())
+    base = campaign_dir(queue.db_path, campaign)
+
+    def clean_rows():
+        for chunk in iter_chunks(contacts_path, chunk_size=5000):
+            for _, row in hygiene.clean_chunk(chunk):
+                yield row
+
+    shards = _write_shards(clean_rows(), os.path.join(base, 'shards'), 'contacts', shard_size)
+    hygiene.log_summary()
+    payloads = [{
+        'input': path,
+        'store': os.path.join(base, 'results', os.path.basename(path)),
+        'start_index': start_index,
+        'send': send,
+        'outbox': os.path.join(base, 'outbox.sqlite'),
+    } for path, start_index in shards]
+    return queue.submit_many(campaign, 'generate', payloads)
+
+
+def submit_profiles(queue, urls, campaign, shard_size=20) -> int:
+    """把公司网址按分片提交背调任务，结果写入各分片自己的 JSONL 存储。"""
+    base = campaign_dir(queue.db_path, campaign)
+    urls = list(dict.fromkeys(url.strip() for url in urls if url and url.strip()))
+    payloads = [{
+        'urls': urls[start:start + shard_size],
+        'store': os.path.join(base, 'profiles', f"profiles-{start // shard_size:05d}.jsonl"),
+    } for start in range(0, len(urls), shard_size)]
+    return queue.submit_many(campaign, 'profile', payloads)
+
+
+def submit_send(queue, generated_path, campaign, shard_size=2000) -> int:
+    """把已生成的邮件文件按分片提交发送任务，所有分片写入同一个发件箱（以活动为来源，每个收件人只发送一次）。"""
+    base = campaign_dir(queue.db_path, campaign)
+    rows = (row for chunk in iter_chunks(generated_path, chunk_size=5000) for row in chunk)
+    shards = _write_shards(rows, os.path.join(base, 'shards'), 'generated', shard_size)
+    outbox = os.path.join(base, 'outbox.sqlite')
+    return queue.submit_many(campaign, 'send', [{'input': path, 'outbox': outbox} for path, _ in shards])
+
+
+class CampaignWorker:
+    """
+    单个 worker 进程：循环领取任务并执行，处理期间定期续租。生成和背调的 chain、发件引擎在首次用到时创建，
+    之后的任务复用。
+
+    任务的执行复用已有的单进程流程：生成任务即对分片调用 process_contacts（resume=True，重新领取的任务从断点继续），
+    背调任务调用 profile_many，发送任务把分片写入发件箱后调用 deliver_outbox。
+    """
+
+    def __init__(self, queue, worker_id=None, kinds=None, max_concurrency=None, batch_size=1,
+                 enrich_companies=False, reuse_similar=False, profile_concurrency=4, max_crawls=3):
+        """
+        :param kinds: 只领取这些类型的任务；为 None 时领取全部类型。
+        :param max_concurrency: 每个进程内同时生成的数量，默认按限流配置。
+        :param batch_size: 大于 1 时启用批量生成模式。
+        :param reuse_similar: 启用相似公司复用；聚类在每个分片内进行，分片越大复用机会越多。
+        """
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.kinds = list(kinds) if kinds else None
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.enrich_companies = enrich_companies
+        self.reuse_similar = reuse_similar
+        self.profile_concurrency = profile_concurrency
+        self.max_crawls = max_crawls
+        self._chains = None
+        self._sender = None
+
+    def _generation_chains(self):
+        if self._chains is None:
+            from generate_email import (
+                create_email_generation_chain, create_batch_email_generation_chain, create_personalization_chain
+            )
+            batch_chain = None
+            if self.batch_size > 1:
+                batch_chain = create_batch_email_generation_chain(batch_size=self.batch_size)
+            personalize_chain = create_personalization_chain() if self.reuse_similar else None
+            self._chains = (create_email_generation_chain(), batch_chain, personalize_chain)
+        return self._chains
+
+    async def _run_generate(self, job):
+        from generate_email import process_contacts
+        from result_store import ResultStore
+
+        payload = job['payload']
+        chain, batch_chain, personalize_chain = self._generation_chains()
+        failed = await process_contacts(
+            filepath=payload['input'], chain=chain, max_concurrency=self.max_concurrency,
+            output_filename=None, store_path=payload['store'], resume=True,
+            batch_chain=batch_chain, batch_size=self.batch_size, enrich_companies=self.enrich_companies,
+            start_index=payload.get('start_index', 0), personalize_chain=personalize_chain,
+        )
+        # 抛出异常使任务放回队列，之后被重新领取时按 resume 只补齐失败的联系人
+        if failed is None:
+            raise RuntimeError(f"未能开始生成 {payload['input']}，请检查联系人文件和产品/发件人资料")
+        if failed:
+            raise RuntimeError(f"分片中有 {failed} 个联系人生成失败")
+        generated = len(ResultStore(payload['store']).completed_keys())
+        if payload.get('send') and generated:
+            await asyncio.to_thread(self.queue.submit, job['campaign'], 'send',
+                                    {'input': payload['store'], 'outbox': payload['outbox'], 'from_store': True})
+        return {'generated': generated}
+
+    async def _run_profile(self, job):
+        from batch_profiler import profile_many
+        from result_store import ResultStore
+
+        payload = job['payload']
+        store = ResultStore(payload['store'], key_field='url')
+        done = store.completed_keys()
+        urls = [url for url in payload['urls'] if store.normalize_key(url) not in done]
+        failed = 0
+        async for url, analysis in profile_many(urls, max_concurrency=self.profile_concurrency,
+                                                max_crawls=self.max_crawls, incremental=True, speculative=True):
+            if not analysis or 'error' in analysis:
+                failed += 1
+                logger.error(f"分析 {url} 失败: {(analysis or {}).get('error', '未返回结果')}")
+            else:
+                store.append({'url': url, **analysis})
+        return {'profiled': len(payload['urls']) - failed, 'failed': failed}
+
+    async def _run_send(self, job):
+        from outbox import Outbox
+        from send_email import create_email_sender, deliver_outbox, load_outbox
+
+        payload = job['payload']
+        if self._sender is None:
+            self._sender = create_email_sender()
+            if self._sender is None:
+                raise RuntimeError("发件账户未配置，无法发送")
+        # 发件箱由多个 worker 共用，这里不调用 recover_interrupted：其他 worker 正在发送的邮件也处于 sending 状态
+        outbox = Outbox(payload['outbox'])
+        try:
+            if not await asyncio.to_thread(load_outbox, payload['input'], outbox, job['campaign'],
+                                           payload.get('from_store', False)):
+                raise RuntimeError(f"读取 {payload['input']} 失败")
+            await deliver_outbox(outbox, self._sender)
+            if not self._sender.available:
+                raise RuntimeError("所有发件账户均登录失败，剩余邮件保留在发件箱中")
+            return outbox.counts()
+        finally:
+            outbox.close()
+
+    async def _heartbeat(self, job_id):
+        """每隔三分之一租约时长续租一次；租约已被他人接管时只记录警告，由后续的 complete 自然失效。"""
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            renewed = await asyncio.to_thread(self.queue.heartbeat, self.worker_id, [job_id])
+            if not renewed:
+                logger.warning(f"任务 {job_id} 的租约已失效，可能已被其他 worker 接管。")
+
+    async def run_job(self, job):
+        handlers = {'generate': self._run_generate, 'profile': self._run_profile, 'send': self._run_send}
+        handler = handlers.get(job['kind'])
+        metrics = get_metrics()
+        heartbeat = asyncio.create_task(self._heartbeat(job['id']))
+        with logger.contextualize(job_id=job['id']):
+            logger.info(f"开始处理任务 {job['id']}（{job['campaign']}/{job['kind']}，第 {job['attempts']} 次）")
+            try:
+                if handler is None:
+                    raise ValueError(f"未知的任务类型: {job['kind']}")
+                with metrics.timer('campaign_job', kind=job['kind']):
+                    result = await handler(job)
+                await asyncio.to_thread(self.queue.complete, job['id'], self.worker_id, result)
+                metrics.inc('campaign_jobs_total', kind=job['kind'], state='done')
+                logger.success(f"任务 {job['id']} 完成: {result}")
+            except Exception as e:
+                state = await asyncio.to_thread(self.queue.fail, job['id'], self.worker_id, e)
+                metrics.inc('campaign_jobs_total', kind=job['kind'], state=state)
+                logger.error(f"任务 {job['id']} 失败（{state}）: {e}")
+            finally:
+                heartbeat.cancel()
+                await asyncio.gather(heartbeat, return_exceptions=True)
+
+    async def run(self, wait=False, poll_interval=1.0) -> int:
+        """
+        循环领取并执行任务，直到队列中没有待处理和处理中的任务。
+
+        :param wait: 为 True 时队列清空后继续轮询等待新任务，不退出。
+        :return: 本 worker 处理的任务数。
+        """
+        processed = 0
+        try:
+            while True:
+                jobs = await asyncio.to_thread(self.queue.claim, self.worker_id, self.kinds)
+                if jobs:
+                    await self.run_job(jobs[0])
+                    processed += 1
+                    continue
+                # 其他 worker 手上还有任务时继续等待：它们可能失败后放回队列，生成任务也可能追加发送任务
+                if not wait and not await asyncio.to_thread(self.queue.active_count, self.kinds):
+                    break
+                await asyncio.sleep(poll_interval)
+        finally:
+            if self._sender is not None:
+                await self._sender.close()
+        logger.info(f"worker {self.worker_id} 退出，共处理 {processed} 个任务。")
+        return processed
+
+
+def _worker_process(queue_path, index, options):
+    """子进程入口：spawn 方式启动，重新加载 .env，各自创建事件循环和 LLM 客户端。"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    os.environ.setdefault("RATE_LIMIT_DB", os.path.abspath(queue_path))
+    queue = JobQueue(queue_path, lease_seconds=options.pop('lease_seconds', 300))
+    wait = options.pop('wait', False)
+    worker = CampaignWorker(queue, worker_id=f"{socket.gethostname()}-{os.getpid()}", **options)
+    try:
+        asyncio.run(worker.run(wait=wait))
+    finally:
+        queue.close()
+        summary_dir = os.path.dirname(os.getenv("METRICS_SUMMARY_PATH") or "logs/run_metrics.json") or "."
+        export_metrics(os.path.join(summary_dir, f"run_metrics.worker{index}.json"))
+
+
+def run_workers(queue_path, processes=1, **options) -> int:
+    """
+    启动 processes 个 worker 进程并等待全部退出。未设置 RATE_LIMIT_DB 时各进程通过队列文件共享 RPM/TPM 配额和发信限速。
+
+    :param options: 透传给 CampaignWorker 的参数，另外支持 wait 与 lease_seconds。
+    :return: 异常退出的进程数。
+    """
+    os.environ.setdefault("RATE_LIMIT_DB", os.path.abspath(queue_path))
+    context = multiprocessing.get_context('spawn')  # 不继承父进程的事件循环、数据库连接和浏览器
+    workers = [context.Process(target=_worker_process, args=(queue_path, index, dict(options)), daemon=False)
+               for index in range(processes)]
+    for process in workers:
+        process.start()
+    logger.info(f"已启动 {processes} 个 worker 进程。")
+    for process in workers:
+        process.join()
+    return sum(1 for process in workers if process.exitcode)
+
+
+def collect_results(queue, campaign, output_filename) -> int:
+    """把活动中已完成的生成任务的分片结果按提交顺序合并导出，格式按扩展名识别。"""
+    from result_store import ResultStore
+
+    count = 0
+    writer = None
+    try:
+        for job in queue.finished_jobs(campaign, 'generate'):
+            latest = ResultStore(job['payload']['store']).latest_records()
+            records = sorted(latest.values(), key=lambda r: r.get('id') or 0)
+            if not records:
+                continue
+            if writer is None:
+                writer = open_writer(output_filename, columns=list(records[0].keys()))
+            writer.write_many(records)
+            count += len(records)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def default_campaign_name() -> str:
+    return datetime.now().strftime("campaign-%Y%m%d-%H%M%S")
+
+
+def log_campaign_status(queue, campaign=None):
+    for name in ([campaign] if campaign else queue.campaigns()):
+        logger.info(f"--- 活动 {name} ---")
+        log_queue_summary(queue, name)
+
+
+def load_urls(path) -> list:
+    """从 .txt（每行一个）或带 url / 官网 / 网站 列的表格文件中读取网址。"""
+    if path.lower().endswith('.txt'):
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            return [line.strip() for line in f if line.strip()]
+    return [row.get('url') or row.get('官网') or row.get('网站') or ''
+            for chunk in iter_chunks(path) for row in chunk]
+
@@ -0,0 +1,293 @@
+"""
+命令行入口：
+
+    python src/cli.py generate contacts.xlsx -o generated.xlsx [--resume] [--batch-size 5] [--enrich] [--reuse-similar] [--pipeline]
+    python src/cli.py profile https://example.com [...] [-o profiles.jsonl]
+    python src/cli.py send generated.xlsx
+    python src/cli.py export -s generated.jsonl -o generated.xlsx
+    python src/cli.py suppress bob@example.com @competitor.com [-f unsubscribes.csv] [--reason unsubscribe]
+    python src/cli.py submit contacts.csv [--campaign spring] [--send] [--shard-size 500]
+    python src/cli.py worker [--processes 4] [--kinds generate,send]
+    python src/cli.py status [--campaign spring]
+    python src/cli.py collect --campaign spring -o generated.csv
+
+各子命令只在执行时导入自己用到的模块，pandas、LangChain、crawl4ai 等较重的依赖以及 LLM 客户端都按需加载，
+例如只发送邮件时不会加载 LangChain 和浏览器。
+"""
+import argparse
+import asyncio
+import sys
+from dotenv import load_dotenv
+from logger import logger
+from metrics import export_metrics
+
+DEFAULT_OUTPUT = "../email_output/generated_emails.xlsx"
+DEFAULT_STORE = "../email_output/generated_emails.jsonl"
+DEFAULT_QUEUE = "../email_output/campaign.sqlite"
+
+
+def cmd_generate(args):
+    from generate_email import (
+        create_email_generation_chain, create_batch_email_generation_chain, create_personalization_chain,
+        process_contacts
+    )
+
+    generate_kwargs = {
+        'filepath': args.input,
+        'max_concurrency': args.concurrency,
+        'output_filename': args.output,
+        'store_path': args.store,
+        'resume': args.resume,
+        'enrich_companies': args.enrich,
+    }
+    try:
+        generate_kwargs['chain'] = create_email_generation_chain()
+        if args.batch_size > 1:
+            generate_kwargs['batch_chain'] = create_batch_email_generation_chain(batch_size=args.batch_size)
+            generate_kwargs['batch_size'] = args.batch_size
+        if args.reuse_similar:
+            generate_kwargs['personalize_chain'] = create_personalization_chain()
+
+        if args.pipeline:
+            from pipeline import run_pipeline
+            logger.info("--- 流水线模式：生成与发送同时进行... ---")
+            asyncio.run(run_pipeline(**generate_kwargs))
+        else:
+            asyncio.run(process_contacts(**generate_kwargs))
+    except Exception as e:
+        logger.error(f"邮件生成过程中发生错误: {e}")
+        return 1
+    return 0
+
+
+def cmd_profile(args):
+    from batch_profiler import profile_many
+    from iterative_analysis import pretty_print_analysis
+    from result_store import ResultStore
+
+    store = ResultStore(args.output, key_field='url') if args.output else None
+
+    async def run():
+        failed = 0
+        async for url, analysis in profile_many(args.urls, max_concurrency=args.concurrency,
+                                                max_crawls=args.max_crawls, incremental=True, speculative=True):
+            if not analysis or 'error' in analysis:
+                failed += 1
+                logger.error(f"分析 {url} 失败: {(analysis or {}).get('error', '未返回结果')}")
+            elif store:
+                store.append({'url': url, **analysis})
+            else:
+                pretty_print_analysis(analysis)
+        return failed
+
+    failed = asyncio.run(run())
+    if store:
+        logger.info(f"背调结果已保存到 {args.output}")
+    return 1 if failed else 0
+
+
+def cmd_send(args):
+    from send_email import send_generated_emails
+
+    try:
+        send_generated_emails(filepath=args.input, outbox_path=args.outbox)
+    except Exception as e:
+        logger.error(f"邮件发送过程中发生错误: {e}")
+        return 1
+    return 0
+
+
+def cmd_export(args):
+    from result_store import ResultStore
+
+    exported = ResultStore(args.store, key_field=args.key_field).export(args.output)
+    if not exported:
+        logger.warning(f"结果存储 {args.store} 中没有可导出的记录。")
+        return 1
+    logger.success(f"已导出 {exported} 条记录到 {args.output}")
+    return 0
+
+
+def _iter_suppression_file(path):
+    """逐行读取退订名单：.txt 每行一个地址，表格文件取 邮箱 / email 列。"""
+    if path.lower().endswith('.txt'):
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            yield from (line.strip() for line in f if line.strip())
+        return
+    from table_io import iter_rows
+    for row in iter_rows(path):
+        yield row.get('邮箱') or row.get('email') or row.get('Email') or ''
+
+
+def cmd_suppress(args):
+    from contact_hygiene import get_suppression_list
+
+    suppression = get_suppression_list()
+    added = suppression.add(args.entries, reason=args.reason)
+    for path in args.file or []:
+        try:
+            added += suppression.add(_iter_suppression_file(path), reason=args.reason)
+        except (OSError, ValueError) as e:
+            logger.error(f"读取退订名单 {path} 时出错: {e}")
+            return 1
+    logger.success(f"已加入 {added} 个新条目，退订/退信名单共 {len(suppression)} 条。")
+    return 0
+
+
+def cmd_submit(args):
+    from campaign import default_campaign_name, load_urls, submit_campaign, submit_profiles, submit_send
+    from job_queue import JobQueue
+
+    campaign = args.campaign or default_campaign_name()
+    queue = JobQueue(args.queue)
+    try:
+        if args.kind == 'generate':
+            submitted = submit_campaign(queue, args.input, campaign, shard_size=args.shard_size, send=args.send)
+        elif args.kind == 'profile':
+            submitted = submit_profiles(queue, load_urls(args.input), campaign, shard_size=args.shard_size)
+        else:
+            submitted = submit_send(queue, args.input, campaign, shard_size=args.shard_size)
+    except (OSError, ValueError) as e:
+        logger.error(f"提交活动时出错: {e}")
+        return 1
+    finally:
+        queue.close()
+    if not submitted:
+        logger.warning(f"{args.input} 中没有可提交的记录。")
+        return 1
+    logger.success(f"活动 {campaign} 已提交 {submitted} 个 {args.kind} 任务，队列: {args.queue}")
+    return 0
+
+
+def cmd_worker(args):
+    from campaign import run_workers
+
+    kinds = [k.strip() for k in args.kinds.split(',') if k.strip()] if args.kinds else None
+    crashed = run_workers(args.queue, processes=args.processes, kinds=kinds, max_concurrency=args.concurrency,
+                          batch_size=args.batch_size, enrich_companies=args.enrich,
+                          reuse_similar=args.reuse_similar, wait=args.wait,
+                          lease_seconds=args.lease)
+    if crashed:
+        logger.error(f"{crashed} 个 worker 进程异常退出。")
+    return 1 if crashed else 0
+
+
+def cmd_status(args):
+    from campaign import log_campaign_status
+    from job_queue import JobQueue
+
+    queue = JobQueue(args.queue)
+    try:
+        log_campaign_status(queue, args.campaign)
+    finally:
+        queue.close()
+    return 0
+
+
+def cmd_collect(args):
+    from campaign import collect_results
+    from job_queue import JobQueue
+
+    queue = JobQueue(args.queue)
+    try:
+        collected = collect_results(queue, args.campaign, args.output)
+    finally:
+        queue.close()
+    if not collected:
+        logger.warning(f"活动 {args.campaign} 还没有已完成的生成结果。")
+        return 1
+    logger.success(f"已合并 {collected} 条生成结果到 {args.output}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="AI 开发信生成与发送代理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser("generate", help="根据联系人文件生成开发信")
+    generate.add_argument("input", help="联系人文件（.xlsx / .csv / .jsonl / .parquet）")
+    generate.add_argument("-o", "--output", default=DEFAULT_OUTPUT, help="生成结果导出路径，格式按扩展名识别")
+    generate.add_argument("-s", "--store", default=DEFAULT_STORE, help="逐条落盘的 JSONL 结果存储路径")
+    generate.add_argument("--concurrency", type=int, default=None, help="同时生成的数量（默认按限流配置）")
+    generate.add_argument("--resume", action="store_true", help="断点续跑：跳过上次运行中已生成且通过质检的联系人，只重新生成缺失和不合格的邮件")
+    generate.add_argument("--batch-size", type=int, default=1,
+                          help="批量模式：每次 LLM 调用为多少个联系人生成邮件（默认 1，即逐封生成）")
+    generate.add_argument("--enrich", action="store_true",
+                          help="公司背调：按公司网站爬取分析（每家公司只分析一次），把结果用于个性化开发信")
+    generate.add_argument("--reuse-similar", action="store_true",
+                          help="相似公司复用：简介近似的公司只完整生成一封，其余基于该草稿用较短的 prompt 改写")
+    generate.add_argument("--pipeline", action="store_true",
+                          help="流水线模式：邮件生成后经自动审核立即发送")
+    generate.set_defaults(func=cmd_generate)
+
+    profile = subparsers.add_parser("profile", help="爬取并分析公司官网")
+    profile.add_argument("urls", nargs="+", help="公司官网网址")
+    profile.add_argument("-o", "--output", help="把结果追加写入 JSONL 文件；不指定时打印报告")
+    profile.add_argument("--max-crawls", type=int, default=3, help="每家公司最多爬取的页面数")
+    profile.add_argument("--concurrency", type=int, default=4, help="同时分析的公司数")
+    profile.set_defaults(func=cmd_profile)
+
+    send = subparsers.add_parser("send", help="发送已生成的开发信")
+    send.add_argument("input", help="生成结果文件（.xlsx / .csv / .jsonl / .parquet）")
+    send.add_argument("--outbox", default="../email_output/outbox.sqlite", help="持久化发件箱路径")
+    send.set_defaults(func=cmd_send)
+
+    export = subparsers.add_parser("export", help="把 JSONL 结果存储导出为 Excel / CSV / Parquet")
+    export.add_argument("-s", "--store", default=DEFAULT_STORE, help="JSONL 结果存储路径")
+    export.add_argument("-o", "--output", default=DEFAULT_OUTPUT, help="导出路径，格式按扩展名识别")
+    export.add_argument("--key-field", default="邮箱", help="去重所用的主键字段")
+    export.set_defaults(func=cmd_export)
+
+    suppress = subparsers.add_parser("suppress", help="把地址或整个域名加入退订/退信名单，之后的生成和发送都会跳过")
+    suppress.add_argument("entries", nargs="*", help="邮箱地址，或 @domain.com 表示整个域名")
+    suppress.add_argument("-f", "--file", action="append", help="从文件导入（.txt 每行一个，或带 邮箱/email 列的表格文件）")
+    suppress.add_argument("--reason", default="unsubscribe", help="加入原因，例如 unsubscribe / bounce / complaint")
+    suppress.set_defaults(func=cmd_suppress)
+
+    submit = subparsers.add_parser("submit", help="把活动按分片提交到共享任务队列，由 worker 进程执行")
+    submit.add_argument("input", help="联系人文件；--kind profile 时为网址列表，--kind send 时为生成结果文件")
+    submit.add_argument("--queue", default=DEFAULT_QUEUE, help="共享任务队列（SQLite）路径")
+    submit.add_argument("--campaign", help="活动名称（默认按提交时间生成）")
+    submit.add_argument("--kind", choices=("generate", "profile", "send"), default="generate", help="任务类型")
+    submit.add_argument("--shard-size", type=int, default=500, help="每个任务包含的联系人/网址/邮件数")
+    submit.add_argument("--send", action="store_true", help="每个分片生成完毕后自动提交发送任务")
+    submit.set_defaults(func=cmd_submit)
+
+    worker = subparsers.add_parser("worker", help="启动 worker 进程，从共享任务队列领取任务执行")
+    worker.add_argument("--queue", default=DEFAULT_QUEUE, help="共享任务队列（SQLite）路径")
+    worker.add_argument("--processes", type=int, default=1, help="本机启动的 worker 进程数")
+    worker.add_argument("--kinds", help="只领取这些类型的任务，逗号分隔（generate,profile,send）")
+    worker.add_argument("--concurrency", type=int, default=None, help="每个进程内同时生成的数量（默认按限流配置）")
+    worker.add_argument("--batch-size", type=int, default=1, help="批量模式：每次 LLM 调用为多少个联系人生成邮件")
+    worker.add_argument("--enrich", action="store_true", help="生成前做公司背调")
+    worker.add_argument("--reuse-similar", action="store_true", help="相似公司复用（在每个分片内聚类）")
+    worker.add_argument("--lease", type=int, default=300, help="任务租约时长（秒），worker 失联超过该时长后任务被重新领取")
+    worker.add_argument("--wait", action="store_true", help="队列清空后继续等待新任务，不退出")
+    worker.set_defaults(func=cmd_worker)
+
+    status = subparsers.add_parser("status", help="查看共享任务队列中各活动的进度")
+    status.add_argument("--queue", default=DEFAULT_QUEUE, help="共享任务队列（SQLite）路径")
+    status.add_argument("--campaign", help="只查看指定活动")
+    status.set_defaults(func=cmd_status)
+
+    collect = subparsers.add_parser("collect", help="合并活动中各分片的生成结果")
+    collect.add_argument("--queue", default=DEFAULT_QUEUE, help="共享任务队列（SQLite）路径")
+    collect.add_argument("--campaign", required=True, help="活动名称")
+    collect.add_argument("-o", "--output", default=DEFAULT_OUTPUT, help="导出路径，格式按扩展名识别")
+    collect.set_defaults(func=cmd_collect)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    load_dotenv()
+    try:
+        return args.func(args)
+    finally:
+        # worker 子进程各自导出指标；只读写队列的子命令不需要
+        if args.command not in ("export", "suppress", "submit", "worker", "status", "collect"):
+            export_metrics()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import asyncio
+from urllib.parse import urlparse
+from logger import logger
+from result_store import ResultStore
+from metrics import stage_timer
+
+# 个人邮箱服务商的域名不代表联系人所在公司，不能据此推断公司官网
+FREE_MAIL_DOMAINS = {
+    'gmail.com', 'googlemail.com', 'yahoo.com', 'yahoo.co.uk', 'yahoo.co.jp', 'hotmail.com', 'outlook.com',
+    'live.com', 'msn.com', 'aol.com', 'icloud.com', 'me.com', 'mail.com', 'gmx.com', 'gmx.de', 'web.de',
+    'yandex.ru', 'yandex.com', 'mail.ru', 'protonmail.com', 'proton.me', 'zoho.com',
+    'qq.com', 'foxmail.com', '163.com', '126.com', 'sina.com', 'sohu.com', 'aliyun.com', 'yeah.net', '139.com',
+}
+
+# 联系人表中可能存放公司官网的列名
+WEBSITE_COLUMNS = ('网站', '官网', '公司网站', 'website', 'Website')
+
+
+def _clean_domain(host: str) -> str:
+    host = host.strip().lower().split(':', 1)[0]
+    return host[4:] if host.startswith('www.') else host
+
+
+def company_site(row):
+    """
+    推断联系人所在公司的网站：优先使用官网列，否则取企业邮箱的域名（个人邮箱除外）。
+
+    :return: (域名, 首页 URL)；无法推断时返回 (None, None)。
+    """
+    for column in WEBSITE_COLUMNS:
+        website = str(row.get(column) or '').strip()
+        if website and website.lower() != 'nan':
+            if '://' not in website:
+                website = f"https://{website}"
+            domain = _clean_domain(urlparse(website).netloc)
+            if domain:
+                return domain, website
+
+    email = str(row.get('邮箱') or '').strip()
+    if '@' in email:
+        domain = _clean_domain(email.rsplit('@', 1)[1])
+        if domain and domain not in FREE_MAIL_DOMAINS:
+            return domain, f"https://{domain}/"
+    return None, None
+
+
+class CompanyEnricher:
+    """
+    公司背调（富化）阶段：按公司域名对联系人分组，每家公司只做一次爬取 + LLM 分析，
+    同一公司的其他联系人直接复用结果。
+
+    并发请求同一家公司时共享同一个分析任务；分析结果同时追加写入 store_path，
+    下次运行时直接读取，不再重复背调。所有分析共享一个浏览器池。
+    """
+
+    def __init__(self, max_concurrency=4, pool_size=2, store_path="../email_output/company_profiles.jsonl",
+                 **profiler_kwargs):
+        """
+        :param max_concurrency: 同时背调的公司数上限。
+        :param pool_size: 浏览器池中的浏览器实例数。
+        :param store_path: 公司背调结果存储路径，为 None 时不落盘。
+        :param profiler_kwargs: 透传给 ai_company_profiler_iterative 的参数。
+        """
+        self.profiler_kwargs = {'max_crawls': 3, 'incremental': True, 'speculative': True, **profiler_kwargs}
+        self.pool_size = pool_size
+        self.store = ResultStore(store_path, key_field='domain') if store_path else None
+        self.profiled = 0
+        self.reused = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks = {}
+        self._pool = None
+        self._profiles = {}
+        if self.store:
+            for record in self.store.iter_records():
+                self._profiles[record['domain']] = record
+
+    async def __aenter__(self):
+        from batch_profiler import CrawlerPool
+        self._pool = CrawlerPool(size=self.pool_size)
+        await self._pool.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        if self._pool:
+            await self._pool.__aexit__(exc_type, exc_val, exc_tb)
+        logger.info(f"公司背调：共分析 {self.profiled} 家公司，复用已有结果 {self.reused} 次。")
+        return False
+
+    async def _profile(self, domain, url):
+        from iterative_analysis import ai_company_profiler_iterative
+        async with self._semaphore:
+            async with self._pool.lease() as crawler:
+                try:
+                    with stage_timer('company_profile'):
+                        analysis = await ai_company_profiler_iterative(url, crawler=crawler, **self.profiler_kwargs)
+                except Exception as e:
+                    logger.error(f"背调公司 {domain} 时发生错误: {e}")
+                    analysis = None
+        self.profiled += 1
+        if not analysis or 'error' in analysis:
+            return None
+
+        profile = {
+            'domain': domain,
+            'url': url,
+            'company_summary': analysis.get('company_summary') or '',
+            'potential_pain_points': analysis.get('potential_pain_points') or [],
+        }
+        self._profiles[domain] = profile
+        if self.store:
+            self.store.append(profile)
+        return profile
+
+    async def enrich(self, row):
+        """
+        返回联系人所在公司的背调结果 {'company_summary', 'potential_pain_points'}；无法推断公司网站或背调失败时返回 None。
+        """
+        domain, url = company_site(row)
+        if not domain:
+            return None
+        if domain in self._profiles:
+            self.reused += 1
+            return self._profiles[domain]
+        if domain in self._tasks:
+            self.reused += 1
+        else:
+            self._tasks[domain] = asyncio.create_task(self._profile(domain, url))
+        return await asyncio.shield(self._tasks[domain])
+
+
+def format_pain_points(profile) -> str:
+    """把背调结果中的潜在痛点整理成适合放入 prompt 的文本。"""
+    points = (profile or {}).get('potential_pain_points') or []
+    if isinstance(points, str):
+        return points
+    return "; ".join(str(point) for point in points) or 'N/A'
@@ -0,0 +1,125 @@
+import re
+import hashlib
+from rate_limit import estimate_tokens
+
+_LINK_RE = re.compile(r'(?<!!)\[([^\]]*)\]\(([^)]*)\)')
+_IMAGE_RE = re.compile(r'!\[([^\]]*)\]\([^)]*\)')
+_BARE_URL_RE = re.compile(r'https?://\S+')
+_SPACES_RE = re.compile(r'[ \t 　]+')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+# Cookie 提示、隐私同意等横幅的常见措辞
+_BANNER_RE = re.compile(
+    r'cookie|consent|accept all|reject all|privacy preferences|we use cookies|'
+    r'隐私政策|使用\s*cookie|接受全部|同意并继续',
+    re.IGNORECASE
+)
+# 横幅中单独成行的按钮
+_BANNER_BUTTON_RE = re.compile(
+    r'^(accept|decline|reject|agree|i agree|ok|got it|allow|deny|settings|manage|customi[sz]e|'
+    r'同意|拒绝|接受|知道了|设置)$',
+    re.IGNORECASE
+)
+_SENTENCE_RE = re.compile(r'(?<=[.!?。！？])\s+|\n')
+
+# 语言切换菜单中常见的语言名称
+_LANGUAGE_RE = re.compile(
+    r'^(english|中文|简体中文|繁體中文|deutsch|français|español|italiano|português|русский|日本語|한국어|'
+    r'العربية|türkçe|polski|nederlands|en|zh|de|fr|es|it|pt|ru|ja|ko|ar)$',
+    re.IGNORECASE
+)
+
+
+def _normalize(block: str) -> str:
+    return _SPACES_RE.sub(' ', block).strip().lower()
+
+
+def _is_link_farm(block: str) -> bool:
+    """导航栏、页脚链接列表等：块内文字大部分是链接文本或网址。"""
+    links = _LINK_RE.findall(block)
+    if len(links) < 3:
+        return False
+    text = _LINK_RE.sub('', block)
+    text = _BARE_URL_RE.sub('', text)
+    text = re.sub(r'[\s*\-|•·>/#]+', '', text)
+    link_text = sum(len(label) for label, _ in links)
+    return len(text) < max(link_text, 1) * 0.5
+
+
+def _is_banner(block: str) -> bool:
+    """
+    Cookie / 隐私同意横幅：块较短，且几乎全部由含横幅措辞的句子和按钮组成（至少两处命中）。
+    只是提到 consent 的产品段落、隐私政策链接旁边有联系方式的页脚都不算。
+    """
+    if len(block) >= 600:
+        return False
+    sentences = [part.strip(' *-|•[]') for part in _SENTENCE_RE.split(_LINK_RE.sub(r'\1', block))]
+    sentences = [part for part in sentences if part]
+    hits = banner_chars = 0
+    for sentence in sentences:
+        matches = len(_BANNER_RE.findall(sentence)) + bool(_BANNER_BUTTON_RE.match(sentence))
+        if matches:
+            hits += matches
+            banner_chars += len(sentence)
+    total_chars = sum(len(part) for part in sentences)
+    return hits >= 2 and banner_chars >= total_chars * 0.8
+
+
+def _is_language_menu(block: str) -> bool:
+    items = [item.strip(' *-|•[]') for item in re.split(r'[\n|/•]+', _LINK_RE.sub(r'\1', block))]
+    items = [item for item in items if item]
+    return len(items) >= 2 and sum(1 for item in items if _LANGUAGE_RE.match(item)) >= len(items) * 0.8
+
+
+class PageCleaner:
+    """
+    爬取内容预处理：在交给 LLM 之前去掉网页中与公司业务无关的样板内容。
+
+    同一个 PageCleaner 对应一次公司分析会话，会记住已处理页面中出现过的内容块，
+    导航栏、页脚、Cookie 提示、语言菜单等在每个页面都重复出现的内容只保留第一次出现的那份，
+    此外还会删除链接列表、图片链接，并压缩多余空白。
+    """
+
+    def __init__(self):
+        self._seen_blocks = set()
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def clean(self, markdown: str) -> str:
+        """清洗一个页面的 markdown 并更新 token 统计。"""
+        markdown = str(markdown or '')
+        self.tokens_before += estimate_tokens(markdown)
+
+        text = _IMAGE_RE.sub(lambda m: m.group(1), markdown)
+        kept = []
+        for block in re.split(r'\n\s*\n', text):
+            lines = [_SPACES_RE.sub(' ', line).strip() for line in block.splitlines()]
+            block = "\n".join(line for line in lines if line)
+            if not block:
+                continue
+            if _is_link_farm(block) or _is_banner(block) or _is_language_menu(block):
+                continue
+            # 单独成块的标题保留，方便 LLM 识别页面结构；其余内容块在整个会话中只保留第一次出现的
+            if not (block.startswith('#') and '\n' not in block):
+                digest = hashlib.sha1(_normalize(block).encode('utf-8')).hexdigest()
+                if digest in self._seen_blocks:
+                    continue
+                self._seen_blocks.add(digest)
+            kept.append(block)
+
+        cleaned = _BLANK_LINES_RE.sub('\n\n', "\n\n".join(kept)).strip()
+        self.tokens_after += estimate_tokens(cleaned)
+        return cleaned
+
+    def stats(self) -> dict:
+        """返回清洗前后的 token 估算值及节省比例。"""
+        return {
+            'tokens_before': self.tokens_before,
+            'tokens_after': self.tokens_after,
+            'tokens_saved': self.tokens_saved,
+            'saved_ratio': self.tokens_saved / self.tokens_before if self.tokens_before else 0.0,
+        }
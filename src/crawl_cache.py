@@ -0,0 +1,327 @@
+import os
+import json
+import asyncio
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+import urllib.request
+import urllib.error
+from urllib.parse import urlsplit, urlunsplit
+from logger import logger
+from metrics import get_metrics, stage_timer
+
+# 页面缓存默认保存在项目根目录下的 cache/crawl 文件夹中，可用 CRAWL_CACHE_DIR 指向其他目录（例如离线快照）
+DEFAULT_CRAWL_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache', 'crawl')
+
+
+def _env_flag(key):
+    return os.getenv(key, "").lower() in ("1", "true", "yes")
+
+
+def normalize_url(url: str) -> str:
+    """统一 URL 写法作为缓存键：协议和域名小写，去掉片段和末尾斜杠。"""
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ''))
+
+
+def _header(headers, name):
+    """不区分大小写地读取响应头。"""
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class CrawlCacheMiss(LookupError):
+    """离线模式下请求了缓存中不存在的页面。"""
+
+
+class CachedPage:
+    """缓存命中时返回的页面，提供与 crawl4ai CrawlResult 相同的常用属性。"""
+
+    def __init__(self, url, markdown, status_code=200, response_headers=None, links=None):
+        self.url = url
+        self.markdown = markdown
+        self.status_code = status_code
+        self.response_headers = response_headers or {}
+        self.links = links or {}
+        self.success = True
+        self.from_cache = True
+
+
+class CrawlCache:
+    """
+    内容寻址的页面缓存：SQLite 索引记录 URL → 正文指纹及元数据，正文按 sha256 存为独立文件，
+    内容相同的页面（例如同一网站的多个入口）只保存一份。
+
+    条目超过 TTL 后，若保存了 ETag/Last-Modified，则先发送条件请求重新验证，返回 304 时直接续期，
+    无需重新启动浏览器渲染；正文总大小超过上限时按最近访问时间淘汰。
+    """
+
+    def __init__(self, cache_dir=None, ttl_seconds=24 * 3600, max_bytes=500 * 1024 * 1024,
+                 offline=None, bypass=None):
+        """
+        :param cache_dir: 缓存目录，为 None 时读取环境变量 CRAWL_CACHE_DIR，默认为 cache/crawl。
+        :param ttl_seconds: 缓存有效期（秒），为 None 时永不过期。
+        :param max_bytes: 正文文件总大小上限，为 None 时不限制。
+        :param offline: 离线模式，只读取缓存（忽略 TTL），不访问网络；为 None 时读取环境变量 CRAWL_CACHE_OFFLINE。
+        :param bypass: 是否跳过缓存读取（仍会写入新结果）；为 None 时读取环境变量 CRAWL_CACHE_BYPASS。
+        """
+        self.cache_dir = cache_dir or os.getenv("CRAWL_CACHE_DIR") or DEFAULT_CRAWL_CACHE_DIR
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.offline = _env_flag("CRAWL_CACHE_OFFLINE") if offline is None else offline
+        self.bypass = _env_flag("CRAWL_CACHE_BYPASS") if bypass is None else bypass
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.blob_dir = os.path.join(self.cache_dir, 'blobs')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, 'index.sqlite'), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                body_hash TEXT NOT NULL,
+                status_code INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                metadata TEXT,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_access ON pages(last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_body ON pages(body_hash)")
+        self._conn.commit()
+
+    def _blob_path(self, body_hash):
+        return os.path.join(self.blob_dir, body_hash[:2], f"{body_hash}.md")
+
+    def get(self, url):
+        """读取缓存条目（不检查是否过期）；不存在或正文文件丢失时返回 None。"""
+        key = normalize_url(url)
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM pages WHERE url = ?", (key,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            entry = dict(zip([d[0] for d in cursor.description], row))
+        try:
+            with open(self._blob_path(entry['body_hash']), 'r', encoding='utf-8') as f:
+                entry['markdown'] = f.read()
+        except OSError:
+            logger.warning(f"页面缓存正文文件缺失，视为未命中: {key}")
+            return None
+        entry['metadata'] = json.loads(entry['metadata'] or '{}')
+        return entry
+
+    def is_fresh(self, entry) -> bool:
+        return self.ttl_seconds is None or time.time() - entry['fetched_at'] <= self.ttl_seconds
+
+    def touch(self, url, refreshed=False):
+        """更新最近访问时间；refreshed=True 表示条目已重新验证，同时重置有效期。"""
+        now = time.time()
+        with self._lock:
+            if refreshed:
+                self._conn.execute("UPDATE pages SET fetched_at = ?, last_access = ? WHERE url = ?",
+                                   (now, now, normalize_url(url)))
+            else:
+                self._conn.execute("UPDATE pages SET last_access = ? WHERE url = ?", (now, normalize_url(url)))
+            self._conn.commit()
+
+    def put(self, url, markdown, status_code=200, response_headers=None, links=None):
+        """写入一个页面；正文相同的页面共享同一个正文文件。"""
+        body = str(markdown)
+        body_hash = hashlib.sha256(body.encode('utf-8')).hexdigest()
+        path = self._blob_path(body_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+
+        metadata = json.dumps({'response_headers': response_headers or {}, 'links': links or {}}, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO blobs (hash, size) VALUES (?, ?)",
+                               (body_hash, len(body.encode('utf-8'))))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, body_hash, status_code, etag, last_modified, metadata, "
+                "fetched_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (normalize_url(url), body_hash, status_code, _header(response_headers, 'etag'),
+                 _header(response_headers, 'last-modified'), metadata, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """正文总大小超过上限时，按最近访问时间删除页面条目及不再被引用的正文文件（调用方需持有锁）。"""
+        if self.max_bytes is None:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        oldest = self._conn.execute("SELECT url, body_hash FROM pages ORDER BY last_access ASC").fetchall()
+        for url, body_hash in oldest:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+            still_used = self._conn.execute("SELECT 1 FROM pages WHERE body_hash = ? LIMIT 1", (body_hash,)).fetchone()
+            if still_used:
+                continue
+            size = self._conn.execute("SELECT size FROM blobs WHERE hash = ?", (body_hash,)).fetchone()
+            self._conn.execute("DELETE FROM blobs WHERE hash = ?", (body_hash,))
+            total -= size[0] if size else 0
+            try:
+                os.remove(self._blob_path(body_hash))
+            except OSError:
+                pass
+
+    def revalidate(self, entry, timeout=10) -> bool:
+        """
+        用 ETag/Last-Modified 发送条件请求（阻塞操作，需在线程中调用）。
+
+        :return: 服务器返回 304（页面未变化）时为 True；没有验证信息、页面已变化或请求失败时为 False。
+        """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        if not headers:
+            return False
+        request = urllib.request.Request(entry['url'], headers=headers, method='GET')
+        try:
+            with urllib.request.urlopen(request, timeout=timeout):
+                return False
+        except urllib.error.HTTPError as e:
+            return e.code == 304
+        except (urllib.error.URLError, OSError) as e:
+            logger.debug(f"页面缓存重新验证失败 ({entry['url']}): {e}")
+            return False
+
+    def snapshot(self, dest_dir):
+        """把当前缓存完整复制到 dest_dir，作为离线运行（CRAWL_CACHE_OFFLINE=1）使用的快照。"""
+        os.makedirs(dest_dir, exist_ok=True)
+        with self._lock:
+            target = sqlite3.connect(os.path.join(dest_dir, 'index.sqlite'))
+            try:
+                self._conn.backup(target)
+            finally:
+                target.close()
+            shutil.copytree(self.blob_dir, os.path.join(dest_dir, 'blobs'), dirs_exist_ok=True)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM pages")
+            self._conn.execute("DELETE FROM blobs")
+            self._conn.commit()
+            shutil.rmtree(self.blob_dir, ignore_errors=True)
+            os.makedirs(self.blob_dir, exist_ok=True)
+
+    def stats(self) -> dict:
+        """返回缓存命中统计。"""
+        with self._lock:
+            pages = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            blobs, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'pages': pages,
+            'unique_bodies': blobs,
+            'bytes': size,
+        }
+
+
+_default_cache = None
+
+
+def get_crawl_cache():
+    """获取全局共享的页面缓存实例（首次调用时创建）。"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = CrawlCache()
+    return _default_cache
+
+
+class CachedCrawler:
+    """
+    带页面缓存的爬虫：提供与 AsyncWebCrawler 相同的 arun 接口，命中缓存时不访问网络。
+
+    可以包装一个外部已启动的爬虫（例如 batch_profiler 的浏览器池），也可以不传入爬虫，
+    此时只在第一次缓存未命中时才启动浏览器，全部命中缓存的重跑无需启动浏览器。
+    """
+
+    def __init__(self, crawler=None, cache=None, crawler_factory=None):
+        self.cache = cache or get_crawl_cache()
+        self._crawler = crawler
+        self._owns_crawler = crawler is None
+        self._crawler_factory = crawler_factory
+        self._start_lock = asyncio.Lock()
+
+    async def _get_crawler(self):
+        async with self._start_lock:  # 并发的多个未命中请求只启动一个浏览器
+            if self._crawler is None:
+                if self._crawler_factory is None:
+                    from crawl4ai import AsyncWebCrawler
+                    self._crawler_factory = AsyncWebCrawler
+                crawler = self._crawler_factory()
+                await crawler.start()
+                self._crawler = crawler
+        return self._crawler
+
+    async def arun(self, url, **kwargs):
+        cache = self.cache
+        entry = None if cache.bypass else await asyncio.to_thread(cache.get, url)
+        if entry is not None:
+            fresh = cache.offline or cache.is_fresh(entry)
+            refreshed = False
+            if not fresh and await asyncio.to_thread(cache.revalidate, entry):
+                cache.revalidated += 1
+                fresh = refreshed = True
+            if fresh:
+                cache.hits += 1
+                get_metrics().inc('crawl_cache_total', result='revalidated' if refreshed else 'hit')
+                await asyncio.to_thread(cache.touch, url, refreshed)
+                return CachedPage(url, entry['markdown'], entry['status_code'],
+                                  entry['metadata'].get('response_headers'), entry['metadata'].get('links'))
+        if cache.offline:
+            raise CrawlCacheMiss(f"离线模式下页面缓存中没有 {url}")
+
+        cache.misses += 1
+        get_metrics().inc('crawl_cache_total', result='miss')
+        crawler = await self._get_crawler()
+        with stage_timer('crawl'):
+            result = await crawler.arun(url=url, **kwargs)
+        if result and getattr(result, 'success', True) and result.markdown:
+            await asyncio.to_thread(
+                cache.put, url, result.markdown, getattr(result, 'status_code', None) or 200,
+                getattr(result, 'response_headers', None), getattr(result, 'links', None)
+            )
+        return result
+
+    async def close(self):
+        if self._owns_crawler and self._crawler is not None:
+            await self._crawler.close()
+            self._crawler = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+        return False
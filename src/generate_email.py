@@ -1,23 +1,24 @@
 import os
+import re
+import json
 import asyncio
-import pandas as pd
-from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains.llm import LLMChain
-from logger import logger
+import contextlib
+from logger import logger, log_payload, ProgressReporter
+from result_store import ResultStore
+from table_io import iter_chunks
+from contact_hygiene import ContactHygiene, get_suppression_list
+from llm_stream import EmailStreamParser, IncrementalJSONParser, parse_json, stream_chain
+from rate_limit import get_rate_limiter
+from company_enrichment import CompanyEnricher, format_pain_points
+from quality_gate import QualityGate, quality_gate_enabled
+from metrics import get_metrics, get_metrics_callback, stage_timer
 
-# --- 1. 加载环境变量 ---
-load_dotenv()
-dashscope_api_key = os.getenv("HUNYUAN_API_KEY")
-
-if not dashscope_api_key:
-    logger.error("错误：请确保在 .env 文件中设置了 DASHSCOPE_API_KEY")
-    exit()
+# 产品信息和身份信息默认读取项目根目录下 config 文件夹中的文件
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config')
 
 
 # --- 2. 定义核心功能函数 ---
-def load_product_info(filepath=r"C:\Users\97909\Desktop\EmailAgent\config\product_info.txt"):
+def load_product_info(filepath=os.path.join(CONFIG_DIR, "product_info.txt")):
     """从文本文件中加载产品信息"""
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
@@ -27,7 +28,7 @@ def load_product_info(filepath=r"C:\Users\97909\Desktop\EmailAgent\config\produc
         return None
 
 
-def load_my_info(filepath=r"C:\Users\97909\Desktop\EmailAgent\config\my_info.txt"):
+def load_my_info(filepath=os.path.join(CONFIG_DIR, "my_info.txt")):
     """从文本文件中加载身份信息"""
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
@@ -37,82 +38,257 @@ def load_my_info(filepath=r"C:\Users\97909\Desktop\EmailAgent\config\my_info.txt
         return None
 
 
-def create_email_generation_chain():
-    """创建 LangChain 来生成邮件 (使用通义千问模型)"""
-    logger.info("正在创建 LangChain 邮件生成链...")
-    llm = ChatOpenAI(
-        model="hunyuan-lite",
+def parse_sender_name(my_info) -> str | None:
+    """从身份信息中取出发件人姓名（"name: Chloe" 或 "姓名：xxx" 一行），用于流式生成时识别签名。"""
+    match = re.search(r'^\s*(?:name|姓名)\s*[:：]\s*(.+?)\s*$', my_info or '', re.IGNORECASE | re.MULTILINE)
+    return match.group(1) if match else None
+
+
+# 所有生成请求共用的静态前缀：产品信息、身份信息和写作规范放在最前面且内容固定，
+# 使服务商的 prompt 前缀缓存能够命中；每个联系人不同的内容一律放在其后。
+STATIC_PROMPT_PREFIX = """
+        Your task is to write concise, professional cold emails in English for potential clients. Every email must be entirely in English, including all professional terms and product names.
+        Input:
+        Product Information: {product_info}
+        My Information: {my_info}
+
+        Writing Guidelines:
+        Salutation: Address the contact by name and title.
+        Opening: Show you've done research by referencing their company profile.
+        Value Proposition: Clearly link your product to a specific client problem or a valuable benefit (e.g., increased efficiency, cost savings).
+        Conciseness: Keep the email around 155-200 words.
+        Call to Action: Provide a low-threshold CTA, for example:
+        Please visit our website for the full product list.
+        Are there any products your company needs? If so, please provide the name and specifications.
+        What are your packaging and application requirements?
+        What is the estimated order quantity?
+        Signature: Sign off professionally.
+
+        Note: Strictly use the provided client data. Do not use placeholders like nan or [Optional Content].
+"""
+
+
+def _create_email_llm(use_cache=True, expected_completion_tokens=500):
+    """
+    创建邮件生成所用的 LLM 客户端：优先腾讯混元，配置了通义千问时作为备用服务商（失败转移与对冲请求），
+    可用 EMAIL_LLM_PROVIDERS 调整。在创建时才读取 .env，导入本模块不需要 API Key。
+    """
+    from llm_cache import get_llm_cache
+    from llm_router import create_routed_llm
+    return create_routed_llm(
+        ["hunyuan", "dashscope"],
+        env_key="EMAIL_LLM_PROVIDERS",
         temperature=0.2,
-        api_key=dashscope_api_key,
-        base_url="https://api.hunyuan.cloud.tencent.com/v1"
+        cache=get_llm_cache() if use_cache else False,
+        expected_completion_tokens=expected_completion_tokens,
+        callbacks=[get_metrics_callback()]
     )
 
+
+def create_email_generation_chain(use_cache=True):
+    """
+    创建 LangChain 来生成邮件 (使用通义千问模型)
+
+    :param use_cache: 是否启用持久化 LLM 响应缓存，相同模型参数与输入的请求直接复用已有结果。
+    """
+    from langchain.prompts import PromptTemplate
+    from langchain.chains.llm import LLMChain
+
+    logger.info("正在创建 LangChain 邮件生成链...")
+    llm = _create_email_llm(use_cache)
+
+    prompt_template = STATIC_PROMPT_PREFIX + """
+        Client Information:
+        Company Name: {company_name}
+        Company Profile: {company_info}
+        Company Research: {company_summary}
+        Their Customers' Potential Pain Points: {potential_pain_points}
+        Contact Name: {contact_name}
+        Contact Title: {contact_title}
+
+        Output Format:
+        Subject: [Your email subject]
+        [Your email body]
+    """
+
+    prompt = PromptTemplate(
+        template=prompt_template,
+        input_variables=["product_info", "company_name", "company_info", "company_summary", "potential_pain_points",
+                         "contact_name", "contact_title", "my_info"]
+    )
+
+    return LLMChain(llm=llm, prompt=prompt)
+
+
+def create_batch_email_generation_chain(batch_size=5, use_cache=True):
+    """
+    创建批量生成邮件的 LangChain：一次调用为多个联系人各生成一封邮件，以 JSON 数组输出。
+
+    静态前缀与单封生成链完全相同，每批只需发送一次，摊薄了每封邮件的 token 开销。
+
+    :param batch_size: 每批联系人数量，用于估算输出 token 数。
+    """
+    from langchain.prompts import PromptTemplate
+    from langchain.chains.llm import LLMChain
+
+    logger.info("正在创建 LangChain 批量邮件生成链...")
+    llm = _create_email_llm(use_cache, expected_completion_tokens=350 * batch_size)
+
+    prompt_template = STATIC_PROMPT_PREFIX + """
+        Write one separate email for each client in the JSON list below. Each client has a unique "id".
+        "company_research" and "potential_pain_points", when present, come from researching the client's website.
+        Clients:
+        {contacts_json}
+
+        Output Format:
+        Return only a JSON array with exactly one object per client, in this form:
+        [{{"id": "<client id>", "subject": "<email subject>", "body": "<email body>"}}]
+    """
+
+    prompt = PromptTemplate(
+        template=prompt_template,
+        input_variables=["product_info", "my_info", "contacts_json"]
+    )
+
+    return LLMChain(llm=llm, prompt=prompt)
+
+
+def create_personalization_chain(use_cache=True):
+    """
+    创建基于草稿改写的 LangChain：把同簇公司（简介近似）已生成的邮件改写给另一位联系人。
+
+    prompt 不含产品信息、身份信息和完整写作规范，只有参考草稿和新联系人的资料，输入 token 明显少于完整生成。
+    """
+    from langchain.prompts import PromptTemplate
+    from langchain.chains.llm import LLMChain
+
+    logger.info("正在创建 LangChain 草稿改写链...")
+    llm = _create_email_llm(use_cache)
+
     prompt_template = """
-        Your task is to write a concise, professional cold email in English for a potential client. The email must be entirely in English, including all professional terms and product names.
-        Input:
-        Product Information: {product_info}        
-        My Information: {my_info}        
-        
-        Client Information:        
-        Company Name: {company_name}        
-        Company Profile: {company_info}        
-        Contact Name: {contact_name}       
-        Contact Title: {contact_title}       
-        
-        Writing Guidelines:
-        Salutation: Address the contact by name and title.       
-        Opening: Show you've done research by referencing their company profile.      
-        Value Proposition: Clearly link your product to a specific client problem or a valuable benefit (e.g., increased efficiency, cost savings).    
-        Conciseness: Keep the email around 155-200 words.   
-        Call to Action: Provide a low-threshold CTA, for example:   
-        Please visit our website for the full product list.       
-        Are there any products your company needs? If so, please provide the name and specifications.      
-        What are your packaging and application requirements?       
-        What is the estimated order quantity?       
-        Signature: Sign off professionally.     
-        
+        Rewrite the reference cold email below for a different client whose company is very similar.
+        Keep its product facts, value proposition, call to action and signature. Address the new contact by name
+        and title, use their company name, and rewrite the opening so it references their own company profile.
+        Keep it 155-200 words and entirely in English. Do not use placeholders like nan or [Optional Content].
+
+        Reference Email:
+        Subject: {draft_subject}
+        {draft_body}
+
+        Client Information:
+        Company Name: {company_name}
+        Company Profile: {company_info}
+        Company Research: {company_summary}
+        Contact Name: {contact_name}
+        Contact Title: {contact_title}
+
         Output Format:
-        Subject: [Your email subject]       
+        Subject: [Your email subject]
         [Your email body]
-        
-        Note: Strictly use the provided client data. Do not use placeholders like nan or [Optional Content].
     """
 
     prompt = PromptTemplate(
         template=prompt_template,
-        input_variables=["product_info", "company_name", "company_info", "contact_name", "contact_title", "my_info"]
+        input_variables=["draft_subject", "draft_body", "company_name", "company_info", "company_summary",
+                         "contact_name", "contact_title"]
     )
 
     return LLMChain(llm=llm, prompt=prompt)
 
 
-async def process_contacts(filepath="", chain=None, max_concurrency=5):
-    """异步处理 Excel 文件并为每个联系人生成邮件，然后将结果写入新的 Excel 文件"""
+def validate_batch_item(item, expected_ids, seen=()):
+    """
+    校验批量生成结果中的一条邮件。
+
+    :param expected_ids: 本批联系人 id 集合。
+    :param seen: 已经取得结果的 id，重复的条目视为无效。
+    :return: (id, subject, body)，未通过校验时返回 None。
+    """
+    if not isinstance(item, dict):
+        return None
+    item_id = str(item.get('id', '')).strip()
+    subject = str(item.get('subject') or '').replace('**', '').strip()
+    body = str(item.get('body') or '').replace('**', '').strip()
+    if item_id not in expected_ids or item_id in seen:
+        return None
+    if not subject or not body or re.search(r'\bnan\b', body, re.IGNORECASE):
+        return None
+    return item_id, subject, body
+
+
+def parse_batch_response(response_text: str, expected_ids):
+    """
+    解析批量生成的 JSON 数组，逐条校验。数组被截断或后面跟着多余文字时，已完整输出的条目仍然有效。
+
+    :param expected_ids: 本批联系人 id 集合。
+    :return: {id: (subject, body)}，只包含通过校验的条目。
+    """
+    items = parse_json(response_text, root='[')
+    if items is None:
+        logger.warning("批量生成结果中未找到 JSON 数组。")
+        return {}
+
+    valid = {}
+    for item in items if isinstance(items, list) else []:
+        checked = validate_batch_item(item, expected_ids, valid)
+        if checked:
+            valid[checked[0]] = checked[1:]
+    return valid
+
+
+async def process_contacts(filepath="", chain=None, max_concurrency=None, result_queue=None,
+                           output_filename="../email_output/generated_emails_0827.xlsx",
+                           store_path="../email_output/generated_emails_0827.jsonl", resume=False,
+                           chunk_size=1000, batch_chain=None, batch_size=5, enrich_companies=False,
+                           enrich_concurrency=4, hygiene=None, start_index=0, quality_gate=None,
+                           personalize_chain=None):
+    """
+    异步处理联系人文件（.xlsx / .csv / .jsonl / .parquet）并为每个联系人生成邮件，然后导出结果文件。
+
+    联系人文件按块流式读取，经有界队列分发给固定数量的异步 worker，内存占用与名单长度无关。
+    每封邮件生成后立即追加写入 store_path 指向的 JSONL 结果存储，全部完成后再由存储导出结果文件。
+
+    :param max_concurrency: worker 数量，即同时进行的生成任务数；默认为 chain 实际路由到的各服务商
+                            <NAME>_MAX_CONCURRENCY（未设置时各为 5）之和。
+                            实际在途的 LLM 请求数还会由共享限流层根据 429 与延迟自适应调整。
+    :param result_queue: 可选的 asyncio.Queue。传入后每封邮件生成完毕即放入队列，
+                         供下游（如发送阶段）流水线式消费；结果文件仍会照常导出。
+                         resume 时结果存储中已完成的邮件也会放入队列：上次中断时已生成但还没发送的邮件
+                         不会遗漏，已发送过的由下游的发件箱去重。
+    :param output_filename: 导出的结果文件路径，格式按扩展名识别（Excel 便于人工查看，大批量建议 CSV / Parquet）；
+                            为 None 时只写结果存储，不导出。
+    :param store_path: 逐条落盘的结果存储路径。
+    :param resume: 为 True 时保留已有结果并跳过其中已完成的联系人，否则清空存储重新生成。
+    :param chunk_size: 每次从联系人文件读取的行数。
+    :param batch_chain: 可选的批量生成链（create_batch_email_generation_chain），传入后启用批量模式，
+                        每次调用为 batch_size 个联系人生成邮件，未通过校验的联系人回退到单封生成。
+    :param batch_size: 批量模式下每批的联系人数量。
+    :param enrich_companies: 启用公司背调阶段：按公司域名（官网列或企业邮箱域名）分组，每家公司只爬取分析一次，
+                             把 company_summary 和 potential_pain_points 加入生成邮件的 prompt。
+    :param enrich_concurrency: 同时背调的公司数上限。
+    :param hygiene: 联系人清洗器（ContactHygiene）；默认过滤无效、重复和角色邮箱，并检查全局退订/退信名单。
+    :param start_index: 第一行联系人的序号，结果 id 从 start_index + 1 开始（分片执行时保证 id 全局唯一）。
+    :param quality_gate: 生成后的本地质检（QualityGate）；默认启用（QUALITY_GATE=0 关闭）。未通过的邮件只对该联系人
+                         重新生成，最终仍未通过的在结果中标出 质检问题；resume 时已有结果中未通过的联系人会被重新生成。
+                         各规则的统计写入结果存储旁的 *.quality.json。
+    :param personalize_chain: 可选的草稿改写链（create_personalization_chain），传入后启用相似公司复用：
+                              按公司简介做 MinHash/LSH 聚类，每个簇只有第一位联系人完整生成，其余成员等待该草稿
+                              生成后用较短的改写 prompt 个性化；草稿不可用或改写结果未通过质检时回退到完整生成。
+                              只作用于逐封生成（包括批量模式中回退到单封生成的联系人）。
+    :return: 生成失败的联系人数（读取联系人文件中途出错时未读到的联系人无法计数，另按 1 计）；
+             参数或配置有误、没有开始生成时返回 None。
+    """
     if not chain:
         logger.error("错误：Chain 未初始化。")
         return
 
-    try:
-        df = pd.read_excel(filepath)
-        logger.info(f"成功读取 {len(df)} 条联系人信息。")
-    except FileNotFoundError:
+    if not os.path.exists(filepath):
         logger.error(f"错误：找不到联系人文件 {filepath}。")
         return
-    except Exception as e:
-        logger.error(f"读取 Excel 文件时出错: {e}")
-        return
-
-    df_filtered = df.dropna(subset=['邮箱']).copy()
-    df_filtered['邮箱'] = df_filtered['邮箱'].astype(str).str.strip()
-    df_filtered = df_filtered[df_filtered['邮箱'] != '']
 
-    removed_count = len(df) - len(df_filtered)
-    if removed_count > 0:
-        logger.warning(f"已移除 {removed_count} 条邮箱为空或无效的数据。")
-
-    if df_filtered.empty:
-        logger.warning("处理后没有有效的联系人信息，程序终止。")
-        return
+    if max_concurrency is None:
+        from llm_router import provider_concurrency
+        max_concurrency = provider_concurrency(getattr(chain, 'llm', None)) or get_rate_limiter("hunyuan").concurrency.max_limit
 
     product_info = load_product_info()
     if not product_info:
@@ -120,82 +296,345 @@ async def process_contacts(filepath="", chain=None, max_concurrency=5):
     my_info = load_my_info()
     if not my_info:
         return
-
-    generated_emails = []
-    semaphore = asyncio.Semaphore(max_concurrency)  # 限制并发数量
-
-    async def process_single_contact(index, row):
-        async with semaphore:  # 控制最大并发
-            company_name = row.get('公司名称', 'N/A')
-            company_info = row.get('简介', 'N/A')
-            contact_name = row.get('姓名', 'N/A')
-            contact_email = row.get('邮箱', 'N/A')
-            contact_title = row.get('职务', 'N/A')
-
-            logger.info(f"===== 正在为 {company_name} 的 {contact_name} ({contact_title}) 生成开发信... =====")
-
-            input_data = {
-                'product_info': product_info,
-                'my_info': my_info,
-                'company_name': company_name,
-                'company_info': company_info,
-                'contact_name': contact_name,
-                'contact_title': contact_title
-            }
-
+    sender_name = parse_sender_name(my_info)
+
+    if quality_gate is None and quality_gate_enabled():
+        quality_gate = QualityGate()
+
+    store = ResultStore(store_path)
+    completed = set()
+    redo = set()  # 上次未通过质检、需要跳过缓存重新生成的联系人
+    if resume:
+        if quality_gate:
+            completed, redo = quality_gate.review_store(store)
+        else:
+            completed = store.completed_keys()
+        if completed:
+            logger.info(f"断点续跑：结果存储中已有 {len(completed)} 个已完成的联系人，将跳过这些联系人。")
+    else:
+        store.reset()
+
+    hygiene = hygiene or ContactHygiene(get_suppression_list())
+    similarity = None
+    drafts = {}  # 簇代表的邮箱 -> 其草稿（生成结果记录，不可用时为 None）的 Future
+    if personalize_chain is not None:
+        from similarity import create_similarity_index
+        similarity = create_similarity_index()
+    enricher = CompanyEnricher(max_concurrency=enrich_concurrency) if enrich_companies else None
+
+    async def company_research(row):
+        """返回公司背调得到的 (公司总结, 潜在痛点)；未启用背调或背调失败时为 (None, None)。"""
+        profile = await enricher.enrich(row) if enricher else None
+        if not profile:
+            return None, None
+        return profile.get('company_summary') or None, format_pain_points(profile)
+
+    def make_result(index, row, generated_subject, generated_content):
+        return {
+            'id': index + 1,
+            '公司名称': row.get('公司名称') or 'N/A',
+            '姓名': row.get('姓名') or 'N/A',
+            '职务': row.get('职务') or 'N/A',
+            '邮箱': row.get('邮箱') or 'N/A',
+            '开发信主题': generated_subject,
+            '开发信内容': generated_content
+        }
+
+    async def save_result(result, failures=(), retried=False):
+        """落盘并向下游输出一封生成好的邮件。"""
+        contact_email = result['邮箱']
+        logger.debug(f"邮件已生成 (收件人: {contact_email})，主题: {result['开发信主题']}")
+        log_payload("email", contact_email, result['开发信内容'])  # 正文只抽样存档，不整段写入日志
+
+        if quality_gate:
+            quality_gate.accept(result, failures, retried)
+            if failures:
+                logger.warning(f"{contact_email} 的邮件在重新生成后仍未通过质检: {', '.join(failures)}")
+        try:
+            store.append(result)  # 立即落盘，中断后可断点续跑
+        except Exception:
+            if quality_gate:
+                quality_gate.release(result)  # 没有保存的邮件不占用正文指纹
+            raise
+        get_metrics().inc('emails_generated_total')
+        if result_queue is not None:
+            await result_queue.put(result)  # 有界队列，下游处理不过来时自动反压
+        return result
+
+    async def process_single_contact(index, row, retries=0, leader=None):
+        """
+        为单个联系人生成邮件；retries 为已经重新生成过的次数（批量结果未通过质检、转为单独生成时为 1）。
+        分配到同簇代表、而代表的草稿尚未生成完毕时，转交 follow 在 worker 之外等待，返回 deferred。
+
+        :param leader: 已分配的同簇代表（由 follow 传入，此时草稿已生成完毕）。
+        """
+        company_name = row.get('公司名称') or 'N/A'
+        company_info = row.get('简介') or 'N/A'
+        contact_name = row.get('姓名') or 'N/A'
+        contact_title = row.get('职务') or 'N/A'
+
+        # 该联系人的所有日志（包括背调、LLM 调用）都带上 contact_id，便于在 JSONL 日志中按联系人检索
+        with logger.contextualize(contact_id=row.get('邮箱') or '-'):
+            logger.debug(f"正在为 {company_name} 的 {contact_name} ({contact_title}) 生成开发信...")
+
+            leader_draft = None
             try:
-                response = await chain.ainvoke(input_data)  # 🚀 异步调用
-                full_response = response['text']
-
-                parts = full_response.split('\n\n', 1)
-                generated_subject = "未生成主题"
-                generated_content = full_response
-                print(generated_content)
-                if len(parts) >= 2:
-                    subject_line = parts[0].strip()
-                    generated_content = parts[1].strip()
-
-                    if subject_line.startswith("主题:"):
-                        generated_subject = subject_line[3:].strip()
-                    elif subject_line.startswith("Subject:"):
-                        generated_subject = subject_line[8:].strip()
-
-                generated_subject = generated_subject.replace('**', '').strip()
-                generated_content = generated_content.replace('**', '').strip()
-                logger.success(f"--- 生成的邮件 (收件人: {contact_email}) ---")
-                logger.debug(f"主题: {generated_subject}")
-                logger.debug(f"内容:\n{generated_content}")
-
-                return {
-                    'id': index + 1,
-                    '公司名称': company_name,
-                    '姓名': contact_name,
-                    '职务': contact_title,
-                    '邮箱': contact_email,
-                    '开发信主题': generated_subject,
-                    '开发信内容': generated_content
+                if leader is None and similarity and not retries:
+                    leader = similarity.assign(row.get('邮箱'), company_info)
+                    if leader is None and similarity.is_leader(row.get('邮箱')):
+                        leader_draft = drafts[row.get('邮箱')] = asyncio.get_running_loop().create_future()
+                    elif leader is not None and not drafts[leader].done():
+                        followers.add(asyncio.create_task(follow(index, row, leader)))
+                        return deferred
+                company_summary, pain_points = await company_research(row)
+                input_data = {
+                    'product_info': product_info,
+                    'my_info': my_info,
+                    'company_name': company_name,
+                    'company_info': company_info,
+                    'company_summary': company_summary or 'N/A',
+                    'potential_pain_points': pain_points or 'N/A',
+                    'contact_name': contact_name,
+                    'contact_title': contact_title
                 }
+                fresh = retries > 0 or row.get('邮箱') in redo
+                active_chain, active_input = chain, input_data
+                if leader is not None:
+                    draft = drafts[leader].result()
+                    get_metrics().inc('similarity_reuse_total', outcome='personalized' if draft else 'fallback')
+                    if draft:
+                        active_chain = personalize_chain
+                        active_input = {
+                            'draft_subject': draft['开发信主题'],
+                            'draft_body': draft['开发信内容'],
+                            'company_name': company_name,
+                            'company_info': company_info,
+                            'company_summary': company_summary or 'N/A',
+                            'contact_name': contact_name,
+                            'contact_title': contact_title
+                        }
+                while True:
+                    # 流式生成：签名块输出完毕即停止，模型在签名后附加的说明文字不再生成和计费
+                    parser = EmailStreamParser(sender_name)
+                    if fresh:
+                        from llm_cache import bypass_cache
+                        # 重新生成时跳过缓存，新结果同时覆盖缓存中不合格的旧结果
+                        with bypass_cache():
+                            await stream_chain(active_chain, active_input, parser)
+                    else:
+                        await stream_chain(active_chain, active_input, parser)
+                    result = make_result(index, row, *parser.result())
+                    failures = quality_gate.check(result) if quality_gate else []
+                    if not failures:
+                        break
+                    quality_gate.note_failure(failures)
+                    if not quality_gate.allow_retry(retries):
+                        break
+                    logger.debug(f"{contact_name} 的邮件未通过质检（{', '.join(failures)}），重新生成。")
+                    retries += 1
+                    fresh = True
+                    active_chain, active_input = chain, input_data  # 改写结果不合格时回退到完整生成
+                saved = await save_result(result, failures, retried=retries > 0)
+                if leader_draft is not None and not leader_draft.done():
+                    leader_draft.set_result(None if failures else saved)
+                return saved
 
             except Exception as e:
                 logger.error(f"为 {company_name} 生成邮件时出错: {e}")
                 return None
-
-    # 🔹 并发执行所有任务
-    tasks = [process_single_contact(idx, row) for idx, row in df_filtered.iterrows()]
-    results = await asyncio.gather(*tasks)
-
-    for res in results:
+            finally:
+                # 代表生成失败或未通过质检时，等待中的同簇成员回退到完整生成，之后相似的联系人另立代表
+                if leader_draft is not None and not leader_draft.done():
+                    leader_draft.set_result(None)
+                if leader_draft is not None and leader_draft.result() is None:
+                    similarity.release(row.get('邮箱'))
+
+    async def follow(index, row, leader):
+        """同簇成员在 worker 之外等待代表的草稿，之后占用一个并发名额完成生成，不让等待占住 worker。"""
+        await asyncio.wait([drafts[leader]])
+        async with slots:
+            record(await process_single_contact(index, row, leader=leader))
+
+    async def process_batch(items):
+        """一次调用为一批联系人生成邮件，校验失败的联系人回退到单封生成。"""
+        if len(items) == 1:
+            return [await process_single_contact(*items[0])]
+
+        logger.debug(f"正在批量生成 {len(items)} 封开发信...")
+        generated = {}
+        regenerate = set()
+        try:
+            research = await asyncio.gather(*(company_research(row) for _, row in items))
+            contacts = []
+            for (index, row), (company_summary, pain_points) in zip(items, research):
+                contact = {
+                    'id': str(index + 1),
+                    'company_name': row.get('公司名称') or 'N/A',
+                    'company_profile': row.get('简介') or 'N/A',
+                    'contact_name': row.get('姓名') or 'N/A',
+                    'contact_title': row.get('职务') or 'N/A',
+                }
+                if company_summary:
+                    contact['company_research'] = company_summary
+                    contact['potential_pain_points'] = pain_points
+                contacts.append(contact)
+            expected_ids = {c['id'] for c in contacts}
+            rows = {str(index + 1): (index, row) for index, row in items}
+            consumed = []
+
+            async def save_completed(parser):
+                # 数组中每封邮件一输出完就落盘并交给下游，不必等整批生成结束
+                for item in parser.items[len(consumed):]:
+                    consumed.append(item)
+                    checked = validate_batch_item(item, expected_ids, generated)
+                    if not checked or checked[0] in regenerate:
+                        continue
+                    item_id, subject, body = checked
+                    result = make_result(*rows[item_id], subject, body)
+                    failures = quality_gate.check(result) if quality_gate else []
+                    if failures:
+                        quality_gate.note_failure(failures)
+                        if quality_gate.allow_retry(0):
+                            regenerate.add(item_id)  # 只有这一封转为单独重新生成
+                            continue
+                    generated[item_id] = await save_result(result, failures)
+
+            await stream_chain(batch_chain, {
+                'product_info': product_info,
+                'my_info': my_info,
+                'contacts_json': json.dumps(contacts, ensure_ascii=False, default=str)
+            }, IncrementalJSONParser(root='['), on_chunk=save_completed)
+        except Exception as e:
+            logger.error(f"批量生成邮件时出错: {e}")
+
+        results = []
+        for index, row in items:
+            if str(index + 1) in generated:
+                results.append(generated[str(index + 1)])
+            elif str(index + 1) in regenerate:
+                results.append(await process_single_contact(index, row, retries=1))
+            else:
+                logger.warning(f"批量结果中 {row.get('邮箱')} 的邮件缺失或未通过校验，改为单独生成。")
+                results.append(await process_single_contact(index, row))
+        return results
+
+    # 🔹 生产者/消费者：生产者分块读取联系人，固定数量的 worker 从有界队列中取任务
+    batch_size = batch_size if batch_chain else 1
+    contact_queue = asyncio.Queue(maxsize=max_concurrency * batch_size * 2)
+    counts = {'total': 0, 'removed': 0, 'skipped': 0, 'generated': 0, 'failed': 0, 'read_errors': 0}
+    progress = ProgressReporter("生成开发信")
+    slots = asyncio.Semaphore(max_concurrency)  # worker 与等到草稿的同簇成员共用的并发名额
+    followers = set()  # 正在等待代表草稿的同簇成员任务
+    deferred = object()  # process_single_contact 转交给 follow 处理时的返回值
+
+    def record(res):
+        if res is deferred:
+            return
         if res:
-            generated_emails.append(res)
+            counts['generated'] += 1
+        else:
+            counts['failed'] += 1
+        progress.update(ok=bool(res))
 
-    if generated_emails:
-        output_df = pd.DataFrame(generated_emails)
-        output_filename = "../email_output/generated_emails_0827.xlsx"
+    async def producer():
         try:
-            output_df.to_excel(output_filename, index=False)
-            logger.success(f"\n--- 所有邮件已生成，并成功保存到 {output_filename} ---")
+            chunks = iter_chunks(filepath, chunk_size=chunk_size)
+            while True:
+                # 读取文件是阻塞操作，放到线程中执行，避免卡住正在生成的 worker
+                with stage_timer('contacts_read'):
+                    chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                # 清洗在生成之前进行：无效、重复、角色邮箱和退订/退信名单中的地址不会进入 LLM
+                with stage_timer('contact_hygiene'):
+                    kept = await asyncio.to_thread(hygiene.clean_chunk, chunk)
+                base = start_index + counts['total']
+                counts['total'] += len(chunk)
+                counts['removed'] += len(chunk) - len(kept)
+                for position, row in kept:
+                    if row['邮箱'] in completed:
+                        counts['skipped'] += 1
+                        continue
+                    await contact_queue.put((base + position, row))
         except Exception as e:
-            logger.error(f"\n错误：保存 Excel 文件时出错: {e}")
+            counts['read_errors'] += 1
+            logger.error(f"读取联系人文件时出错: {e}")
+        finally:
+            for _ in range(max_concurrency):
+                await contact_queue.put(None)  # 每个 worker 一个结束信号
+
+    async def worker():
+        while True:
+            item = await contact_queue.get()
+            get_metrics().set_gauge('queue_depth', contact_queue.qsize(), queue='contacts')
+            if item is None:
+                break
+            items = [item]
+            # 批量模式下顺带取走队列中已就绪的联系人，凑成一批（不额外等待）
+            while len(items) < batch_size:
+                try:
+                    extra = contact_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if extra is None:
+                    await contact_queue.put(None)  # 结束信号属于其他 worker，放回队列
+                    break
+                items.append(extra)
+
+            async with slots:
+                results = await process_batch(items)
+            for res in results:
+                record(res)
+
+    async def requeue_completed():
+        records = await asyncio.to_thread(store.latest_records)
+        for key, record in records.items():
+            if key in completed:
+                await result_queue.put(record)
+
+    stages = [producer(), *(worker() for _ in range(max_concurrency))]
+    if completed and result_queue is not None:
+        stages.append(requeue_completed())
+    try:
+        async with enricher or contextlib.nullcontext():
+            await asyncio.gather(*stages)
+            await asyncio.gather(*followers)  # worker 结束后再无新的同簇成员加入
+    finally:
+        for task in followers:
+            task.cancel()
+    if counts['generated'] or counts['failed']:
+        progress.report()
+
+    logger.info(f"成功读取 {counts['total']} 条联系人信息。")
+    hygiene.log_summary()
+    if similarity:
+        similarity.log_summary()
+    if counts['skipped'] > 0:
+        logger.info(f"断点续跑：已跳过 {counts['skipped']} 个已完成的联系人。")
+    failed = counts['failed'] + counts['read_errors']
+    if counts['total'] - counts['removed'] == 0:
+        logger.warning("处理后没有有效的联系人信息，程序终止。")
+        return failed
+    logger.info(f"本次共生成 {counts['generated']} 封邮件。")
+    if counts['failed'] > 0:
+        logger.warning(f"有 {counts['failed']} 个联系人在重试后仍生成失败，可使用 resume 模式重新运行以补齐。")
+
+    from llm_cache import get_llm_cache
+    cache_stats = get_llm_cache().stats()
+    logger.info(f"LLM 缓存命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次。")
+
+    if quality_gate:
+        quality_gate.write_stats(os.path.splitext(store_path)[0] + '.quality.json')
+
+    if not output_filename:
+        return failed
+    try:
+        exported = store.export(output_filename)
+        if exported:
+            logger.success(f"\n--- 所有邮件已生成，共 {exported} 封，并成功保存到 {output_filename} ---")
+    except Exception as e:
+        logger.error(f"\n错误：保存结果文件时出错: {e}")
+    return failed
 
 
 # # --- 3. 主程序入口 --- 调试或分步执行用
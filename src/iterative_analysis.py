@@ -2,28 +2,53 @@ import os
 import asyncio
 import json
 import re
-from urllib.parse import urlparse
-from crawl4ai import AsyncWebCrawler
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from dotenv import load_dotenv
-from logger import logger
-
-# --- 1. 加载环境变量和初始化LLM ---
-load_dotenv()
-ali_api_key = os.getenv("DASHSCOPE_API_KEY")
-
-if not ali_api_key:
-    logger.error("错误：请确保在 .env 文件中设置了 DASHSCOPE_API_KEY")
-    exit()
-
-llm = ChatOpenAI(
-    model="qwen-turbo",
-    temperature=0.2,
-    api_key=ali_api_key,
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-)
+from urllib.parse import urlparse, urljoin
+from logger import logger, log_payload
+from crawl_cache import CachedCrawler, get_crawl_cache, normalize_url
+from rate_limit import estimate_tokens
+from content_cleaner import PageCleaner
+from metrics import get_metrics_callback, export_metrics
+from llm_stream import IncrementalJSONParser, parse_json, stream_chain
+
+# --- 1. LLM 客户端 ---
+# 客户端和各分析链都在首次使用时才创建：导入本模块不读取 .env、不需要 API Key，也不加载 LangChain
+_llm = None
+_chains = {}
+
+
+def get_analysis_llm():
+    """
+    获取背调分析所用的 LLM 客户端，首次调用时创建：优先通义千问，配置了腾讯混元时作为备用服务商，
+    可用 ANALYSIS_LLM_PROVIDERS 调整。
+    """
+    global _llm
+    if _llm is None:
+        from llm_cache import get_llm_cache
+        from llm_router import create_routed_llm
+        _llm = create_routed_llm(
+            ["dashscope", "hunyuan"],
+            env_key="ANALYSIS_LLM_PROVIDERS",
+            temperature=0.2,
+            cache=get_llm_cache(),  # 重复分析同一页面内容时直接复用缓存结果
+            callbacks=[get_metrics_callback()]
+        )
+    return _llm
+
+
+def get_analysis_chain(name):
+    """
+    获取指定的分析链，首次调用时创建。
+
+    :param name: "analysis"、"incremental"、"chunk_summary" 或 "final"，对应 ANALYSIS_PROMPTS 中的 Prompt。
+    """
+    if name not in _chains:
+        from langchain.prompts import PromptTemplate
+        from langchain.chains import LLMChain
+        template, input_variables = ANALYSIS_PROMPTS[name]
+        prompt = PromptTemplate(template=template, input_variables=input_variables)
+        _chains[name] = LLMChain(llm=get_analysis_llm(), prompt=prompt)
+    return _chains[name]
+
 
 # --- 2. 定义LLM分析用的Prompt ---
 
@@ -61,33 +86,269 @@ iterative_analysis_prompt_template = """
         {crawled_content}
         """
 
-analysis_prompt = PromptTemplate(
-    template=iterative_analysis_prompt_template,
-    input_variables=["crawled_content"]
-)
-analysis_chain = LLMChain(llm=llm, prompt=analysis_prompt)
+
+# 增量模式 Prompt: 只携带已有总结和本次新爬取的页面，避免把所有历史页面重复发送
+incremental_analysis_prompt_template = """
+        你是一位专业的市场分析师和智能网页爬虫。我为你提供了你截至目前对该公司的总结，以及本次新爬取的一个页面的内容。
+
+        你的任务是：
+        1.  结合已有总结和新页面内容，更新你对公司核心业务、产品、服务和价值主张的理解。
+        2.  基于分析，判断信息是否足以编写一封高度个性化的开发信（cold email）。
+        3.  如果需要更多信息，请建议下一个最相关的URL子路径（不要重复已访问的页面）。选择最有可能提供详细产品/服务信息的路径（例如，'products', 'solutions', 'services'）。
+        4.  如果信息已足够，请回答 "DONE"，并提供一个最终详细的总结。
+
+        注意：之前页面的原文不会再提供给你，"summary_so_far" 必须是融合了已有总结与新页面信息的完整总结。
+
+        请以结构化的 JSON 格式输出你的响应。
+
+        "继续爬取"的 JSON 输出示例:
+        {{
+            "status": "CONTINUE",
+            "summary_so_far": "该公司似乎是一家 B2B 软件供应商，但具体产品细节尚不清楚。主页提到了 'AI 赋能的解决方案'。",
+            "next_url_path": "/solutions"
+        }}
+
+        "完成爬取"的 JSON 输出示例:
+        {{
+            "status": "DONE",
+            "final_analysis": {{
+                "company_summary": "对公司业务、产品和服务的详细总结。",
+                "target_market": "识别出的目标客户群体（例如：'零售业的中小型企业'）。",
+                "potential_pain_points": ["列出公司产品/服务为其客户解决的问题。", "例如：'低效的库存管理'"]
+            }}
+        }}
+
+        ---
+        已访问的页面:
+        {visited_urls}
+
+        已有总结:
+        {summary_so_far}
+
+        新爬取的页面内容:
+        {new_content}
+        """
+
+
+# 超长页面的 map 阶段 Prompt: 分块提炼要点，再把要点合并后交给分析链
+chunk_summary_prompt_template = """
+        以下是某公司网站一个页面的其中一部分内容。请提取其中与公司业务、产品、服务、目标客户和价值主张相关的关键信息，
+        用简洁的中文要点列出，忽略导航栏、页脚、Cookie 提示等无关内容。
+
+        页面内容:
+        {chunk}
+        """
+
+# 最终分析 Prompt: 基于全部内容（或增量模式下的累积总结）输出完整的背调报告
+final_analysis_prompt_template = """
+    你是一位高级市场分析师。基于从公司网站上爬取的所有内容，你的任务是提供一份最终的、全面的分析报告。
+    你的目标是收集足够的情报，用于撰写一封有针对性的销售邮件。
+
+    请执行以下分析并以 JSON 格式使用中文输出你的报告：
+    1.  **公司总结 (company_summary)**: 简洁地总结公司做什么，其核心产品/服务，以及主要价值主张。
+    2.  **核心业务/产品 (core_products_services)**: 详细描述公司的主要业务线或核心产品/服务。
+    3.  **目标市场 (target_market)**: 描述公司的理想客户画像或目标行业。
+    4.  **潜在痛点 (potential_pain_points)**: 基于其产品/服务，列出其客户可能面临的、而其产品/服务旨在解决的潜在问题或挑战。
+    5.  **潜在合作点 (potential_collaboration_points)**: 基于公司的业务和你的洞察，提出几个可能的合作方向或切入点，用于在开发信中提及。
+
+    已爬取的内容:
+    {all_content}
+
+    请使用以下 JSON 格式提供你的中文输出：
+    {{
+        "company_summary": "...",
+        "core_products_services": "...",
+        "target_market": "...",
+        "potential_pain_points": ["...", "..."],
+        "potential_collaboration_points": ["...", "..."]
+    }}
+    """
+
+# 各分析链的 (Prompt 模板, 输入变量)
+ANALYSIS_PROMPTS = {
+    "analysis": (iterative_analysis_prompt_template, ["crawled_content"]),
+    "incremental": (incremental_analysis_prompt_template, ["visited_urls", "summary_so_far", "new_content"]),
+    "chunk_summary": (chunk_summary_prompt_template, ["chunk"]),
+    "final": (final_analysis_prompt_template, ["all_content"]),
+}
+
+
+def truncate_to_budget(text: str, token_budget: int) -> str:
+    """
+    按估算的 token 数截断文本，尽量在换行处截断。
+    """
+    total_tokens = estimate_tokens(text)
+    if total_tokens <= token_budget:
+        return text
+    max_chars = max(1, int(len(text) * token_budget / total_tokens))
+    cut = text.rfind('\n', 0, max_chars)
+    return text[:cut if cut > max_chars // 2 else max_chars]
+
+
+def split_into_chunks(text: str, token_budget: int):
+    """
+    把文本切分为若干块，每块的估算 token 数不超过 token_budget，尽量在换行处切分。
+    """
+    chunks = []
+    while text:
+        chunk = truncate_to_budget(text, token_budget)
+        chunks.append(chunk)
+        text = text[len(chunk):].lstrip('\n')
+    return chunks
+
+
+async def fit_content_to_budget(content: str, token_budget: int, strategy="map_reduce", max_chunks=8):
+    """
+    使页面内容不超过单次调用的 token 预算。
+
+    :param strategy: "truncate" 直接截断；"map_reduce" 分块并发提炼要点后合并，合并结果仍超出预算时再截断。
+    :param max_chunks: map_reduce 模式下最多处理的分块数，超出部分直接丢弃，以控制成本。
+    """
+    if estimate_tokens(content) <= token_budget:
+        return content
+    if strategy == "truncate":
+        logger.info(f"  -> 页面内容超出单次调用预算 ({token_budget} tokens)，已截断。")
+        return truncate_to_budget(content, token_budget)
+
+    chunks = split_into_chunks(content, token_budget)[:max_chunks]
+    logger.info(f"  -> 页面内容超出单次调用预算 ({token_budget} tokens)，拆分为 {len(chunks)} 块分别提炼。")
+    responses = await asyncio.gather(
+        *(get_analysis_chain("chunk_summary").ainvoke({"chunk": chunk}) for chunk in chunks),
+        return_exceptions=True
+    )
+    summaries = []
+    for chunk, response in zip(chunks, responses):
+        if isinstance(response, Exception):
+            logger.warning(f"  -> 分块提炼失败，改为截断该块: {response}")
+            summaries.append(truncate_to_budget(chunk, token_budget // len(chunks)))
+        else:
+            summaries.append(response['text'])
+    return truncate_to_budget("\n\n".join(summaries), token_budget)
 
 
 def extract_json_from_response(response_text: str):
     """
-    尝试从可能包含额外文本的字符串中提取 JSON 对象。
+    从可能包含额外文本的字符串中提取第一个完整的 JSON 对象（按括号配对扫描，JSON 之后的说明文字不影响解析）。
     """
-    match = re.search(r'\{.*}', response_text, re.DOTALL)
-    if match:
-        json_string = match.group(0)
-        try:
-            return json.loads(json_string)
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON 解析失败: {e}")
-            return None
-    logger.warning("在LLM响应中未找到有效的JSON对象。")
-    return None
+    data = parse_json(response_text)
+    if data is None:
+        logger.warning("在LLM响应中未找到有效的JSON对象。")
+    return data
 
 
-async def ai_company_profiler_iterative(company_url: str, max_crawls=5):
+async def run_json_chain(name, inputs):
+    """
+    以流式方式调用分析链，第一个完整的 JSON 对象输出后立即停止生成，返回解析出的字典（解析失败时为 None）。
+
+    :param name: 分析链名称，见 get_analysis_chain。
+    """
+    parser = IncrementalJSONParser()
+    text = await stream_chain(get_analysis_chain(name), inputs, parser)
+    if parser.value is None:
+        logger.warning("在LLM响应中未找到有效的JSON对象。")
+        log_payload("invalid_json", name, text)
+    return parser.value
+
+
+# 推测预取时用于给候选链接打分的关键词（同时匹配路径和链接文字）
+LINK_KEYWORD_WEIGHTS = {
+    'product': 3, 'solution': 3, 'service': 3, '产品': 3, '解决方案': 3, '服务': 3,
+    'application': 2, 'industr': 2, 'about': 2, 'capabilit': 2, 'technology': 2,
+    '应用': 2, '行业': 2, '关于': 2, '简介': 2, '技术': 2,
+    'company': 1, 'case': 1, 'customer': 1, '案例': 1, '客户': 1,
+    'login': -3, 'signin': -3, 'register': -3, 'cart': -3, 'privacy': -3, 'terms': -3, 'cookie': -3,
+    'career': -2, 'job': -2, 'news': -1, 'blog': -1, 'download': -2, '招聘': -2, '新闻': -1,
+}
+SKIPPED_LINK_SUFFIXES = ('.pdf', '.jpg', '.jpeg', '.png', '.gif', '.svg', '.zip', '.rar', '.doc', '.docx', '.xls',
+                         '.xlsx', '.mp4')
+
+
+def extract_internal_links(crawl_result, page_url: str):
+    """从爬取结果中提取同一站点的链接，返回 [(url, 链接文字)]；优先使用 crawl4ai 的 links，否则解析 markdown。"""
+    links = []
+    for link in (getattr(crawl_result, 'links', None) or {}).get('internal', []):
+        if isinstance(link, dict) and link.get('href'):
+            links.append((link['href'], link.get('text') or ''))
+    if not links:
+        markdown = str(crawl_result.markdown or '')
+        links = [(href, text) for text, href in re.findall(r'(?<!!)\[([^\]]*)\]\(([^)\s]+)', markdown)]
+
+    host = urlparse(page_url).netloc.lower()
+    internal = []
+    for href, text in links:
+        url = urljoin(page_url, href.strip())
+        parsed = urlparse(url)
+        if parsed.scheme in ('http', 'https') and parsed.netloc.lower() == host:
+            internal.append((url.split('#', 1)[0], text.strip()))
+    return internal
+
+
+def rank_candidate_links(links, visited, top_k=3):
+    """按关键词给候选链接打分（本地规则，不调用 LLM），返回得分最高且未访问过的 top_k 个 URL。"""
+    scores = {}
+    for url, text in links:
+        key = normalize_url(url)
+        if key in visited or key in scores:
+            continue
+        path = urlparse(url).path.lower()
+        if path.endswith(SKIPPED_LINK_SUFFIXES):
+            continue
+        haystack = f"{path} {text.lower()}"
+        score = sum(weight for keyword, weight in LINK_KEYWORD_WEIGHTS.items() if keyword in haystack)
+        depth = len([part for part in path.split('/') if part])
+        score -= 0.5 * max(depth - 2, 0)  # 层级过深的页面通常是具体文章或详情页
+        if score > 0:
+            scores[key] = (score, url)
+    ranked = sorted(scores.values(), key=lambda item: item[0], reverse=True)
+    return [url for _, url in ranked[:top_k]]
+
+
+def _cancel_prefetch(prefetched):
+    """取消尚未用到的预取任务；已完成的任务结果已写入页面缓存，之后仍可复用。"""
+    for task in prefetched.values():
+        if task.done():
+            if not task.cancelled():
+                task.exception()  # 取出异常，避免 "Task exception was never retrieved" 警告
+        else:
+            task.cancel()
+    prefetched.clear()
+
+
+def _log_cleaning_stats(cleaner):
+    if cleaner and cleaner.tokens_before:
+        stats = cleaner.stats()
+        logger.info(f"  -> 内容清洗: {stats['tokens_before']} → {stats['tokens_after']} tokens，"
+                    f"节省约 {stats['tokens_saved']} tokens ({stats['saved_ratio']:.0%})")
+
+
+async def ai_company_profiler_iterative(company_url: str, max_crawls=5, incremental=False,
+                                        max_tokens_per_call=6000, oversize_strategy="map_reduce", crawler=None,
+                                        clean_content=True, speculative=False, prefetch_top_k=3):
     """
     使用多轮 AI-driven 爬取和分析，直到LLM认为信息已足够。
+
+    :param incremental: 增量模式。每轮只把已有的 summary_so_far 和新爬取的页面交给 LLM，
+                        而不是累积的全部页面，token 开销随爬取轮数线性而非平方增长。
+    :param max_tokens_per_call: 增量模式下单次 LLM 调用的输入 token 预算。
+    :param oversize_strategy: 增量模式下超长页面的处理方式，"map_reduce"（分块提炼）或 "truncate"（截断）。
+    :param crawler: 可选，复用外部已启动的 AsyncWebCrawler（例如 batch_profiler 中的浏览器池）；
+                    为 None 时仅在页面缓存未命中时才为本次分析启动一个浏览器。
+                    页面均经过 crawl_cache 的页面缓存，重复分析同一网站时不再重新爬取。
+    :param clean_content: 是否在分析前清洗页面内容（去掉导航栏、页脚、Cookie 提示及跨页面重复的内容块）。
+    :param speculative: 推测预取模式。爬取首页后按关键词挑选最可能有价值的站内链接（产品、解决方案、关于等），
+                        在首轮 LLM 分析进行的同时并发预取，LLM 选中的下一个页面通常已经爬取完毕。
+    :param prefetch_top_k: 推测预取模式下预取的页面数。
     """
+    if crawler is None:
+        async with CachedCrawler() as own_crawler:
+            return await ai_company_profiler_iterative(
+                company_url, max_crawls=max_crawls, incremental=incremental,
+                max_tokens_per_call=max_tokens_per_call, oversize_strategy=oversize_strategy, crawler=own_crawler,
+                clean_content=clean_content, speculative=speculative, prefetch_top_k=prefetch_top_k
+            )
+    if not isinstance(crawler, CachedCrawler):
+        crawler = CachedCrawler(crawler)
+
     logger.info(f"===== 正在为公司 {company_url} 进行AI背调 (多轮模式)... =====")
     url_path = urlparse(company_url).path
     if '.' in os.path.basename(url_path):
@@ -101,22 +362,55 @@ async def ai_company_profiler_iterative(company_url: str, max_crawls=5):
     base_url_for_session = f"{parsed_url.scheme}://{parsed_url.netloc}{base_path}"
     logger.info(f"  -> 会话基础URL已设定为: {base_url_for_session}")
 
-    async with AsyncWebCrawler() as crawler:
-        full_content = ""
-        current_url = company_url
-        crawls_count = 0
-        visited_paths = {company_url.strip('/')}
+    full_content = ""
+    summary_so_far = ""
+    latest_page = ""
+    current_url = company_url
+    crawls_count = 0
+    visited_paths = {company_url.strip('/')}
+    cleaner = PageCleaner() if clean_content else None
+    prefetched = {}
 
+    try:
         while crawls_count < max_crawls:
             crawls_count += 1
             logger.info(f"  -> 第 {crawls_count} 次尝试: 爬取 {current_url}")
+            latest_page = ""  # 只放本轮新爬取的页面，上一轮的页面已经体现在 summary_so_far 中
 
             try:
-                crawl_result = await crawler.arun(url=current_url)
-                if crawl_result and crawl_result.markdown:
-                    full_content += f"\n\n--- Content from {current_url} ---\n\n{crawl_result.markdown}"
+                prefetch_task = prefetched.pop(normalize_url(current_url), None)
+                if prefetch_task:
+                    logger.info("  -> 该页面已被预取。")
+                    crawl_result = await prefetch_task
                 else:
-                    logger.warning(f"  -> 爬取 {current_url} 未返回有效内容。")
+                    crawl_result = await crawler.arun(url=current_url)
+                if speculative and crawls_count == 1 and crawl_result and max_crawls > 1:
+                    candidates = rank_candidate_links(
+                        extract_internal_links(crawl_result, current_url),
+                        {normalize_url(url) for url in visited_paths},
+                        top_k=min(prefetch_top_k, max_crawls - 1)
+                    )
+                    for url in candidates:
+                        prefetched[normalize_url(url)] = asyncio.create_task(crawler.arun(url=url))
+                    if candidates:
+                        logger.info(f"  -> 推测预取: {candidates}")
+                page_markdown = crawl_result.markdown if crawl_result else None
+                if page_markdown and cleaner:
+                    page_markdown = cleaner.clean(page_markdown)
+                if page_markdown:
+                    page_content = f"\n\n--- Content from {current_url} ---\n\n{page_markdown}"
+                    if incremental:
+                        # 为 prompt 模板和已有总结预留空间，剩余预算留给新页面
+                        page_budget = max_tokens_per_call - estimate_tokens(
+                            incremental_analysis_prompt_template + summary_so_far
+                        )
+                        latest_page = await fit_content_to_budget(page_content, max(page_budget, 500),
+                                                                  strategy=oversize_strategy)
+                    else:
+                        full_content += page_content
+                else:
+                    logger.warning(f"  -> 爬取 {current_url} 未返回有效内容，不再调用 LLM 分析，使用现有内容进行最终分析。")
+                    break
 
             except Exception as e:
                 logger.error(f"  -> 错误: 爬取 {current_url} 失败: {e}")
@@ -124,8 +418,14 @@ async def ai_company_profiler_iterative(company_url: str, max_crawls=5):
 
             try:
                 logger.info("  -> 正在进行AI分析并决策下一步...")
-                analysis_response = await analysis_chain.ainvoke({"crawled_content": full_content})
-                analysis_data = extract_json_from_response(analysis_response['text'])
+                if incremental:
+                    analysis_data = await run_json_chain("incremental", {
+                        "visited_urls": "\n".join(sorted(visited_paths)),
+                        "summary_so_far": summary_so_far or "（暂无）",
+                        "new_content": latest_page
+                    })
+                else:
+                    analysis_data = await run_json_chain("analysis", {"crawled_content": full_content})
 
                 if analysis_data is None:
                     logger.error("  -> 错误: LLM返回了非JSON格式响应，无法解析。终止循环。")
@@ -133,10 +433,15 @@ async def ai_company_profiler_iterative(company_url: str, max_crawls=5):
 
                 status = analysis_data.get("status")
                 logger.info(f"  -> AI Agent 状态: {status}")
-                logger.info(f"  -> AI Agent 当前总结: {analysis_data.get('summary_so_far', 'N/A')}")
+                # 总结可能很长，日志中只保留摘要，完整内容抽样存档
+                log_payload("profile_summary", company_url, analysis_data.get('summary_so_far', 'N/A'))
+                if analysis_data.get('summary_so_far'):
+                    summary = analysis_data['summary_so_far']
+                    summary_so_far = summary if isinstance(summary, str) else json.dumps(summary, ensure_ascii=False)
 
                 if status == "DONE":
                     logger.success("  -> AI Agent认为信息已足够，正在生成最终报告。")
+                    _log_cleaning_stats(cleaner)
                     return analysis_data.get("final_analysis")
 
                 elif status == "CONTINUE":
@@ -156,44 +461,29 @@ async def ai_company_profiler_iterative(company_url: str, max_crawls=5):
             except Exception as e:
                 logger.error(f"  -> 错误: 分析或决策失败: {e}")
                 break
+    finally:
+        # 正常结束、出错或被取消时都取消未用到的预取任务，不再占用浏览器
+        _cancel_prefetch(prefetched)
+
+    logger.warning("  -> 循环结束，使用现有内容进行最终分析。")
+    _log_cleaning_stats(cleaner)
+    if incremental:
+        # 增量模式下不保留历史页面原文，用累积的总结加最近一个页面做最终分析
+        all_content = f"已有总结:\n{summary_so_far or '（暂无）'}\n\n最近爬取的页面内容:\n{latest_page}"
+    else:
+        all_content = full_content
 
-        logger.warning("  -> 循环结束，使用现有内容进行最终分析。")
-        final_analysis_prompt_template = """
-        你是一位高级市场分析师。基于从公司网站上爬取的所有内容，你的任务是提供一份最终的、全面的分析报告。
-        你的目标是收集足够的情报，用于撰写一封有针对性的销售邮件。
-
-        请执行以下分析并以 JSON 格式使用中文输出你的报告：
-        1.  **公司总结 (company_summary)**: 简洁地总结公司做什么，其核心产品/服务，以及主要价值主张。
-        2.  **核心业务/产品 (core_products_services)**: 详细描述公司的主要业务线或核心产品/服务。
-        3.  **目标市场 (target_market)**: 描述公司的理想客户画像或目标行业。
-        4.  **潜在痛点 (potential_pain_points)**: 基于其产品/服务，列出其客户可能面临的、而其产品/服务旨在解决的潜在问题或挑战。
-        5.  **潜在合作点 (potential_collaboration_points)**: 基于公司的业务和你的洞察，提出几个可能的合作方向或切入点，用于在开发信中提及。
-
-        已爬取的内容:
-        {all_content}
-
-        请使用以下 JSON 格式提供你的中文输出：
-        {{
-            "company_summary": "...",
-            "core_products_services": "...",
-            "target_market": "...",
-            "potential_pain_points": ["...", "..."],
-            "potential_collaboration_points": ["...", "..."]
-        }}
-        """
-        final_analysis_prompt = PromptTemplate(
-            template=final_analysis_prompt_template,
-            input_variables=["all_content"]
-        )
-        final_analysis_chain = LLMChain(llm=llm, prompt=final_analysis_prompt)
+    has_content = (summary_so_far or latest_page) if incremental else full_content
+    if not has_content:
+        logger.error(f"  -> 未能从 {company_url} 获取任何有效内容，跳过最终分析。")
+        return {"error": "未爬取到有效内容"}
 
-        try:
-            final_response = await final_analysis_chain.ainvoke({"all_content": full_content})
-            final_analysis_data = extract_json_from_response(final_response['text'])
-            return final_analysis_data or {"error": "最终分析失败，无法解析。"}
-        except Exception as e:
-            logger.error(f"  -> 最终分析环节发生错误: {e}")
-            return {"error": f"最终分析时发生异常: {e}"}
+    try:
+        final_analysis_data = await run_json_chain("final", {"all_content": all_content})
+        return final_analysis_data or {"error": "最终分析失败，无法解析。"}
+    except Exception as e:
+        logger.error(f"  -> 最终分析环节发生错误: {e}")
+        return {"error": f"最终分析时发生异常: {e}"}
 
 
 def pretty_print_analysis(analysis_data: dict):
@@ -239,7 +529,9 @@ async def run_profiler(url: str):
     """
     执行分析器并打印结果。
     """
-    analysis_result = await ai_company_profiler_iterative(url, max_crawls=3)
+    analysis_result = await ai_company_profiler_iterative(url, max_crawls=3, incremental=True, speculative=True)
+    logger.info(f"页面缓存统计: {get_crawl_cache().stats()}")
+    export_metrics()
     if analysis_result:
         pretty_print_analysis(analysis_result)
     else:
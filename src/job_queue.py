@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from logger import logger
+
+# 任务状态
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue:
+    """
+    基于 SQLite 的共享任务队列：一个活动（campaign）被拆成若干任务，本机的多个 worker 进程或共享存储上的
+    多台机器都可以从中领取任务。
+
+    领取任务时获得一段时间的租约（lease），处理期间由 worker 定期续租；worker 崩溃或失联后租约过期，
+    任务会被其他 worker 重新领取。任务处理函数需要是幂等的（生成按结果存储断点续跑，发送由发件箱去重）。
+    """
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3):
+        """
+        :param lease_seconds: 租约时长（秒），worker 每隔三分之一租约时长续租一次。
+        :param max_attempts: 每个任务最多被领取的次数，超过后标记为 failed。
+        """
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                campaign TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                last_error TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, kind, id)")
+
+    def _transaction(self, func):
+        """在 BEGIN IMMEDIATE 事务中执行 func(conn)，保证多个进程同时领取任务时不会拿到同一个。"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def submit_many(self, campaign, kind, payloads) -> int:
+        """提交一批任务，返回提交的任务数。"""
+        now = time.time()
+        rows = [(campaign, kind, json.dumps(payload, ensure_ascii=False), PENDING, now) for payload in payloads]
+        self._transaction(lambda conn: conn.executemany(
+            "INSERT INTO jobs (campaign, kind, payload, state, updated_at) VALUES (?, ?, ?, ?, ?)", rows
+        ))
+        return len(rows)
+
+    def submit(self, campaign, kind, payload) -> int:
+        return self.submit_many(campaign, kind, [payload])
+
+    def claim(self, worker_id, kinds=None, limit=1) -> list:
+        """
+        领取最多 limit 个待处理任务（包括租约已过期的任务），返回任务字典列表（payload 已解析）。
+
+        :param kinds: 只领取这些类型的任务（generate / profile / send）；为 None 时不限。
+        """
+        kind_filter = f" AND kind IN ({','.join('?' * len(kinds))})" if kinds else ""
+
+        def claim_jobs(conn):
+            now = time.time()
+            # 租约过期且已达到最大尝试次数的任务不再重试
+            conn.execute(
+                "UPDATE jobs SET state = ?, last_error = ?, updated_at = ? "
+                "WHERE state = ? AND lease_expires_at < ? AND attempts >= ?",
+                (FAILED, "租约过期次数过多", now, LEASED, now, self.max_attempts)
+            )
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE (state = ? OR (state = ? AND lease_expires_at < ?))"
+                f"{kind_filter} ORDER BY id LIMIT ?",
+                (PENDING, LEASED, now, *(kinds or ()), limit)
+            ).fetchall()
+            ids = [job_id for (job_id,) in rows]
+            if not ids:
+                return []
+            conn.executemany(
+                "UPDATE jobs SET state = ?, lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?",
+                [(LEASED, worker_id, now + self.lease_seconds, now, job_id) for job_id in ids]
+            )
+            cursor = conn.execute(f"SELECT * FROM jobs WHERE id IN ({','.join('?' * len(ids))})", ids)
+            columns = [d[0] for d in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        jobs = self._transaction(claim_jobs)
+        for job in jobs:
+            job['payload'] = json.loads(job['payload'])
+        return jobs
+
+    def heartbeat(self, worker_id, job_ids) -> int:
+        """为仍在处理的任务续租，返回成功续租的任务数（租约已被他人接管的任务不会续租）。"""
+        now = time.time()
+        return self._transaction(lambda conn: conn.executemany(
+            "UPDATE jobs SET lease_expires_at = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND state = ?",
+            [(now + self.lease_seconds, now, job_id, worker_id, LEASED) for job_id in job_ids]
+        ).rowcount)
+
+    def complete(self, job_id, worker_id, result=None):
+        now = time.time()
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET state = ?, result = ?, last_error = NULL, lease_expires_at = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (DONE, json.dumps(result, ensure_ascii=False, default=str), now, job_id, worker_id)
+        ))
+
+    def fail(self, job_id, worker_id, error) -> str:
+        """
+        记录一次处理失败：未达到最大尝试次数时放回队列，否则标记为 failed。
+
+        :return: 更新后的状态（pending 或 failed）。
+        """
+        def mark(conn):
+            row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            state = PENDING if row and row[0] < self.max_attempts else FAILED
+            conn.execute(
+                "UPDATE jobs SET state = ?, last_error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ?",
+                (state, f"{type(error).__name__}: {error}", time.time(), job_id, worker_id)
+            )
+            return state
+        return self._transaction(mark)
+
+    def active_count(self, kinds=None) -> int:
+        """待处理和处理中的任务数；为 0 时队列已处理完毕。"""
+        kind_filter = f" AND kind IN ({','.join('?' * len(kinds))})" if kinds else ""
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE state IN (?, ?){kind_filter}", (PENDING, LEASED, *(kinds or ()))
+            ).fetchone()[0]
+
+    def counts(self, campaign=None) -> dict:
+        """各类型任务按状态的数量：{kind: {state: count}}。"""
+        query = "SELECT kind, state, COUNT(*) FROM jobs"
+        params = ()
+        if campaign:
+            query += " WHERE campaign = ?"
+            params = (campaign,)
+        counts = {}
+        with self._lock:
+            for kind, state, count in self._conn.execute(query + " GROUP BY kind, state", params):
+                counts.setdefault(kind, {})[state] = count
+        return counts
+
+    def finished_jobs(self, campaign, kind) -> list:
+        """已完成的任务（payload 与 result 已解析），按提交顺序排列。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, payload, result FROM jobs WHERE campaign = ? AND kind = ? AND state = ? ORDER BY id",
+                (campaign, kind, DONE)
+            ).fetchall()
+        return [{'id': job_id, 'payload': json.loads(payload), 'result': json.loads(result) if result else None}
+                for job_id, payload, result in rows]
+
+    def campaigns(self) -> list:
+        with self._lock:
+            return [c for (c,) in self._conn.execute("SELECT DISTINCT campaign FROM jobs ORDER BY campaign")]
+
+    def close(self):
+        self._conn.close()
+
+
+def log_queue_summary(queue, campaign=None):
+    for kind, states in sorted(queue.counts(campaign).items()):
+        details = "，".join(f"{state} {count}" for state, count in sorted(states.items()))
+        logger.info(f"[{kind}] {details}")
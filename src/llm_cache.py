@@ -0,0 +1,157 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import contextvars
+from contextlib import contextmanager
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from logger import logger
+
+# 缓存文件默认保存在项目根目录下的 cache 文件夹中
+cache_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cache')
+DEFAULT_CACHE_PATH = os.path.join(cache_dir, "llm_cache.sqlite")
+
+# 当前上下文是否跳过缓存读取（仍会写入新结果），用于强制重新生成
+_bypass_var = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+
+@contextmanager
+def bypass_cache():
+    """
+    在该上下文内发起的 LLM 调用跳过缓存读取并用新结果覆盖旧缓存。
+    """
+    token = _bypass_var.set(True)
+    try:
+        yield
+    finally:
+        _bypass_var.reset(token)
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    基于 SQLite 的持久化 LLM 响应缓存，可直接作为 ChatOpenAI(cache=...) 使用。
+
+    缓存键由 LangChain 传入的 llm_string（包含模型名、temperature 等调用参数）
+    和渲染后的完整 prompt（即 prompt 模板 + 输入变量）共同决定。
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, ttl_seconds=7 * 24 * 3600, max_entries=50000, bypass=None):
+        """
+        :param ttl_seconds: 缓存有效期（秒），为 None 时永不过期。
+        :param max_entries: 最多保留的条目数，超出后按最近访问时间淘汰。
+        :param bypass: 是否跳过缓存读取；为 None 时读取环境变量 LLM_CACHE_BYPASS。
+        """
+        if bypass is None:
+            bypass = os.getenv("LLM_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                llm_string TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def _make_key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str):
+        if self.bypass or _bypass_var.get():
+            self.misses += 1
+            return None
+
+        key = self._make_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+
+        try:
+            generations = loads(row[0])
+        except Exception as e:
+            logger.warning(f"LLM 缓存条目反序列化失败，视为未命中: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        key = self._make_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, llm_string, value, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, llm_string, dumps(return_val), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """按 TTL 删除过期条目，并在超出容量时淘汰最久未访问的条目（调用方需持有锁）。"""
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        if self.max_entries is not None:
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """返回缓存命中统计。"""
+        total = self.hits + self.misses
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': size,
+        }
+
+
+_default_cache = None
+
+
+def get_llm_cache():
+    """获取全局共享的 LLM 缓存实例（首次调用时创建）。"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SQLiteLLMCache()
+    return _default_cache
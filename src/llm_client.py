@@ -0,0 +1,58 @@
+from contextlib import aclosing
+from typing import Optional
+from langchain_openai import ChatOpenAI
+from rate_limit import get_rate_limiter, estimate_tokens
+
+
+def _total_tokens(result):
+    """从 ChatResult 中读取服务端返回的实际 token 用量。"""
+    usage = (result.llm_output or {}).get('token_usage') or {}
+    return usage.get('total_tokens')
+
+
+class RateLimitedChatOpenAI(ChatOpenAI):
+    """
+    接入共享限流层的 ChatOpenAI：真正发往服务商的请求都会经过 RPM/TPM 令牌桶、
+    自适应并发控制和退避重试。命中 LLM 缓存的请求不会走到这里，因此不占用配额。
+    """
+
+    rate_limiter_name: str = "default"
+    """限流器名称，同名的客户端共享同一组配额（见 rate_limit.get_rate_limiter）。"""
+
+    expected_completion_tokens: int = 500
+    """预估的单次输出 token 数，与输入估算值一起用于 TPM 限流。"""
+
+    limiter_max_retries: Optional[int] = None
+    """覆盖限流层的最大重试次数；为 None 时使用限流器的配置（见 llm_router 中的失败转移）。"""
+
+    def estimate_request_tokens(self, messages) -> int:
+        return sum(estimate_tokens(m.content) for m in messages) + self.expected_completion_tokens
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        limiter = get_rate_limiter(self.rate_limiter_name)
+        estimated = self.estimate_request_tokens(messages)
+        return await limiter.call(
+            lambda: super(RateLimitedChatOpenAI, self)._agenerate(
+                messages, stop=stop, run_manager=run_manager, **kwargs
+            ),
+            estimated_tokens=estimated,
+            usage_getter=_total_tokens,
+            max_retries=self.limiter_max_retries,
+        )
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        """
+        流式请求同样经过限流层：收到第一块输出之前的限流和临时错误按退避重试，
+        之后出错直接抛出（已输出的内容无法撤回），由路由层失败转移。
+        """
+        limiter = get_rate_limiter(self.rate_limiter_name)
+        stream = limiter.stream(
+            lambda: super(RateLimitedChatOpenAI, self)._astream(
+                messages, stop=stop, run_manager=run_manager, **kwargs
+            ),
+            estimated_tokens=self.estimate_request_tokens(messages),
+            max_retries=self.limiter_max_retries,
+        )
+        async with aclosing(stream):  # 调用方提前结束时立即归还限流名额
+            async for chunk in stream:
+                yield chunk
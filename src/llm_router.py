@@ -0,0 +1,338 @@
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from dotenv import load_dotenv
+from langchain_core.language_models.chat_models import BaseChatModel
+from pydantic import PrivateAttr
+from logger import logger
+from metrics import get_metrics
+from rate_limit import get_rate_limiter
+
+# 已知的 OpenAI 兼容服务商：API Key、base URL 和默认模型都可以用环境变量覆盖，例如 HUNYUAN_MODEL
+PROVIDERS = {
+    "hunyuan": {
+        "model": "hunyuan-lite",
+        "base_url": "https://api.hunyuan.cloud.tencent.com/v1",
+    },
+    "dashscope": {
+        "model": "qwen-turbo",
+        "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+    },
+}
+
+
+class ProviderStats:
+    """单个服务商的运行统计：延迟的指数加权均值、最近的延迟样本（用于对冲阈值）以及连续失败次数。"""
+
+    def __init__(self, alpha=0.2, window=200):
+        self.alpha = alpha
+        self.ewma = None
+        self.samples = deque(maxlen=window)
+        self.consecutive_errors = 0
+        self.last_error_at = 0.0
+
+    def record_success(self, latency):
+        self.ewma = latency if self.ewma is None else self.alpha * latency + (1 - self.alpha) * self.ewma
+        self.samples.append(latency)
+        self.consecutive_errors = 0
+
+    def record_error(self):
+        self.consecutive_errors += 1
+        self.last_error_at = time.monotonic()
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class RouterChatModel(BaseChatModel):
+    """
+    多服务商路由：把请求分发给当前预计最快的服务商，出错时依次失败转移到其他服务商；
+    请求耗时超过该服务商近期延迟的 hedge_quantile 分位数时，再向下一个服务商（只有一个服务商时向同一个）
+    发出一个对冲请求，先返回的结果生效，另一个请求随即取消。
+
+    预计耗时 = 延迟 EWMA × (1 + 当前负载) × 失败惩罚 + 限流层按剩余配额估算的排队时间。
+    对冲请求会额外消耗配额，占全部请求的比例不超过 max_hedge_ratio。
+
+    LLM 缓存和回调都挂在路由层，底层模型直接调用，不会重复缓存或重复计量。
+    """
+
+    models: list
+    """底层模型（RateLimitedChatOpenAI），排在前面的在没有统计数据时优先使用。"""
+
+    hedge: bool = True
+    """是否启用对冲请求。"""
+
+    hedge_quantile: float = 0.95
+    """对冲阈值取服务商近期延迟的分位数。"""
+
+    initial_hedge_delay: float = 10.0
+    """样本不足 min_samples 时使用的对冲阈值（秒）。"""
+
+    min_hedge_delay: float = 0.5
+    """对冲阈值下限（秒），避免延迟很低时频繁对冲。"""
+
+    min_samples: int = 20
+    """计算延迟分位数所需的最少样本数。"""
+
+    max_hedge_ratio: float = 0.1
+    """对冲请求占全部请求的比例上限。"""
+
+    error_cooldown: float = 30.0
+    """服务商出错后受到降权惩罚的时长（秒）。"""
+
+    explore_ratio: float = 0.05
+    """随机选择非最优服务商的比例，使各服务商的延迟统计保持更新。"""
+
+    _stats: dict = PrivateAttr(default_factory=dict)
+    _requests: int = PrivateAttr(default=0)
+    _hedges: int = PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self) -> str:
+        return "router"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {
+            "model_name": "+".join(self._model_name(m) for m in self.models),
+            "models": [m._identifying_params for m in self.models],
+        }
+
+    @staticmethod
+    def _model_name(model) -> str:
+        return getattr(model, 'model_name', None) or getattr(model, 'model', None) or type(model).__name__
+
+    @staticmethod
+    def _provider(model) -> str:
+        return getattr(model, 'rate_limiter_name', None) or RouterChatModel._model_name(model)
+
+    def _provider_stats(self, model) -> ProviderStats:
+        key = self._provider(model)
+        if key not in self._stats:
+            self._stats[key] = ProviderStats()
+        return self._stats[key]
+
+    def _expected_seconds(self, model, messages) -> float:
+        stats = self._provider_stats(model)
+        latency = stats.ewma if stats.ewma is not None else 1.0
+        if stats.consecutive_errors and time.monotonic() - stats.last_error_at < self.error_cooldown:
+            latency *= 1 + 4 * stats.consecutive_errors
+        try:
+            limiter = get_rate_limiter(self._provider(model))
+        except RuntimeError:  # 不在事件循环中（同步调用）
+            return latency
+        estimate = getattr(model, 'estimate_request_tokens', None)
+        estimated_tokens = estimate(messages) if estimate else 0
+        return latency * (1 + limiter.load) + limiter.estimated_wait(estimated_tokens)
+
+    def _ranked(self, messages) -> list:
+        """按预计耗时从短到长排列服务商；同分时保持配置顺序。"""
+        ranked = sorted(self.models, key=lambda m: self._expected_seconds(m, messages))
+        if len(ranked) > 1 and random.random() < self.explore_ratio:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def _hedge_delay(self, model) -> float:
+        stats = self._provider_stats(model)
+        if len(stats.samples) < self.min_samples:
+            return self.initial_hedge_delay
+        return max(self.min_hedge_delay, stats.quantile(self.hedge_quantile))
+
+    def _can_hedge(self) -> bool:
+        return self.hedge and self._hedges < self.max_hedge_ratio * max(self._requests, 1)
+
+    async def _timed_call(self, model, messages, stop, **kwargs):
+        start = time.monotonic()
+        result = await model._agenerate(messages, stop=stop, **kwargs)
+        self._provider_stats(model).record_success(time.monotonic() - start)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        metrics = get_metrics()
+        self._requests += 1
+        candidates = self._ranked(messages)
+        pending = {}
+        last_error = None
+        hedge_task = None
+
+        def launch(model, reason):
+            task = asyncio.create_task(self._timed_call(model, messages, stop, **kwargs))
+            pending[task] = model
+            metrics.inc('llm_router_requests_total', provider=self._provider(model), reason=reason)
+
+            return task
+
+        launch(candidates.pop(0), 'primary')
+        try:
+            while pending:
+                timeout = None
+                if hedge_task is None and self._can_hedge():
+                    timeout = self._hedge_delay(next(iter(pending.values())))
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # 首个请求超过对冲阈值仍未返回：向下一个服务商发出对冲请求，只有一个服务商时发给同一个
+                    self._hedges += 1
+                    hedge_task = launch(candidates.pop(0) if candidates else self.models[0], 'hedge')
+                    continue
+
+                for task in done:
+                    model = pending.pop(task)
+                    if task.exception() is None:
+                        if task is hedge_task:
+                            metrics.inc('llm_router_hedge_wins_total', provider=self._provider(model))
+                        return task.result()
+                    last_error = task.exception()
+                    self._provider_stats(model).record_error()
+                    metrics.inc('llm_router_errors_total', provider=self._provider(model),
+                                error=type(last_error).__name__)
+
+                if not pending and candidates:
+                    model = candidates.pop(0)
+                    logger.warning(f"[router] 请求失败 ({type(last_error).__name__}: {last_error})，"
+                                   f"转移到 {self._provider(model)}。")
+                    launch(model, 'failover')
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        raise last_error
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        """
+        流式调用：选用预计最快的服务商；在收到第一块输出之前出错时失败转移到下一个服务商，
+        之后出错则直接抛出（已输出的内容无法撤回）。流式请求不做对冲。
+        """
+        metrics = get_metrics()
+        self._requests += 1
+        last_error = None
+        for attempt, model in enumerate(self._ranked(messages)):
+            provider = self._provider(model)
+            if attempt:
+                logger.warning(f"[router] 流式请求失败 ({type(last_error).__name__}: {last_error})，转移到 {provider}。")
+            metrics.inc('llm_router_requests_total', provider=provider, reason='failover' if attempt else 'primary')
+            start = time.monotonic()
+            stream = model._astream(messages, stop=stop, **kwargs)
+            try:
+                first = await anext(stream)
+            except StopAsyncIteration:
+                self._provider_stats(model).record_success(time.monotonic() - start)
+                return
+            except Exception as e:
+                await stream.aclose()
+                last_error = e
+                self._provider_stats(model).record_error()
+                metrics.inc('llm_router_errors_total', provider=provider, error=type(e).__name__)
+                continue
+
+            try:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+            except Exception:
+                self._provider_stats(model).record_error()
+                raise
+            else:
+                self._provider_stats(model).record_success(time.monotonic() - start)
+            finally:
+                await stream.aclose()
+            return
+        raise last_error
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        """同步调用：按配置顺序依次尝试各服务商，不做对冲。"""
+        last_error = None
+        for model in self.models:
+            try:
+                return model._generate(messages, stop=stop, **kwargs)
+            except Exception as e:
+                last_error = e
+                logger.warning(f"[router] {self._provider(model)} 请求失败 ({type(e).__name__}: {e})，"
+                               f"尝试下一个服务商。")
+        raise last_error
+
+    def stats(self) -> dict:
+        return {
+            'requests': self._requests,
+            'hedges': self._hedges,
+            'providers': {name: {'ewma_seconds': round(s.ewma, 3) if s.ewma is not None else None,
+                                 'p95_seconds': s.quantile(0.95), 'consecutive_errors': s.consecutive_errors}
+                          for name, s in self._stats.items()},
+        }
+
+
+def provider_concurrency(llm) -> int | None:
+    """
+    返回 LLM 客户端（路由层或单个 RateLimitedChatOpenAI）实际使用的各服务商并发上限（<NAME>_MAX_CONCURRENCY）之和，
+    用作生成任务数的默认值；不是经过限流层的客户端时返回 None。需在事件循环中调用。
+    """
+    models = getattr(llm, 'models', None) or [llm]
+    names = dict.fromkeys(name for name in (getattr(m, 'rate_limiter_name', None) for m in models) if name)
+    if not names:
+        return None
+    return sum(get_rate_limiter(name).concurrency.max_limit for name in names)
+
+
+def _env_float(key, default):
+    try:
+        return float(os.getenv(key) or default)
+    except ValueError:
+        logger.warning(f".env 文件中的 {key} 值无效，已使用默认值 {default}。")
+        return default
+
+
+def create_routed_llm(providers, temperature=0.2, cache=None, callbacks=None, expected_completion_tokens=500,
+                      env_key=None) -> BaseChatModel:
+    """
+    按服务商列表创建带失败转移和对冲请求的 LLM 客户端。
+
+    服务商列表可以用环境变量 env_key 覆盖（逗号分隔，例如 EMAIL_LLM_PROVIDERS=hunyuan,dashscope）；
+    未设置 API Key（<NAME>_API_KEY）的服务商会被跳过。LLM_HEDGE=0 关闭对冲请求，
+    LLM_HEDGE_AFTER 设置样本不足时的对冲阈值（秒）。
+
+    :param providers: 默认的服务商名称列表，排在前面的优先。
+    :param cache: 传给路由层的 LLM 缓存。
+    :param callbacks: 传给路由层的回调（例如指标回调）。
+    """
+    from llm_client import RateLimitedChatOpenAI
+
+    load_dotenv()
+    if env_key and os.getenv(env_key):
+        providers = [p.strip().lower() for p in os.getenv(env_key).split(',') if p.strip()]
+
+    configured = [name for name in providers if os.getenv(f"{name.upper()}_API_KEY")]
+    models = []
+    for name in configured:
+        config = PROVIDERS.get(name, {})
+        prefix = name.upper()
+        models.append(RateLimitedChatOpenAI(
+            model=os.getenv(f"{prefix}_MODEL") or config.get("model"),
+            temperature=temperature,
+            api_key=os.getenv(f"{prefix}_API_KEY"),
+            base_url=os.getenv(f"{prefix}_BASE_URL") or config.get("base_url"),
+            max_retries=0,  # 重试交给共享限流层统一处理（带退避并感知 429）
+            stream_usage=True,  # 流式输出完整结束时由服务端返回实际 token 用量
+            rate_limiter_name=name,
+            expected_completion_tokens=expected_completion_tokens,
+            # 有备用服务商时限流层只重试一次，之后尽快转移到其他服务商
+            limiter_max_retries=1 if len(configured) > 1 else None,
+        ))
+    if not models:
+        keys = ", ".join(f"{p.upper()}_API_KEY" for p in providers)
+        raise RuntimeError(f"请确保在 .env 文件中至少设置了以下之一: {keys}")
+    if len(configured) < len(providers):
+        logger.debug(f"LLM 路由: 部分服务商未配置 API Key，实际使用 {configured}。")
+
+    return RouterChatModel(
+        models=models,
+        hedge=os.getenv("LLM_HEDGE", "1").lower() not in ("0", "false", "no"),
+        initial_hedge_delay=_env_float("LLM_HEDGE_AFTER", 10.0),
+        cache=cache,
+        callbacks=callbacks,
+    )
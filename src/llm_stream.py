@@ -0,0 +1,271 @@
+import os
+import re
+import json
+from logger import logger
+from metrics import get_metrics
+
+# 邮件签名前单独成行的结束语（可带逗号和署名，如 "Best regards, Chloe"）；同一行或下一行出现发件人姓名时
+# 才视为签名开始，读完签名块即可停止生成。正文中单独成行的 "Thanks!" 之类不会被误认为签名
+SIGN_OFF_PATTERN = re.compile(
+    r'^(?:(?:(?:best|kind|warm|warmest|with\s+best)\s+)?(?:regards|wishes)'
+    r'|(?:yours\s+)?(?:sincerely|truly|faithfully)'
+    r'|best|cheers|thanks|many\s+thanks|thank\s+you'
+    r'|此致|敬礼|祝好|顺祝商祺)\s*(?:[,，!！]\s*.{0,40})?$',
+    re.IGNORECASE
+)
+SUBJECT_PREFIXES = ("subject line:", "subject:", "主题:", "主题：")
+
+
+def streaming_enabled() -> bool:
+    """是否以流式方式调用 LLM，可用环境变量 LLM_STREAMING=0 关闭。"""
+    return os.getenv("LLM_STREAMING", "1").lower() not in ("0", "false", "no")
+
+
+class IncrementalJSONParser:
+    """
+    增量 JSON 解析：逐块喂入 LLM 输出，按括号深度（跳过字符串内的括号和转义）找出第一个完整的 JSON 值，
+    取代对整段输出做贪婪正则匹配。JSON 前后的说明文字会被忽略；某段候选文本不是合法 JSON 时从下一个起始括号重新扫描。
+
+    root 为 '[' 时，数组中的每个对象一闭合就解析出来放入 items，数组还没输出完就可以交给下游。
+    """
+
+    def __init__(self, root='{'):
+        self.root = root
+        self.value = None
+        self.done = False
+        self.items = []
+        self._buffer = ''
+        self._pos = 0
+        self._reset()
+
+    def _reset(self):
+        self._start = None
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._item_start = None
+
+    def feed(self, text):
+        if self.done or not text:
+            return
+        self._buffer += text
+        buffer = self._buffer
+        while self._pos < len(buffer) and not self.done:
+            char = buffer[self._pos]
+            if self._start is None:
+                if char == self.root:
+                    self._start = self._pos
+                    self._stack.append(char)
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._stack.append(char)
+                if self.root == '[' and len(self._stack) == 2 and char == '{':
+                    self._item_start = self._pos
+            elif char in '}]':
+                if not self._stack or self._stack[-1] != ('{' if char == '}' else '['):
+                    self._restart()  # 括号不匹配：当前候选不是合法 JSON
+                    continue
+                self._stack.pop()
+                if self._item_start is not None and len(self._stack) == 1:
+                    self._add_item(buffer[self._item_start:self._pos + 1])
+                    self._item_start = None
+                if not self._stack:
+                    candidate = buffer[self._start:self._pos + 1]
+                    try:
+                        self.value = json.loads(candidate)
+                        self.done = True
+                    except json.JSONDecodeError:
+                        self._restart()
+                        continue
+            self._pos += 1
+
+    def _add_item(self, text):
+        try:
+            self.items.append(json.loads(text))
+        except json.JSONDecodeError:
+            logger.debug(f"流式解析: 数组元素不是合法 JSON，已跳过: {text[:80]}")
+
+    def _restart(self):
+        """从当前候选起点之后的下一个起始括号重新扫描；已解析出的数组元素保留。"""
+        self._pos = self._start + 1
+        self._reset()
+
+    def result(self):
+        """返回解析出的 JSON 值；输出被截断时，数组模式退回已完整解析的元素。"""
+        if self.value is not None:
+            return self.value
+        if self.root == '[' and self.items:
+            return list(self.items)
+        return None
+
+
+def parse_json(text, root='{'):
+    """从可能包含额外文本的 LLM 输出中解析出第一个完整的 JSON 对象（root='['时为数组）。"""
+    parser = IncrementalJSONParser(root)
+    parser.feed(text)
+    return parser.result()
+
+
+class EmailStreamParser:
+    """
+    增量解析生成的邮件：第一行非空内容若带 "Subject:" / "主题:" 前缀即为主题，其余为正文。
+
+    正文中出现单独成行的结束语（Best regards、Sincerely 等），且结束语同一行或下一个非空行包含发件人姓名时，
+    再读完签名块（遇到空行或超过 max_signature_lines 行）即视为邮件完整，此时 done 为 True，调用方可以停止生成；
+    签名之后模型附加的说明文字也被丢弃。结束语后面不是发件人姓名时按正文继续解析。
+
+    :param sender_name: 发件人姓名（见 generate_email.parse_sender_name）；为空时无法确认签名，不提前停止。
+    """
+
+    def __init__(self, sender_name=None, max_signature_lines=6):
+        self.sender_name = (sender_name or '').strip().lower() or None
+        self.max_signature_lines = max_signature_lines
+        self.subject = None
+        self.done = False
+        self._lines = []
+        self._pending = ''
+        self._seen_first_line = False
+        self._awaiting_name = False  # 已出现结束语，等待下一个非空行确认发件人姓名
+        self._signature_lines = None  # 确认签名后开始计数
+
+    def feed(self, text):
+        if self.done or not text:
+            return
+        self._pending += text
+        *lines, self._pending = self._pending.split('\n')
+        for line in lines:
+            self._add_line(line)
+            if self.done:
+                return
+
+    def close(self):
+        """输出结束时处理最后一行（没有换行符结尾）。"""
+        if self._pending and not self.done:
+            self._add_line(self._pending)
+        self._pending = ''
+
+    def _add_line(self, line):
+        stripped = line.strip()
+        clean = stripped.replace('**', '').lstrip('#').strip()
+        if not self._seen_first_line:
+            if not clean:
+                return
+            self._seen_first_line = True
+            lowered = clean.lower()
+            for prefix in SUBJECT_PREFIXES:
+                if lowered.startswith(prefix):
+                    self.subject = clean[len(prefix):].strip()
+                    return
+
+        if self._signature_lines is not None:
+            if not clean:
+                if self._signature_lines > 0:
+                    self.done = True
+                return
+            self._lines.append(line)
+            self._signature_lines += 1
+            if self._signature_lines >= self.max_signature_lines:
+                self.done = True
+            return
+
+        if self._awaiting_name and clean:
+            self._awaiting_name = False
+            if self._has_sender_name(clean):
+                self._lines.append(line)
+                self._signature_lines = 1
+                return
+
+        self._lines.append(line)
+        if clean and self.sender_name and SIGN_OFF_PATTERN.match(clean):
+            if self._has_sender_name(clean):
+                self._signature_lines = 0
+            else:
+                self._awaiting_name = True
+
+    def _has_sender_name(self, text) -> bool:
+        return self.sender_name in text.lower()
+
+    @property
+    def body(self) -> str:
+        return '\n'.join(self._lines).replace('**', '').strip()
+
+    def result(self):
+        """返回 (主题, 正文)；未识别到主题时主题为 "未生成主题"。"""
+        self.close()
+        return (self.subject or "未生成主题").replace('**', '').strip(), self.body
+
+
+def parse_email(text, sender_name=None):
+    """解析一段完整的邮件输出，返回 (主题, 正文)。"""
+    parser = EmailStreamParser(sender_name)
+    parser.feed(text)
+    return parser.result()
+
+
+async def stream_chain(chain, inputs, parser, on_chunk=None) -> str:
+    """
+    以流式方式调用 LLMChain：逐块喂给 parser，parser.done 变为 True 后立即关闭连接、停止生成，
+    不再为之后的 token 付费。
+
+    流式调用不经过 LangChain 的缓存逻辑，这里按相同的键自行查询和写入 LLM 缓存（遵守 bypass_cache）；
+    缓存中保存的是停止时已生成的内容。LLM_STREAMING=0 或 chain 不是 LLMChain 时退回普通调用。
+
+    :param parser: IncrementalJSONParser 或 EmailStreamParser。
+    :param on_chunk: 可选的异步回调，每收到一块输出后以 parser 为参数调用，用于把已完成的部分提前交给下游。
+    :return: 已生成的完整文本。
+    """
+    llm = getattr(chain, 'llm', None)
+    prompt = getattr(chain, 'prompt', None)
+    if not streaming_enabled() or llm is None or prompt is None:
+        text = (await chain.ainvoke(inputs))['text']
+        parser.feed(text)
+        if on_chunk:
+            await on_chunk(parser)
+        return text
+
+    from langchain_core.caches import BaseCache
+    from langchain_core.load import dumps
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration
+
+    messages = prompt.format_prompt(**inputs).to_messages()
+    cache = llm.cache if isinstance(llm.cache, BaseCache) else None
+    if cache is not None:
+        cache_prompt, llm_string = dumps(messages), llm._get_llm_string()
+        cached = await cache.alookup(cache_prompt, llm_string)
+        if cached:
+            get_metrics().inc('llm_cache_hits_total', model=llm._identifying_params.get('model_name', 'unknown'))
+            text = cached[0].text
+            parser.feed(text)
+            if on_chunk:
+                await on_chunk(parser)
+            return text
+
+    parts = []
+    stream = llm.astream(messages)
+    try:
+        async for chunk in stream:
+            if not chunk.content:
+                continue
+            parts.append(chunk.content)
+            parser.feed(chunk.content)
+            if on_chunk:
+                await on_chunk(parser)
+            if parser.done:
+                get_metrics().inc('llm_early_stops_total')
+                break
+    finally:
+        await stream.aclose()  # 提前结束时关闭连接，服务端随即停止生成
+
+    text = ''.join(parts)
+    if cache is not None and text:
+        await cache.aupdate(cache_prompt, llm_string, [ChatGeneration(message=AIMessage(content=text))])
+    return text
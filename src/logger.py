@@ -1,5 +1,8 @@
 import os
 import sys
+import time
+import uuid
+import random
 
 from loguru import logger
 
@@ -10,32 +13,151 @@ logger.remove()
 log_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
 os.makedirs(log_dir, exist_ok=True)
 log_file_path = os.path.join(log_dir, "email_agent.log")
+json_log_path = os.path.join(log_dir, "email_agent.jsonl")
+artifact_dir = os.path.join(log_dir, "artifacts")
+
+# 本次运行的关联 ID；联系人/公司级别的 ID 通过 logger.contextualize(contact_id=...) 附加
+RUN_ID = uuid.uuid4().hex[:8]
+logger.configure(extra={"run_id": RUN_ID, "contact_id": "-"})
 
 # 配置日志格式
 log_format = (
     "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
     "<level>{level: <8}</level> | "
+    "{extra[run_id]}:{extra[contact_id]} | "
     "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
     "<level>{message}</level>"
 )
 
+# 控制台使用紧凑格式，逐条明细只写入日志文件，控制台以进度汇总为主
+console_format = "<green>{time:HH:mm:ss}</green> | <level>{level: <7}</level> | <level>{message}</level>"
+
+
+def _not_artifact(record):
+    return "artifact" not in record["extra"]
+
+
+def _artifact_sink(message):
+    """把大段内容（邮件正文、LLM 原始响应等）写入独立的文件，而不是日志文件。"""
+    record = message.record
+    path = record["extra"]["artifact"]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(record["message"])
+
+
 # 添加日志处理器：输出到控制台
 logger.add(
     sys.stderr,
-    format=log_format,
-    level="INFO",  # 控制台只显示 INFO 级别及以上的日志
-    colorize=True
+    format=console_format,
+    level=os.getenv("LOG_CONSOLE_LEVEL", "INFO"),  # 控制台只显示 INFO 级别及以上的日志
+    colorize=True,
+    filter=_not_artifact
 )
 
 # 添加日志处理器：保存到文件
+# 所有文件处理器都使用 enqueue=True，由后台线程写盘，高并发时不会阻塞事件循环
 logger.add(
     log_file_path,
     format=log_format,
     rotation="10 MB",  # 单个日志文件最大 10MB
     compression="zip",  # 自动压缩旧日志文件
     level="DEBUG",  # 文件中记录所有 DEBUG 级别及以上的日志
-    encoding="utf-8"
+    encoding="utf-8",
+    enqueue=True,
+    filter=_not_artifact
+)
+
+# 添加日志处理器：结构化 JSONL，每行一条记录，包含 run_id / contact_id 等上下文字段，便于检索和统计
+logger.add(
+    json_log_path,
+    serialize=True,
+    rotation="50 MB",
+    compression="zip",
+    level="DEBUG",
+    encoding="utf-8",
+    enqueue=True,
+    filter=_not_artifact
+)
+
+# 添加日志处理器：大段内容的抽样存档
+logger.add(
+    _artifact_sink,
+    format="{message}",
+    level="DEBUG",
+    enqueue=True,
+    filter=lambda record: "artifact" in record["extra"]
 )
 
+
+def _env_float(key, default):
+    try:
+        return float(os.getenv(key) or default)
+    except ValueError:
+        logger.warning(f".env 文件中的 {key} 值无效，已使用默认值 {default}。")
+        return default
+
+
+# 大段内容的抽样比例，默认 5%；设为 1 保存全部，设为 0 不保存
+PAYLOAD_SAMPLE_RATE = _env_float("LOG_PAYLOAD_SAMPLE_RATE", 0.05)
+
+
+def log_payload(kind, key, text, preview_chars=120):
+    """
+    记录一段大内容：日志中只写长度和开头的摘要，完整内容按 LOG_PAYLOAD_SAMPLE_RATE 抽样存入
+    logs/artifacts/<run_id>/<kind>/ 下的独立文件。
+
+    :param kind: 内容类别，例如 "email"、"profile_summary"。
+    :param key: 内容标识（如收件人邮箱），用于生成文件名。
+    """
+    text = str(text)
+    preview = " ".join(text[:preview_chars].split())
+    if random.random() < PAYLOAD_SAMPLE_RATE:
+        safe_key = "".join(c if c.isalnum() or c in "@._-" else "_" for c in str(key))[:100]
+        path = os.path.join(artifact_dir, RUN_ID, kind, f"{safe_key}_{uuid.uuid4().hex[:6]}.txt")
+        logger.bind(artifact=path).debug(text)
+        logger.debug(f"[{kind}] {key}: {len(text)} 字符，已存档至 {path} | {preview}")
+    else:
+        logger.debug(f"[{kind}] {key}: {len(text)} 字符 | {preview}")
+
+
+class ProgressReporter:
+    """
+    紧凑的进度汇总：每隔 interval 秒在控制台输出一行完成数、失败数、速率和预计剩余时间，
+    替代逐条刷屏的明细日志。
+    """
+
+    def __init__(self, label, total=None, interval=5.0):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self._last_report = self.started_at
+
+    def update(self, ok=True, force=False):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        now = time.monotonic()
+        if force or now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        finished = self.done + self.failed
+        rate = finished / elapsed
+        line = f"[{self.label}] 完成 {self.done}"
+        if self.total:
+            line += f"/{self.total}"
+        line += f"，失败 {self.failed}，{rate:.1f} 条/秒"
+        if self.total and rate > 0:
+            line += f"，预计剩余 {max(self.total - finished, 0) / rate:.0f} 秒"
+        logger.info(line)
+
+
 # 确保 logger 实例被正确导出，供其他模块调用
-__all__ = ["logger"]
+__all__ = ["logger", "log_payload", "ProgressReporter", "RUN_ID"]
@@ -1,16 +1,68 @@
+import argparse
 import asyncio
 import os
 import sys
+from dotenv import load_dotenv
 from logger import logger
+from metrics import export_metrics
 
-from src.generate_email import create_email_generation_chain, process_contacts
-from src.send_email import send_generated_emails
+
+def build_generate_kwargs(args):
+    """
+    根据命令行参数组装 process_contacts 的可选参数。
+    """
+    generate_kwargs = {'resume': args.resume, 'enrich_companies': args.enrich}
+    if args.batch_size > 1:
+        from generate_email import create_batch_email_generation_chain
+
+        generate_kwargs['batch_chain'] = create_batch_email_generation_chain(batch_size=args.batch_size)
+        generate_kwargs['batch_size'] = args.batch_size
+    if args.reuse_similar:
+        from generate_email import create_personalization_chain
+
+        generate_kwargs['personalize_chain'] = create_personalization_chain()
+    return generate_kwargs
+
+
+def run_pipeline_mode(input_file_path, output_file_path, generate_kwargs):
+    """
+    流水线模式：生成与发送并行进行，每封邮件通过自动审核后立即发送，无需等待整批生成完毕。
+    """
+    from generate_email import create_email_generation_chain
+    from pipeline import run_pipeline
+
+    logger.info("--- 流水线模式：生成与发送同时进行... ---")
+    try:
+        email_chain = create_email_generation_chain()
+        asyncio.run(run_pipeline(
+            filepath=input_file_path,
+            chain=email_chain,
+            **generate_kwargs
+        ))
+        logger.success(f"--- 流水线执行完毕，生成结果已保存到 {output_file_path}。---")
+    except Exception as e:
+        logger.error(f"流水线执行过程中发生错误: {e}")
+        sys.exit(1)
 
 
 def main():
     """
     主程序入口，负责协调邮件生成的流程。
     """
+    parser = argparse.ArgumentParser(description="AI 开发信生成与发送代理")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="流水线模式：邮件生成后经自动审核立即发送，而不是整批生成后再确认发送")
+    parser.add_argument("--resume", action="store_true",
+                        help="断点续跑：跳过上次运行中已生成且通过质检的联系人，只重新生成缺失和不合格的邮件")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="批量模式：每次 LLM 调用为多少个联系人生成邮件（默认 1，即逐封生成）")
+    parser.add_argument("--enrich", action="store_true",
+                        help="公司背调：按公司网站爬取分析（每家公司只分析一次），把结果用于个性化开发信")
+    parser.add_argument("--reuse-similar", action="store_true",
+                        help="相似公司复用：简介近似的公司只完整生成一封，其余基于该草稿改写")
+    args = parser.parse_args()
+    load_dotenv()
+
     logger.info("--- 邮件代理程序启动 ---")
     logger.info("正在初始化...")
 
@@ -22,14 +74,19 @@ def main():
         logger.error(f"找不到联系人数据文件: {os.path.abspath(input_file_path)}")
         sys.exit(1)
 
+    if args.pipeline:
+        run_pipeline_mode(input_file_path, output_file_path, build_generate_kwargs(args))
+        return
+
     # --- 2. 生成邮件 ---
     logger.info("--- 任务一：正在生成开发信... ---")
+    from generate_email import create_email_generation_chain, process_contacts
     try:
         email_chain = create_email_generation_chain()
         asyncio.run(process_contacts(
             filepath=r"C:\Users\97909\Desktop\EmailAgent\data\data_0822.xlsx",
             chain=email_chain,
-            max_concurrency=5
+            **build_generate_kwargs(args)
         ))
         logger.success("--- 开发信已全部生成并保存。---")
     except Exception as e:
@@ -44,6 +101,7 @@ def main():
     if user_input == 'y':
         # --- 3. 发送邮件 ---
         logger.info("--- 任务二：正在发送邮件... ---")
+        from send_email import send_generated_emails
         try:
             send_generated_emails(filepath=output_file_path)
             logger.success("--- 邮件已全部成功发送。---")
@@ -56,4 +114,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        export_metrics()  # 无论成功、失败还是用户取消，都保存本次运行的指标汇总
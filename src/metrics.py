@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+from logger import logger
+
+# 运行指标默认写入项目根目录下的 logs 文件夹
+log_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
+DEFAULT_SUMMARY_PATH = os.path.join(log_dir, "run_metrics.json")
+
+# 延迟直方图的桶边界（秒），覆盖从本地 I/O 到慢速 LLM 调用的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_key(labels: dict):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in key) + "}"
+
+
+class Histogram:
+    """
+    延迟直方图：按固定桶计数（用于 Prometheus），同时以蓄水池抽样保留最多 max_samples 个样本用于计算分位数。
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_samples=10000):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.max_samples = max_samples
+        self.samples = []
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.max_samples:
+                self.samples[slot] = value
+
+    def percentile(self, pct):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'total_seconds': round(self.total, 3),
+            'mean': round(self.total / self.count, 4) if self.count else 0.0,
+            'p50': round(self.percentile(50), 4),
+            'p95': round(self.percentile(95), 4),
+            'p99': round(self.percentile(99), 4),
+            'max': round(self.max, 4),
+        }
+
+
+class MetricsRegistry:
+    """
+    进程内的运行指标：计数器、延迟直方图和仪表（记录最新值与峰值，例如队列深度）。
+
+    所有方法都是线程安全的，可以在事件循环和 asyncio.to_thread 的工作线程中调用。
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(seconds)
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            _, peak = self._gauges.get(key, (value, value))
+            self._gauges[key] = (value, max(peak, value))
+
+    def total(self, name, **labels) -> float:
+        """计数器 name 在所有匹配 labels 的标签组合上的合计。"""
+        wanted = set(_label_key(labels))
+        with self._lock:
+            return sum(value for (counter, key), value in self._counters.items()
+                       if counter == name and wanted <= set(key))
+
+    def samples(self, name) -> list:
+        """直方图 name 在所有标签组合上保留的样本。"""
+        with self._lock:
+            return [v for (histogram, _), h in self._histograms.items() if histogram == name for v in h.samples]
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """记录代码块的耗时到 stage_seconds 直方图；代码块抛出异常时同时累加 stage_errors_total。"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc('stage_errors_total', stage=stage, **labels)
+            raise
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._gauges.clear()
+            self.started_at = time.time()
+
+    def summary(self) -> dict:
+        """汇总为便于阅读的字典：各阶段延迟分布、计数器、仪表峰值，以及平均每封邮件的 token 开销。"""
+        with self._lock:
+            histograms = {(name, key): h.summary() for (name, key), h in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        def label_text(key):
+            return ",".join(f"{k}={v}" for k, v in key) or "total"
+
+        result = {
+            'started_at': self.started_at,
+            'duration_seconds': round(time.time() - self.started_at, 3),
+            'stages': {},
+            'counters': {},
+            'gauges': {},
+        }
+        for (name, key), summary in sorted(histograms.items()):
+            section = result['stages'] if name == 'stage_seconds' else result.setdefault(name, {})
+            section[label_text(key)] = summary
+        for (name, key), value in sorted(counters.items()):
+            result['counters'].setdefault(name, {})[label_text(key)] = value
+        for (name, key), (value, peak) in sorted(gauges.items()):
+            result['gauges'].setdefault(name, {})[label_text(key)] = {'last': value, 'max': peak}
+
+        tokens = sum(value for (name, _), value in counters.items() if name == 'llm_tokens_total')
+        emails = sum(value for (name, _), value in counters.items() if name == 'emails_generated_total')
+        if emails:
+            result['tokens_per_email'] = round(tokens / emails, 1)
+        return result
+
+    def write_summary(self, path=DEFAULT_SUMMARY_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    def write_prometheus(self, path):
+        """以 Prometheus textfile 格式写出全部指标（先写临时文件再替换，供 node_exporter 的 textfile collector 读取）。"""
+        lines = []
+        with self._lock:
+            for (name, key), value in sorted(self._counters.items()):
+                lines.append(f"email_agent_{name}{_format_labels(key)} {value}")
+            for (name, key), (value, peak) in sorted(self._gauges.items()):
+                lines.append(f"email_agent_{name}{_format_labels(key)} {value}")
+                lines.append(f"email_agent_{name}_max{_format_labels(key)} {peak}")
+            for (name, key), histogram in sorted(self._histograms.items()):
+                for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                    bucket_key = key + (('le', str(bound)),)
+                    lines.append(f"email_agent_{name}_bucket{_format_labels(bucket_key)} {count}")
+                lines.append(f"email_agent_{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"email_agent_{name}_sum{_format_labels(key)} {histogram.total}")
+                lines.append(f"email_agent_{name}_count{_format_labels(key)} {histogram.count}")
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+_registry = MetricsRegistry()
+_callback = None
+
+
+def get_metrics() -> MetricsRegistry:
+    """获取全局共享的指标注册表。"""
+    return _registry
+
+
+def get_metrics_callback():
+    """
+    获取记录到全局指标注册表的 LangChain 回调，可直接传给 ChatOpenAI(callbacks=[...])。
+
+    回调类依赖 langchain_core，首次调用时才导入，只发送邮件的流程不需要加载 LangChain。
+    """
+    global _callback
+    if _callback is None:
+        from metrics_callback import MetricsCallbackHandler
+        _callback = MetricsCallbackHandler(_registry)
+    return _callback
+
+
+def stage_timer(stage, **labels):
+    """统计代码块耗时，例如 ``with stage_timer("contacts_read"): chunk = next(chunks)``。"""
+    return _registry.timer(stage, **labels)
+
+
+def export_metrics(summary_path=None, prometheus_path=None):
+    """
+    导出本次运行的指标：JSON 汇总写入 summary_path（默认 METRICS_SUMMARY_PATH 或 logs/run_metrics.json），
+    设置了 prometheus_path 或 METRICS_PROMETHEUS_PATH 时同时写出 Prometheus textfile。
+    """
+    summary_path = summary_path or os.getenv("METRICS_SUMMARY_PATH") or DEFAULT_SUMMARY_PATH
+    prometheus_path = prometheus_path or os.getenv("METRICS_PROMETHEUS_PATH")
+    try:
+        _registry.write_summary(summary_path)
+        logger.info(f"运行指标已保存到 {summary_path}")
+        if prometheus_path:
+            _registry.write_prometheus(prometheus_path)
+    except OSError as e:
+        logger.error(f"保存运行指标时出错: {e}")
@@ -0,0 +1,79 @@
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+from rate_limit import estimate_tokens
+
+
+def _response_usage(response):
+    """读取服务端返回的 token 用量：普通调用在 llm_output 中，流式调用在消息的 usage_metadata 中。"""
+    usage = (response.llm_output or {}).get('token_usage') or {}
+    if usage:
+        return usage.get('prompt_tokens') or 0, usage.get('completion_tokens') or 0
+    for generations in response.generations or []:
+        for generation in generations:
+            metadata = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+            if metadata:
+                return metadata.get('input_tokens') or 0, metadata.get('output_tokens') or 0
+    return None
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain 回调：记录每次 LLM 调用的延迟、token 用量和错误，按模型名区分。
+
+    命中 LLM 缓存的调用同样会触发回调，但不会带回服务端的 token 用量，单独计入 llm_cache_hits_total。
+    流式调用被提前结束时服务端来不及返回用量，按 prompt 和已收到的输出估算 token 数。
+    """
+
+    run_inline = True  # 只做计数，直接在事件循环中执行，不需要放到线程池
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._starts = {}
+        self._prompt_tokens = {}
+        self._streamed = {}
+
+    def _start(self, serialized, run_id, kwargs):
+        params = kwargs.get('invocation_params') or {}
+        model = params.get('model_name') or params.get('model') or (serialized or {}).get('name', 'unknown')
+        self._starts[run_id] = (time.perf_counter(), model)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(serialized, run_id, kwargs)
+        self._prompt_tokens[run_id] = sum(estimate_tokens(m.content) for batch in messages for m in batch)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        self._streamed.setdefault(run_id, []).append(token)
+
+    def _finish(self, run_id):
+        start, model = self._starts.pop(run_id, (None, 'unknown'))
+        prompt_tokens = self._prompt_tokens.pop(run_id, 0)
+        streamed = self._streamed.pop(run_id, None)
+        if start is not None:
+            self.registry.observe('llm_call_seconds', time.perf_counter() - start, model=model)
+        estimated = (prompt_tokens, estimate_tokens(''.join(streamed))) if streamed is not None else None
+        return model, estimated
+
+    def _record_usage(self, model, usage):
+        prompt_tokens, completion_tokens = usage
+        self.registry.inc('llm_calls_total', model=model)
+        self.registry.inc('llm_tokens_total', prompt_tokens, model=model, kind='prompt')
+        self.registry.inc('llm_tokens_total', completion_tokens, model=model, kind='completion')
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(serialized, run_id, kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        model, estimated = self._finish(run_id)
+        usage = _response_usage(response) or estimated
+        if not usage:
+            self.registry.inc('llm_cache_hits_total', model=model)
+            return
+        self._record_usage(model, usage)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        model, estimated = self._finish(run_id)
+        if isinstance(error, GeneratorExit):
+            # 调用方拿到完整结果后主动结束了流式输出，不算错误
+            self._record_usage(model, estimated or (0, 0))
+            return
+        self.registry.inc('llm_errors_total', model=model, error=type(error).__name__)
@@ -0,0 +1,232 @@
+import os
+import time
+import random
+import sqlite3
+import smtplib
+import hashlib
+from logger import logger
+
+# 邮件状态
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+DEFERRED = 'deferred'
+
+
+def message_hash(to, source=None) -> str:
+    """
+    以收件人和来源（活动 / 生成结果文件）计算邮件指纹：同一活动中每个收件人只对应一条记录，
+    重新生成后正文不同的邮件也不会再发给已发送过的收件人。
+    """
+    raw = "\x00".join([str(to).strip().lower(), str(source or '')])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def is_transient_smtp_error(error) -> bool:
+    """
+    判断 SMTP 错误是否为临时性错误（值得稍后重试）。
+
+    4xx 响应码、连接断开和超时视为临时错误；5xx 响应码（如收件人不存在）、认证失败和其他未知异常
+    （如 yagmail 的无效地址）视为永久错误，重试也不会成功。认证失败由发送引擎停用对应的发件账户。
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return any(400 <= code < 500 for code in codes)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)):
+        return True
+    return False
+
+
+def is_hard_bounce(error) -> bool:
+    """
+    判断 SMTP 错误是否为收件人地址永久无效（RCPT 阶段全部收件人被 5xx 拒收，如邮箱不存在），这类地址应加入退信名单。
+
+    发件人被拒（SMTPSenderRefused，自己账户的问题）和 DATA 阶段的拒收（SMTPDataError，如内容被判为垃圾邮件）
+    即使是 550 也与收件人地址无关，不算退信。
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(code >= 500 for code in codes)
+    return False
+
+
+class Outbox:
+    """
+    持久化发件箱（SQLite）：记录每封邮件的发送状态，保证重启后从中断处继续且不会重复发送。
+
+    状态流转：pending → sending → sent；发送失败时临时错误转为 deferred 并按指数退避安排重试，
+    超过最大尝试次数或遇到永久错误则转为 failed。
+    """
+
+    def __init__(self, db_path="../email_output/outbox.sqlite", max_attempts=5, base_delay=60, max_delay=3600):
+        """
+        :param max_attempts: 每封邮件最多尝试发送的次数。
+        :param base_delay: 第一次重试前的等待秒数，之后每次翻倍（带随机抖动）。
+        :param max_delay: 单次重试等待的上限秒数。
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30)  # 多个 worker 进程可以共用同一个发件箱
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                hash TEXT PRIMARY KEY,
+                recipient TEXT NOT NULL,
+                subject TEXT,
+                content TEXT,
+                source TEXT,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(state, next_attempt_at)")
+        self._conn.commit()
+
+    def enqueue(self, to, subject, content, source=None) -> str:
+        """
+        加入一封待发邮件；同一来源中已有该收件人的邮件（无论何种状态）时不会重复加入。返回邮件指纹。
+
+        :param source: 来源（活动名称或生成结果文件），与收件人一起决定去重的范围。
+        """
+        key = message_hash(to, source)
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR IGNORE INTO outbox (hash, recipient, subject, content, source, state, next_attempt_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, str(to).strip(), subject, content, source, PENDING, now, now)
+        )
+        self._conn.commit()
+        return key
+
+    def enqueue_many(self, messages, source=None) -> int:
+        """
+        批量加入待发邮件，在一个事务中提交，适合一次导入大量邮件。
+
+        :param messages: (收件人, 主题, 内容) 的可迭代对象。
+        :return: 新加入的邮件数（已存在的不计）。
+        """
+        now = time.time()
+        rows = [(message_hash(to, source), str(to).strip(), subject, content, source, PENDING, now, now)
+                for to, subject, content in messages]
+        before = self._conn.total_changes
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO outbox (hash, recipient, subject, content, source, state, next_attempt_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        self._conn.commit()
+        return self._conn.total_changes - before
+
+    def recover_interrupted(self) -> int:
+        """
+        处理上次运行中断时仍处于 sending 状态的邮件。
+
+        这些邮件可能已经送达，为避免重复发送，一律标记为 failed 并注明原因，需人工确认后再用 requeue 重新排队。
+        """
+        cursor = self._conn.execute(
+            "UPDATE outbox SET state = ?, last_error = ?, updated_at = ? WHERE state = ?",
+            (FAILED, "上次运行中断时正在发送，投递状态未知，请人工确认", time.time(), SENDING)
+        )
+        self._conn.commit()
+        if cursor.rowcount:
+            logger.warning(f"发件箱中有 {cursor.rowcount} 封邮件在上次中断时正在发送，已标记为 failed，请人工确认。")
+        return cursor.rowcount
+
+    def requeue(self, state=FAILED) -> int:
+        """把指定状态的邮件重新放回待发送队列（例如人工确认后重发 failed 邮件）。"""
+        now = time.time()
+        cursor = self._conn.execute(
+            "UPDATE outbox SET state = ?, attempts = 0, next_attempt_at = ?, updated_at = ? WHERE state = ?",
+            (PENDING, now, now, state)
+        )
+        self._conn.commit()
+        return cursor.rowcount
+
+    def claim(self, key) -> dict | None:
+        """认领一封到期的待发邮件并标记为 sending；邮件不存在、已发送或未到重试时间时返回 None。"""
+        now = time.time()
+        cursor = self._conn.execute(
+            "UPDATE outbox SET state = ?, attempts = attempts + 1, updated_at = ? "
+            "WHERE hash = ? AND state IN (?, ?) AND next_attempt_at <= ?",
+            (SENDING, now, key, PENDING, DEFERRED, now)
+        )
+        self._conn.commit()
+        if not cursor.rowcount:
+            return None
+        return self.get(key)
+
+    def claim_due(self, limit=10) -> list:
+        """认领一批已到发送时间的邮件。"""
+        rows = self._conn.execute(
+            "SELECT hash FROM outbox WHERE state IN (?, ?) AND next_attempt_at <= ? "
+            "ORDER BY next_attempt_at LIMIT ?",
+            (PENDING, DEFERRED, time.time(), limit)
+        ).fetchall()
+        return [message for message in (self.claim(key) for (key,) in rows) if message]
+
+    def get(self, key) -> dict | None:
+        cursor = self._conn.execute("SELECT * FROM outbox WHERE hash = ?", (key,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+
+    def release(self, key):
+        """认领后未能尝试发送（例如没有可用的发件账户）时放回待发送队列，不计入尝试次数。"""
+        self._conn.execute(
+            "UPDATE outbox SET state = ?, attempts = MAX(attempts - 1, 0), updated_at = ? WHERE hash = ? AND state = ?",
+            (PENDING, time.time(), key, SENDING)
+        )
+        self._conn.commit()
+
+    def mark_sent(self, key):
+        self._conn.execute(
+            "UPDATE outbox SET state = ?, last_error = NULL, updated_at = ? WHERE hash = ?",
+            (SENT, time.time(), key)
+        )
+        self._conn.commit()
+
+    def mark_failed(self, key, error) -> str:
+        """
+        记录一次发送失败：临时错误且未超过最大尝试次数时安排退避重试，否则标记为永久失败。
+
+        :return: 更新后的状态（deferred 或 failed）。
+        """
+        message = self.get(key)
+        attempts = message['attempts'] if message else self.max_attempts
+        now = time.time()
+        if is_transient_smtp_error(error) and attempts < self.max_attempts:
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+            state, next_attempt_at = DEFERRED, now + delay
+        else:
+            state, next_attempt_at = FAILED, now
+        self._conn.execute(
+            "UPDATE outbox SET state = ?, next_attempt_at = ?, last_error = ?, updated_at = ? WHERE hash = ?",
+            (state, next_attempt_at, f"{type(error).__name__}: {error}", now, key)
+        )
+        self._conn.commit()
+        return state
+
+    def seconds_until_next_due(self):
+        """距离下一封待发/待重试邮件到期的秒数；没有剩余邮件时返回 None。"""
+        row = self._conn.execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE state IN (?, ?)", (PENDING, DEFERRED)
+        ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def counts(self) -> dict:
+        """各状态的邮件数量。"""
+        return dict(self._conn.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall())
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,87 @@
+import asyncio
+import re
+from logger import logger
+from table_io import write_table
+from quality_gate import QUALITY_FIELD
+
+from generate_email import process_contacts
+from send_email import send_emails_from_queue
+
+
+class ApprovalPolicy:
+    """
+    自动审核规则：只有满足全部规则的邮件才会在流水线中直接发送，其余转入人工复核队列。
+    """
+
+    def __init__(self, min_words=80, max_words=300,
+                 forbidden_patterns=(r'\bnan\b', r'\[[^\]]*\]', r'未生成主题')):
+        self.min_words = min_words
+        self.max_words = max_words
+        self.forbidden_patterns = [re.compile(p, re.IGNORECASE) for p in forbidden_patterns]
+
+    def review(self, email: dict):
+        """
+        审核单封邮件。
+
+        :return: (是否通过, 未通过原因)
+        """
+        subject = str(email.get('开发信主题') or '').strip()
+        content = str(email.get('开发信内容') or '').strip()
+
+        if email.get(QUALITY_FIELD):
+            return False, f"未通过质检: {email[QUALITY_FIELD]}"
+        if not subject:
+            return False, "缺少邮件主题"
+        if not content:
+            return False, "缺少邮件正文"
+
+        word_count = len(content.split())
+        if word_count < self.min_words or word_count > self.max_words:
+            return False, f"正文字数 {word_count} 不在 {self.min_words}-{self.max_words} 范围内"
+
+        for pattern in self.forbidden_patterns:
+            if pattern.search(subject) or pattern.search(content):
+                return False, f"包含占位符或无效内容: {pattern.pattern}"
+
+        return True, ""
+
+
+async def run_pipeline(filepath="", chain=None, max_concurrency=None, queue_size=20,
+                       approval_policy=None, review_output="../email_output/review_queue.xlsx",
+                       **generate_kwargs):
+    """
+    生成 → 发送 流水线：两个阶段通过有界队列相连，每封邮件生成并通过审核后即刻发送，
+    端到端耗时取决于较慢的那个阶段，而非两阶段耗时之和。生成结果仍会照常导出 Excel。
+
+    :param queue_size: 阶段间队列容量，发送阶段跟不上时会对生成阶段形成反压。
+    :param approval_policy: 审核策略，默认使用 ApprovalPolicy()。
+    :param review_output: 未通过审核的邮件导出路径，供人工复核后再用 send_generated_emails 发送。
+    :param generate_kwargs: 透传给 process_contacts 的其他参数（如 resume、batch_chain）。
+                            resume 时上次已生成但还没发送的邮件会直接进入发送阶段，已发送的不会重复发送。
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+    approval_policy = approval_policy or ApprovalPolicy()
+
+    async def generate_stage():
+        try:
+            await process_contacts(
+                filepath=filepath,
+                chain=chain,
+                max_concurrency=max_concurrency,
+                result_queue=queue,
+                **generate_kwargs
+            )
+        finally:
+            await queue.put(None)  # 通知发送阶段上游已结束
+
+    _, review_queue = await asyncio.gather(
+        generate_stage(),
+        send_emails_from_queue(queue, approval_policy=approval_policy)
+    )
+
+    if review_queue:
+        try:
+            write_table(review_output, review_queue)
+            logger.warning(f"--- {len(review_queue)} 封邮件待人工复核，已保存到 {review_output} ---")
+        except Exception as e:
+            logger.error(f"错误：保存复核队列文件时出错: {e}")
@@ -0,0 +1,236 @@
+import os
+import re
+import json
+import hashlib
+from collections import Counter
+from logger import logger
+from metrics import get_metrics
+
+# 结果记录中保存未通过规则的字段，全部通过时为空字符串
+QUALITY_FIELD = '质检问题'
+
+# 占位符和无效内容：nan / N/A、方括号或花括号模板、尖括号占位（如 <Your Name>）。
+# nan 区分大小写，只匹配 pandas 写出的空值（nan / NaN），不会误判名叫 Nan 的联系人
+PLACEHOLDER_PATTERNS = (
+    r'\b(?-i:nan|NaN)\b',
+    r'\bN/A\b',
+    r'\[[^\]\n]{0,80}\]',
+    r'\{\{?[^}\n]{0,80}\}\}?',
+    r'<[A-Za-z][A-Za-z _-]{1,40}>',
+)
+
+# 英文邮件中不应出现的非拉丁文字（中日韩、西里尔、阿拉伯等），按字母所在的 Unicode 区段粗略判断
+_LATIN_LIMIT = 0x250
+
+
+def quality_gate_enabled() -> bool:
+    """是否启用生成后的本地质检，可用环境变量 QUALITY_GATE=0 关闭。"""
+    return os.getenv("QUALITY_GATE", "1").lower() not in ("0", "false", "no")
+
+
+def _env_int(key, default):
+    value = os.getenv(key)
+    try:
+        return int(value) if value else default
+    except ValueError:
+        logger.warning(f".env 文件中的 {key} 值无效，已使用默认值 {default}。")
+        return default
+
+
+class QualityGate:
+    """
+    生成结果的本地质检：逐封检查主题、正文字数、占位符、语言和重复正文，只对未通过的联系人重新生成，
+    不必重跑整张表。
+
+    规则：
+      - missing_subject: 没有主题（或为 "未生成主题"）
+      - missing_body: 没有正文
+      - word_count: 正文字数不在 [min_words, max_words] 范围内
+      - placeholder: 出现 nan、N/A、[...]、{...}、<...> 等占位符
+      - language: 正文或主题中的非拉丁字母（扣除公司名、姓名、职务后）超过 max_foreign_chars 个；
+                  中文等文字信息密度高，一句话只有几个字，按个数而不是比例判断
+      - duplicate: 正文与已保存的另一位联系人的邮件完全相同（忽略大小写和空白）
+
+    重新生成的次数受两层限制：每个联系人最多 max_retries 次；整轮运行的重新生成总数不超过
+    max(min_budget, retry_ratio × 已质检数)，提示词本身有问题导致大面积不合格时不会无限消耗配额。
+    """
+
+    def __init__(self, min_words=None, max_words=None, max_retries=2, retry_ratio=0.3, min_budget=5,
+                 max_foreign_chars=3):
+        """
+        :param min_words: 正文最少词数，默认取环境变量 QUALITY_MIN_WORDS（未设置时为 130）。
+        :param max_words: 正文最多词数，默认取环境变量 QUALITY_MAX_WORDS（未设置时为 230）。
+                          prompt 要求 155-200 词，默认上下限各留了一些余量。
+        :param max_retries: 每个联系人最多重新生成的次数。
+        :param retry_ratio: 重新生成总数占已质检邮件数的比例上限。
+        :param min_budget: 重新生成总数的最低额度（运行刚开始、已质检数还很少时）。
+        :param max_foreign_chars: 允许出现的非拉丁字母个数（如产品规格中的 μ）。
+        """
+        self.min_words = min_words if min_words is not None else _env_int("QUALITY_MIN_WORDS", 130)
+        self.max_words = max_words if max_words is not None else _env_int("QUALITY_MAX_WORDS", 230)
+        self.max_retries = max_retries
+        self.retry_ratio = retry_ratio
+        self.min_budget = min_budget
+        self.max_foreign_chars = max_foreign_chars
+        self.placeholder_patterns = [re.compile(p, re.IGNORECASE) for p in PLACEHOLDER_PATTERNS]
+        self._bodies = {}  # 正文指纹 -> 收件人
+        self.checked = 0
+        self.passed = 0
+        self.regenerations = 0
+        self.recovered = 0
+        self.budget_exhausted = 0
+        self.resumed_failed = 0  # 断点续跑时已有结果中未通过、需要重新生成的邮件数
+        self.failed_checks = Counter()  # 每次未通过（包括之后重新生成通过的）
+        self.unrecovered = Counter()    # 最终仍未通过
+
+    @staticmethod
+    def _body_digest(content) -> bytes:
+        normalized = ' '.join(str(content).lower().split())
+        return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+
+    @staticmethod
+    def _without(text, exclude) -> str:
+        """去掉文本中出现的联系人自身字段（公司名、姓名、职务），这些值本身不算占位符或外文。"""
+        for value in exclude:
+            if value:
+                text = text.replace(str(value), ' ')
+        return text
+
+    @classmethod
+    def _foreign_chars(cls, text, exclude) -> int:
+        text = cls._without(text, exclude)
+        return sum(1 for ch in text if ch.isalpha() and ord(ch) >= _LATIN_LIMIT)
+
+    def check(self, record) -> list:
+        """
+        检查一封邮件（生成结果记录，包含 邮箱 / 开发信主题 / 开发信内容 等字段）。
+
+        全部通过时在同一步中登记正文指纹，并发生成出相同正文的两封邮件只有先检查的一封通过；
+        通过后最终没有保存的邮件需调用 release 注销。
+
+        :return: 未通过的规则名列表，全部通过时为空列表。
+        """
+        subject = str(record.get('开发信主题') or '').strip()
+        content = str(record.get('开发信内容') or '').strip()
+        failures = []
+        if not subject or subject == '未生成主题':
+            failures.append('missing_subject')
+            subject = ''
+        if not content:
+            failures.append('missing_body')
+            return failures
+
+        word_count = len(content.split())
+        if not self.min_words <= word_count <= self.max_words:
+            failures.append('word_count')
+        # 字段值本身就是占位符（如空值写成的 nan）时不扣除，否则会掩盖正文中的同一个占位符
+        exclude = [value for value in (record.get('公司名称'), record.get('姓名'), record.get('职务'))
+                   if value and not any(p.search(str(value)) for p in self.placeholder_patterns)]
+        scanned = self._without(f"{subject}\n{content}", exclude)
+        if any(p.search(scanned) for p in self.placeholder_patterns):
+            failures.append('placeholder')
+        if self._foreign_chars(f"{subject}\n{content}", exclude) > self.max_foreign_chars:
+            failures.append('language')
+        digest = self._body_digest(content)
+        owner = self._bodies.get(digest)
+        if owner is not None and owner != record.get('邮箱'):
+            failures.append('duplicate')
+        if not failures:
+            self._bodies[digest] = record.get('邮箱')
+        return failures
+
+    def release(self, record):
+        """注销 check 通过时登记的正文指纹（该邮件最终没有保存）。"""
+        digest = self._body_digest(record.get('开发信内容') or '')
+        if self._bodies.get(digest) == record.get('邮箱'):
+            del self._bodies[digest]
+
+    def allow_retry(self, attempt) -> bool:
+        """
+        未通过质检后是否还能重新生成；允许时计入重新生成总数。
+
+        :param attempt: 该联系人已经重新生成的次数。
+        """
+        if attempt >= self.max_retries:
+            return False
+        if self.regenerations >= max(self.min_budget, self.retry_ratio * max(self.checked, 1)):
+            self.budget_exhausted += 1
+            return False
+        self.regenerations += 1
+        get_metrics().inc('quality_regenerations_total')
+        return True
+
+    def note_failure(self, failures):
+        """记录一次未通过的检查（无论之后是否重新生成）。"""
+        self.failed_checks.update(failures)
+        for rule in failures:
+            get_metrics().inc('quality_failures_total', rule=rule)
+
+    def accept(self, record, failures, retried=False):
+        """
+        最终保存一封邮件前调用：在记录中写入未通过的规则，登记正文指纹用于重复检测（通过的邮件已在 check 中登记），
+        并更新统计。
+
+        :param retried: 该邮件是否经过重新生成。
+        """
+        record[QUALITY_FIELD] = ','.join(failures)
+        self._bodies.setdefault(self._body_digest(record.get('开发信内容') or ''), record.get('邮箱'))
+        self.checked += 1
+        if failures:
+            self.unrecovered.update(failures)
+        else:
+            self.passed += 1
+            if retried:
+                self.recovered += 1
+        return record
+
+    def review_store(self, store):
+        """
+        断点续跑时重新检查结果存储中已有的邮件（每个联系人取最后一条）。通过的邮件由 check 登记到重复检测中。
+
+        :return: (通过质检的联系人集合, 未通过的联系人集合)；未通过的联系人不计入已完成，会被重新生成。
+        """
+        passing, failing = set(), set()
+        rules = Counter()
+        for key, record in store.latest_records().items():
+            failures = self.check(record)
+            if failures:
+                rules.update(failures)
+                failing.add(key)
+                continue
+            passing.add(key)
+        if failing:
+            details = "，".join(f"{rule} {count}" for rule, count in rules.most_common())
+            self.resumed_failed += len(failing)
+            logger.info(f"质检：结果存储中有 {len(failing)} 封邮件未通过（{details}），只重新生成这些联系人。")
+        return passing, failing
+
+    def stats(self) -> dict:
+        rules = sorted(set(self.failed_checks) | set(self.unrecovered))
+        return {
+            'checked': self.checked,
+            'passed': self.passed,
+            'failed': self.checked - self.passed,
+            'regenerations': self.regenerations,
+            'recovered': self.recovered,
+            'retry_budget_exhausted': self.budget_exhausted,
+            'resumed_failed': self.resumed_failed,
+            'bounds': {'min_words': self.min_words, 'max_words': self.max_words, 'max_retries': self.max_retries},
+            'rules': {rule: {'failed_checks': self.failed_checks[rule], 'unrecovered': self.unrecovered[rule]}
+                      for rule in rules},
+        }
+
+    def write_stats(self, path):
+        """把各规则的未通过统计写入 JSON 文件，并在日志中输出汇总。"""
+        stats = self.stats()
+        if self.checked:
+            logger.info(f"质检：共检查 {stats['checked']} 封，通过 {stats['passed']} 封，"
+                        f"重新生成 {stats['regenerations']} 次（修复 {stats['recovered']} 封），"
+                        f"仍未通过 {stats['failed']} 封。")
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logger.error(f"保存质检统计时出错: {e}")
+        return stats
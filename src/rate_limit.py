@@ -0,0 +1,390 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+import weakref
+from logger import logger
+from metrics import get_metrics
+
+
+def estimate_tokens(text) -> int:
+    """
+    粗略估算文本的 token 数：中日韩字符按 1 个字符约 1 token，其余按约 4 个字符 1 token。
+    """
+    if not text:
+        return 0
+    text = str(text)
+    cjk_count = len(re.findall(r'[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]', text))
+    return cjk_count + (len(text) - cjk_count) // 4 + 1
+
+
+class TokenBucket:
+    """
+    令牌桶：按每分钟 rate_per_minute 个令牌匀速补充，最多积累 capacity 个。
+
+    rate_per_minute 为 None 时不做任何限制。
+    """
+
+    def __init__(self, rate_per_minute=None, capacity=None):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity or 0)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_minute / 60)
+        self.updated_at = now
+
+    async def acquire(self, amount=1):
+        """等待直到桶中有足够的令牌，然后扣除。单次申请超过容量时按容量计。"""
+        if not self.rate_per_minute:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) * 60 / self.rate_per_minute)
+
+    def wait_time(self, amount=1) -> float:
+        """当前申请 amount 个令牌需要等待的秒数（不扣除令牌）。"""
+        if not self.rate_per_minute:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) * 60 / self.rate_per_minute)
+
+    def adjust(self, delta):
+        """事后修正扣除量：delta 为正表示补扣，为负表示退还（可暂时透支）。"""
+        if not self.rate_per_minute:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class SharedTokenBucket:
+    """
+    跨进程共享的令牌桶：状态保存在 SQLite 文件中，同一台机器上的多个 worker 进程（或共享存储上的多台机器）
+    共用一份 RPM/TPM 配额。每次申请在 BEGIN IMMEDIATE 事务中完成读-改-写，接口与 TokenBucket 相同。
+    """
+
+    def __init__(self, db_path, key, rate_per_minute=None, capacity=None):
+        self.key = key
+        self.rate_per_minute = rate_per_minute
+        self.capacity = capacity or rate_per_minute
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _current(self, now):
+        row = self._conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE key = ?", (self.key,)).fetchone()
+        if row is None:
+            return float(self.capacity)
+        # 各进程的时钟不完全一致，只按正的时间差补充令牌
+        return min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate_per_minute / 60)
+
+    def _update(self, change):
+        """在事务中执行 change(当前令牌数) -> (新令牌数, 返回值)。"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                tokens, result = change(self._current(now))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    (self.key, tokens, now)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def _try_take(self, amount) -> float:
+        """令牌足够时扣除并返回 0，否则返回需要等待的秒数。"""
+        def take(tokens):
+            if tokens >= amount:
+                return tokens - amount, 0.0
+            return tokens, (amount - tokens) * 60 / self.rate_per_minute
+        return self._update(take)
+
+    async def acquire(self, amount=1):
+        if not self.rate_per_minute:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            wait = await asyncio.to_thread(self._try_take, amount)
+            if wait <= 0:
+                return
+            # 加一点随机抖动，避免多个进程在同一时刻醒来争抢
+            await asyncio.sleep(wait * random.uniform(1.0, 1.2))
+
+    def wait_time(self, amount=1) -> float:
+        if not self.rate_per_minute:
+            return 0.0
+        amount = min(amount, self.capacity)
+        with self._lock:
+            tokens = self._current(time.time())
+        return max(0.0, (amount - tokens) * 60 / self.rate_per_minute)
+
+    def adjust(self, delta):
+        if not self.rate_per_minute:
+            return
+        self._update(lambda tokens: (min(self.capacity, tokens - delta), None))
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD 自适应并发：请求顺利时并发上限线性增长，遇到 429 或延迟超标时减半。
+    """
+
+    def __init__(self, initial=2, min_limit=1, max_limit=5, latency_target=None, cooldown=5.0):
+        """
+        :param latency_target: 单次请求延迟目标（秒），超过视为过载信号；为 None 时只看 429。
+        :param cooldown: 两次减半之间的最短间隔（秒），避免同一波错误把并发一降到底。
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency=None, overloaded=False):
+        async with self._cond:
+            self.in_flight -= 1
+            slow = self.latency_target is not None and latency is not None and latency > self.latency_target
+            if overloaded or slow:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+                    logger.warning(f"检测到{'限流' if overloaded else '高延迟'}，并发上限降至 {int(self.limit)}。")
+            elif latency is not None:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+def _status_code(error):
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status
+
+
+def is_rate_limit_error(error) -> bool:
+    """判断异常是否为服务端限流（HTTP 429）。"""
+    return _status_code(error) == 429 or type(error).__name__ == 'RateLimitError'
+
+
+def is_retryable_error(error) -> bool:
+    """判断异常是否值得重试：限流、服务端 5xx、超时和网络连接错误。"""
+    if is_rate_limit_error(error):
+        return True
+    status = _status_code(error)
+    if isinstance(status, int) and status >= 500:
+        return True
+    return (isinstance(error, (asyncio.TimeoutError, ConnectionError))
+            or type(error).__name__ in ('APIConnectionError', 'APITimeoutError', 'InternalServerError'))
+
+
+def _retry_after(error):
+    """读取服务端返回的 Retry-After 头（秒），没有则返回 None。"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    单个 LLM 服务商共享的限流层：RPM/TPM 令牌桶 + AIMD 自适应并发 + 带抖动的指数退避重试。
+    """
+
+    def __init__(self, name, rpm=None, tpm=None, max_concurrency=5, latency_target=None,
+                 max_retries=4, base_delay=1.0, max_delay=30.0, shared_db=None):
+        """
+        :param shared_db: 共享配额的 SQLite 文件路径；设置后 RPM/TPM 令牌桶由所有使用该文件的进程共用，
+                          并发上限仍按进程各自计算。
+        """
+        self.name = name
+        if shared_db:
+            self.requests = SharedTokenBucket(shared_db, f"{name}:rpm", rpm)
+            self.tokens = SharedTokenBucket(shared_db, f"{name}:tpm", tpm)
+        else:
+            self.requests = TokenBucket(rpm)
+            self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveConcurrency(initial=max_concurrency, max_limit=max_concurrency,
+                                               latency_target=latency_target)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def estimated_wait(self, estimated_tokens=0) -> float:
+        """按当前令牌桶余量估算一次请求在限流层需要排队的秒数，供路由层比较各服务商的剩余配额。"""
+        return max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+
+    @property
+    def load(self) -> float:
+        """当前在途请求数占自适应并发上限的比例。"""
+        return self.concurrency.in_flight / max(1.0, self.concurrency.limit)
+
+    async def _acquire(self, estimated_tokens):
+        """等待 RPM/TPM 令牌和并发名额，返回开始请求的时间。"""
+        metrics = get_metrics()
+        wait_start = time.monotonic()
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+        await self.concurrency.acquire()
+        start = time.monotonic()
+        metrics.observe('llm_limiter_wait_seconds', start - wait_start, provider=self.name)
+        metrics.set_gauge('llm_in_flight', self.concurrency.in_flight, provider=self.name)
+        return start
+
+    async def _finish(self, start):
+        await self.concurrency.release(latency=time.monotonic() - start)
+        get_metrics().set_gauge('llm_concurrency_limit', int(self.concurrency.limit), provider=self.name)
+
+    def _retry_delay(self, error, attempt, max_retries):
+        """
+        请求失败后的退避时间（秒）；不可重试或已达到最大重试次数时记录失败并返回 None。
+        """
+        metrics = get_metrics()
+        if attempt >= max_retries or not is_retryable_error(error):
+            metrics.inc('llm_failures_total', provider=self.name, error=type(error).__name__)
+            return None
+        delay = _retry_after(error)  # Retry-After: 0 表示可以立即重试，不能当作没有该头处理
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        metrics.inc('llm_retries_total', provider=self.name,
+                    reason='rate_limit' if is_rate_limit_error(error) else type(error).__name__)
+        logger.warning(f"[{self.name}] 请求失败 ({type(error).__name__}: {error})，"
+                       f"{delay:.1f} 秒后进行第 {attempt + 1} 次重试。")
+        return delay
+
+    async def call(self, request_factory, estimated_tokens=0, usage_getter=None, max_retries=None):
+        """
+        在限流约束下执行一次请求，可重试的错误按带抖动的指数退避重试。
+
+        :param request_factory: 无参函数，每次调用返回一个新的请求协程。
+        :param estimated_tokens: 本次请求预计消耗的 token 数，用于 TPM 限流。
+        :param usage_getter: 可选，从结果中取出实际 token 用量的函数，用于修正 TPM 令牌桶。
+        :param max_retries: 覆盖本次调用的最大重试次数；有备用服务商时可以少重试、尽快失败转移。
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            start = await self._acquire(estimated_tokens)
+            try:
+                result = await request_factory()
+            except asyncio.CancelledError:
+                await self.concurrency.release()  # 被取消（例如对冲请求中落后的一方）时归还并发名额
+                raise
+            except Exception as e:
+                await self.concurrency.release(overloaded=is_rate_limit_error(e))
+                delay = self._retry_delay(e, attempt, max_retries)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+
+            await self._finish(start)
+            if usage_getter:
+                actual_tokens = usage_getter(result)
+                if actual_tokens:
+                    self.tokens.adjust(actual_tokens - estimated_tokens)
+            return result
+
+    async def stream(self, stream_factory, estimated_tokens=0, max_retries=None):
+        """
+        在限流约束下执行一次流式请求，逐块转发输出。收到第一块输出之前出错（例如 429）时按与 call 相同的规则
+        退避重试；之后出错直接抛出（已输出的内容无法撤回，失败转移由调用方处理）。
+
+        调用方提前结束流（GeneratorExit）视为正常完成。
+
+        :param stream_factory: 无参函数，每次调用返回一个新的异步迭代器（流式请求）。
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            start = await self._acquire(estimated_tokens)
+            stream = stream_factory()
+            started = False
+            try:
+                async for chunk in stream:
+                    started = True
+                    yield chunk
+            except asyncio.CancelledError:
+                await self.concurrency.release()
+                raise
+            except GeneratorExit:
+                await self._finish(start)
+                raise
+            except Exception as e:
+                await self.concurrency.release(overloaded=is_rate_limit_error(e))
+                delay = None if started else self._retry_delay(e, attempt, max_retries)
+                if delay is None:
+                    if started:
+                        get_metrics().inc('llm_failures_total', provider=self.name, error=type(e).__name__)
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                await stream.aclose()
+            await self._finish(start)
+            return
+
+
+# 每个事件循环各自维护一组限流器（asyncio 同步原语不能跨事件循环使用）
+_limiters = weakref.WeakKeyDictionary()
+
+
+def _env_number(key, default=None, cast=int):
+    value = os.getenv(key)
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f".env 文件中的 {key} 值无效，已使用默认值 {default}。")
+        return default
+
+
+def get_rate_limiter(name) -> RateLimiter:
+    """
+    获取指定服务商在当前事件循环中共享的限流器（首次调用时创建）。
+
+    配置来自环境变量，以服务商名称大写为前缀，例如 HUNYUAN_RPM、HUNYUAN_TPM、
+    HUNYUAN_MAX_CONCURRENCY、HUNYUAN_LATENCY_TARGET；未设置 RPM/TPM 时不限制。
+    设置 RATE_LIMIT_DB 后，RPM/TPM 配额由使用同一文件的所有进程共享（见 campaign 的 worker 模式）。
+    """
+    loop_limiters = _limiters.setdefault(asyncio.get_running_loop(), {})
+    if name not in loop_limiters:
+        prefix = name.upper()
+        loop_limiters[name] = RateLimiter(
+            name,
+            rpm=_env_number(f"{prefix}_RPM"),
+            tpm=_env_number(f"{prefix}_TPM"),
+            max_concurrency=_env_number(f"{prefix}_MAX_CONCURRENCY", 5),
+            latency_target=_env_number(f"{prefix}_LATENCY_TARGET", cast=float),
+            shared_db=os.getenv("RATE_LIMIT_DB") or None,
+        )
+    return loop_limiters[name]
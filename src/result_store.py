@@ -0,0 +1,91 @@
+import os
+import json
+from logger import logger
+from table_io import write_table
+
+
+class ResultStore:
+    """
+    追加写入的 JSONL 结果存储：每生成一封邮件立即落盘一行，以联系人邮箱作为主键。
+
+    程序中途崩溃或被中断时，已完成的结果不会丢失；配合 resume 模式可跳过已完成的联系人。
+    同一邮箱出现多条记录时，以最后写入的一条为准。
+    """
+
+    def __init__(self, path, key_field='邮箱'):
+        self.path = path
+        self.key_field = key_field
+        self._tail_checked = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @staticmethod
+    def normalize_key(value) -> str:
+        return str(value).strip().lower()
+
+    def reset(self):
+        """清空存储，开始新一轮生成。"""
+        open(self.path, 'w', encoding='utf-8').close()
+        self._tail_checked = True
+
+    def iter_records(self):
+        """逐行读取存储中的全部记录，跳过因中断而写了一半的行。"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"结果存储 {self.path} 第 {line_no} 行不完整，已忽略。")
+
+    def completed_keys(self) -> set:
+        """返回已完成联系人的邮箱集合。"""
+        return {self.normalize_key(r.get(self.key_field)) for r in self.iter_records()}
+
+    def _ends_with_partial_line(self) -> bool:
+        """上次运行中断时最后一行可能只写了一半（没有换行符）。"""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return False
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) != b'\n'
+        except FileNotFoundError:
+            return False
+
+    def append(self, record: dict):
+        """追加一条结果并立即刷新到磁盘。"""
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        if not self._tail_checked:
+            # 先补上换行符，使写了一半的行单独成行（读取时忽略），新记录不会拼接在它后面而丢失
+            if self._ends_with_partial_line():
+                line = '\n' + line
+            self._tail_checked = True
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+
+    def latest_records(self) -> dict:
+        """按主键去重后的记录：{规范化主键: 最后写入的一条记录}。"""
+        latest = {}
+        for record in self.iter_records():
+            latest[self.normalize_key(record.get(self.key_field))] = record
+        return latest
+
+    def export(self, output_filename) -> int:
+        """
+        将存储中的结果（按邮箱去重，保留最后一条）导出为表格文件，格式按扩展名识别（.xlsx / .csv / .jsonl / .parquet）。
+
+        :return: 导出的记录数。
+        """
+        latest = self.latest_records()
+        if not latest:
+            return 0
+        records = list(latest.values())
+        if any('id' in r for r in records):
+            records.sort(key=lambda r: (r.get('id') is None, r.get('id') or 0))
+        return write_table(output_filename, records)
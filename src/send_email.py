@@ -1,89 +1,352 @@
 import os
-import pandas as pd
+import json
+import asyncio
 from dotenv import load_dotenv
-import yagmail
-import time
-from logger import logger
+from logger import logger, ProgressReporter
+from smtp_sender import AsyncEmailSender, NoSenderAccountError
+from table_io import iter_chunks
+from outbox import Outbox, SENT, DEFERRED, PENDING, FAILED, is_hard_bounce
+from contact_hygiene import ContactHygiene, SuppressedRecipientError, get_suppression_list
+from quality_gate import QUALITY_FIELD
+from metrics import get_metrics, stage_timer
 
 
-def send_generated_emails(filepath=""):
+def _env_flag(key, default=None):
+    value = os.getenv(key)
+    if value is None or value.strip() == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes')
+
+
+def _env_int(key, default=None):
+    value = os.getenv(key)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.error(f"错误：.env 文件中的 {key} 值无效，应为数字。")
+        return default
+
+
+def load_smtp_settings():
     """
-    从指定的 Excel 文件中读取邮件信息，并使用 yagmail 发送。
+    从 .env 文件中读取主发件账户及 SMTP 配置。
 
-    :param filepath: 包含待发送邮件信息的 Excel 文件路径。
+    除 SENDER_EMAIL、SENDER_PASSWORD、SMTP_SERVER、SMTP_PORT 外，还支持：
+    SMTP_SSL（默认 true）、SMTP_STARTTLS（默认非 SSL 时启用）、SMTP_SKIP_LOGIN（默认 false）、
+    SMTP_POOL_SIZE（每个账户的连接数，默认 2）、SENDER_RATE_PER_MINUTE（每个账户每分钟发送上限，默认 12）。
+
+    :return: 配置字典；配置缺失或无效时返回 None。
     """
-    # --- 1. 加载环境变量 ---
     load_dotenv()
     sender_email = os.getenv("SENDER_EMAIL")
     sender_password = os.getenv("SENDER_PASSWORD")
     smtp_server = os.getenv("SMTP_SERVER")
     smtp_port = os.getenv("SMTP_PORT")
+    skip_login = _env_flag("SMTP_SKIP_LOGIN", False)
 
-    if not sender_email or not sender_password:
+    if not sender_email or (not sender_password and not skip_login):
         logger.error("错误：请确保在 .env 文件中设置了 SENDER_EMAIL 和 SENDER_PASSWORD")
-        return
+        return None
 
     if smtp_port:
         try:
             smtp_port = int(smtp_port)
         except ValueError:
             logger.error("错误：.env 文件中的 SMTP_PORT 值无效，应为数字。")
-            return
+            return None
+
+    return {
+        'user': sender_email,
+        'password': sender_password,
+        'host': smtp_server,
+        'port': smtp_port,
+        'ssl': _env_flag("SMTP_SSL", True),
+        'starttls': _env_flag("SMTP_STARTTLS"),
+        'skip_login': skip_login,
+        'pool_size': _env_int("SMTP_POOL_SIZE", 2),
+        'rate_per_minute': _env_int("SENDER_RATE_PER_MINUTE", 12),
+    }
+
+
+def load_sender_accounts():
+    """
+    加载全部发件账户：.env 中的主账户，加上 SENDER_ACCOUNTS_FILE 指向的 JSON 文件中的额外账户。
+
+    JSON 文件为账户列表，字段与 load_smtp_settings 的返回值相同，未填写的字段沿用主账户配置。
+    """
+    primary = load_smtp_settings()
+    if not primary:
+        return []
+    accounts = [primary]
+
+    accounts_file = os.getenv("SENDER_ACCOUNTS_FILE")
+    if accounts_file:
+        try:
+            with open(accounts_file, 'r', encoding='utf-8') as f:
+                extra_accounts = json.load(f)
+            accounts.extend({**primary, **extra} for extra in extra_accounts)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"错误：读取发件账户文件 {accounts_file} 失败: {e}")
+    logger.info(f"已加载 {len(accounts)} 个发件账户。")
+    return accounts
+
+
+def create_email_sender(accounts=None):
+    """
+    创建异步发送引擎，并发数和收件域名限速来自 SEND_CONCURRENCY（默认 4）和 DOMAIN_RATE_PER_MINUTE（默认不限）。
+
+    :return: AsyncEmailSender 实例；没有可用账户时返回 None。
+    """
+    accounts = accounts if accounts is not None else load_sender_accounts()
+    if not accounts:
+        return None
+    return AsyncEmailSender(
+        accounts,
+        max_parallel=_env_int("SEND_CONCURRENCY", 4),
+        domain_rate_per_minute=_env_int("DOMAIN_RATE_PER_MINUTE")
+    )
+
+
+async def deliver_message(outbox, sender, message, progress=None):
+    """
+    发送一封已从发件箱认领的邮件，并把结果写回发件箱。
+
+    :param progress: 可选的 ProgressReporter，用于在控制台汇总发送进度。
+    :return: 发送后的状态（sent / deferred / failed）。
+    """
+    contact_email = message['recipient']
+    suppression = get_suppression_list()
+    with logger.contextualize(contact_id=contact_email):
+        logger.debug(f"正在发送邮件至 {contact_email}，主题: {message['subject']}")
+        try:
+            # 入队之后才退订或退信的地址在发送前再检查一次
+            if contact_email in suppression:
+                raise SuppressedRecipientError("收件人在退订/退信名单中")
+            await sender.send(to=contact_email, subject=message['subject'], contents=message['content'])
+        except NoSenderAccountError as e:
+            outbox.release(message['hash'])  # 邮件本身没有问题，保留在发件箱中等待下次发送
+            logger.error(f"--- 邮件未发送 (收件人: {contact_email}): {e} ---")
+            return PENDING
+        except Exception as e:
+            state = outbox.mark_failed(message['hash'], e)
+            get_metrics().inc('emails_send_total', state=state)
+            if is_hard_bounce(e):
+                suppression.add([contact_email], reason='bounce')  # 之后的生成和发送都会跳过该地址
+            if isinstance(e, SuppressedRecipientError):
+                logger.info(f"收件人 {contact_email} 已退订或退信，跳过发送。")
+            elif state == DEFERRED:
+                logger.warning(f"--- 邮件发送失败 (收件人: {contact_email})，稍后重试: {e} ---")
+            else:
+                logger.error(f"--- 邮件发送失败 (收件人: {contact_email})，不再重试: {e} ---")
+            if progress:
+                progress.update(ok=False)
+            return state
+        outbox.mark_sent(message['hash'])
+        get_metrics().inc('emails_send_total', state=SENT)
+        logger.debug(f"邮件发送成功 (收件人: {contact_email})")
+        if progress:
+            progress.update()
+        return SENT
+
+
+async def deliver_outbox(outbox, sender, max_wait=300, progress=None):
+    """
+    持续发送发件箱中已到期的邮件，直到发件箱清空，或下一封待重试邮件的等待时间超过 max_wait 秒
+    （剩余邮件保留在发件箱中，下次运行时继续）。
+    """
+    progress = progress or ProgressReporter("发送邮件")
+    # 滚动窗口：有邮件发完就补充认领，等待域名限速的邮件不会拖住整批
+    window = sender.max_parallel * 4
+    in_flight = set()
+    while True:
+        if sender.available and len(in_flight) < window:
+            for message in outbox.claim_due(limit=window - len(in_flight)):
+                in_flight.add(asyncio.create_task(deliver_message(outbox, sender, message, progress)))
+        if in_flight:
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()  # 发件箱读写等意外错误照常抛出
+            continue
+        if not sender.available:
+            break
+
+        wait = outbox.seconds_until_next_due()
+        if wait is None:
+            break
+        if wait > max_wait:
+            logger.info(f"剩余待重试邮件最早将在 {wait:.0f} 秒后到期，下次运行时将继续发送。")
+            break
+        await asyncio.sleep(wait)
+    if not sender.available:
+        logger.error("所有发件账户均登录失败，停止发送，剩余邮件保留在发件箱中。请检查账户配置后重新运行。")
+    if progress.done or progress.failed:
+        progress.report()
+
 
-    # --- 2. 读取 Excel 文件 ---
+def log_outbox_summary(outbox):
+    counts = outbox.counts()
+    logger.info("--- 所有邮件处理完毕 ---")
+    logger.info(f"成功发送: {counts.get(SENT, 0)} 封")
+    logger.info(f"等待重试: {counts.get(DEFERRED, 0) + counts.get(PENDING, 0)} 封")
+    logger.info(f"发送失败: {counts.get(FAILED, 0)} 封")
+
+
+def _iter_latest_records(store_path, chunk_size=5000):
+    """按块返回结果存储中每个联系人最后写入的一条记录。"""
+    from result_store import ResultStore
+
+    if not os.path.exists(store_path):
+        raise FileNotFoundError(store_path)
+    records = list(ResultStore(store_path).latest_records().values())
+    for start in range(0, len(records), chunk_size):
+        yield records[start:start + chunk_size]
+
+
+def load_outbox(filepath, outbox, source=None, from_store=False) -> bool:
+    """
+    分块读取生成结果文件，清洗后写入发件箱（同一来源中已有的收件人不会重复加入）。
+
+    :param source: 去重的来源（如活动名称），默认为文件路径。
+    :param from_store: filepath 是追加写入的 JSONL 结果存储（ResultStore）时为 True：同一联系人取最后写入的一条，
+                       resume 时重新生成并通过质检的邮件不会被先前未通过质检的旧记录挡住。
+    :return: 读取成功时为 True。
+    """
+    hygiene = ContactHygiene(get_suppression_list())
+    total = 0
+    rejected = 0
     try:
-        df = pd.read_excel(filepath)
-        logger.info(f"成功读取 {len(df)} 条待发送邮件信息。")
+        with stage_timer('outbox_load'):
+            for chunk in _iter_latest_records(filepath) if from_store else iter_chunks(filepath, chunk_size=5000):
+                total += len(chunk)
+                # 无效、重复、角色邮箱和退订/退信名单中的地址不进入发件箱，未通过质检的邮件也不发送
+                messages = []
+                for _, row in hygiene.clean_chunk(chunk):
+                    if row.get(QUALITY_FIELD):
+                        rejected += 1
+                        continue
+                    messages.append((row['邮箱'], row.get('开发信主题') or 'N/A', row.get('开发信内容') or 'N/A'))
+                outbox.enqueue_many(messages, source=source or filepath)  # 每块一个事务，大文件导入不必逐条提交
     except FileNotFoundError:
         logger.error(f"错误：找不到邮件文件 {filepath}。请先运行主脚本生成该文件。")
-        return
+        return False
     except Exception as e:
-        logger.error(f"读取 Excel 文件时出错: {e}")
+        logger.error(f"读取邮件文件时出错: {e}")
+        return False
+    logger.info(f"成功读取 {total} 条待发送邮件信息。")
+    hygiene.log_summary()
+    if rejected:
+        logger.warning(f"有 {rejected} 封邮件未通过质检（{QUALITY_FIELD} 列），未加入发件箱，修改或重新生成后再发送。")
+    return True
+
+
+def send_generated_emails(filepath="", outbox_path="../email_output/outbox.sqlite"):
+    """
+    从生成结果文件（.xlsx / .csv / .jsonl / .parquet）中分块读取邮件信息，写入持久化发件箱后使用异步发送引擎并发发送。
+
+    发件箱按收件人和文件去重：重复运行同一个文件时，已发送过的收件人不会再次收到邮件（即使邮件重新生成过），
+    只会继续发送剩余和待重试的邮件。
+
+    :param filepath: 包含待发送邮件信息的文件路径。
+    :param outbox_path: 发件箱数据库路径。
+    """
+    # --- 1. 加载发件账户 ---
+    accounts = load_sender_accounts()
+    if not accounts:
         return
 
-    # --- 3. 初始化 yagmail 客户端 ---
-    try:
-        if smtp_server and smtp_port:
-            yag = yagmail.SMTP(user=sender_email, password=sender_password, host=smtp_server, port=smtp_port)
-        else:
-            yag = yagmail.SMTP(user=sender_email, password=sender_password)
-        logger.info("成功连接到邮件服务器。")
-    except Exception as e:
-        logger.error(f"错误：连接邮件服务器失败。请检查您的邮箱地址、密码、网络连接或SMTP配置。详细错误: {e}")
+    # --- 2. 分块读取邮件文件并写入发件箱 ---
+    outbox = Outbox(outbox_path)
+    outbox.recover_interrupted()
+    if not load_outbox(filepath, outbox):
+        outbox.close()
         return
+    logger.info(f"发件箱当前状态: {outbox.counts()}")
 
-    # --- 4. 遍历并发送邮件 ---
-    success_count = 0
-    fail_count = 0
-    for index, row in df.iterrows():
-        contact_email = row.get('邮箱', 'N/A')
-        generated_subject = row.get('开发信主题', 'N/A')
-        generated_content = row.get('开发信内容', 'N/A')
+    # --- 3. 并发发送 ---
+    async def send_all():
+        sender = create_email_sender(accounts)
+        try:
+            await deliver_outbox(outbox, sender)
+        finally:
+            await sender.close()
 
-        if pd.isna(contact_email) or contact_email == 'N/A':
-            logger.warning(f"跳过第 {int(index) + 1} 行：邮箱地址无效。")
-            continue
+    try:
+        asyncio.run(send_all())
+    finally:
+        log_outbox_summary(outbox)
+        outbox.close()
 
-        logger.info(f"===== 正在发送邮件至 {contact_email}... =====")
-        logger.info(f"主题: {generated_subject}")
 
-        try:
-            yag.send(
-                to=contact_email,
-                subject=generated_subject,
-                contents=generated_content
-            )
-            logger.success(f"--- 邮件发送成功！ ---")
-            success_count += 1
-        except Exception as e:
-            logger.error(f"--- 邮件发送失败: {e} ---")
-            fail_count += 1
+async def send_emails_from_queue(queue, approval_policy=None, sender=None, outbox=None, source='pipeline'):
+    """
+    从 asyncio.Queue 中取出已生成的邮件，审核通过后写入发件箱并立即发送；多个发送协程并发消费队列，
+    实际节奏由发送引擎按发件账户和收件域名限速控制。队列结束后继续重试到期的失败邮件。
 
-        time.sleep(5)
+    队列中放入 None 表示上游已结束。未通过审核的邮件不会发送，而是汇总返回，供人工复核。
 
-    logger.info("--- 所有邮件处理完毕 ---")
-    logger.info(f"成功发送: {success_count} 封")
-    logger.info(f"发送失败: {fail_count} 封")
+    :param queue: 上游生成阶段写入的 asyncio.Queue。
+    :param approval_policy: 审核策略，需提供 review(email) -> (bool, reason) 方法；为 None 时全部放行。
+    :param sender: AsyncEmailSender 实例；为 None 时按 .env 配置创建。
+    :param outbox: Outbox 实例；为 None 时使用默认路径的发件箱，结束时由本函数关闭。
+    :param source: 发件箱去重的来源，同一来源中每个收件人只发送一次。
+    :return: 待人工复核的邮件列表。
+    """
+    if sender is None:
+        sender = create_email_sender()
+    if not sender:
+        logger.error("发送阶段无法启动，所有邮件将转入人工复核队列。")
+    owns_outbox = outbox is None
+    if owns_outbox:
+        outbox = Outbox()
+
+    review_queue = []
+    progress = ProgressReporter("发送邮件")
+
+    async def consumer():
+        while True:
+            email = await queue.get()
+            get_metrics().set_gauge('queue_depth', queue.qsize(), queue='send')
+            if email is None:
+                await queue.put(None)  # 把结束信号留给其他发送协程
+                break
+
+            contact_email = email.get('邮箱', 'N/A')
+            if not sender or not sender.available:
+                review_queue.append({**email, '复核原因': "发送阶段不可用"})
+                continue
+
+            approved, reason = approval_policy.review(email) if approval_policy else (True, "")
+            if not approved:
+                logger.warning(f"邮件 (收件人: {contact_email}) 未通过自动审核: {reason}，已转入人工复核队列。")
+                review_queue.append({**email, '复核原因': reason})
+                continue
+
+            key = outbox.enqueue(contact_email, email.get('开发信主题', 'N/A'), email.get('开发信内容', 'N/A'),
+                                 source=source)
+            message = outbox.claim(key)
+            if message is None:
+                # resume 时上次已发送的邮件也会再次进入队列，这里按发件箱去重
+                logger.debug(f"邮件 (收件人: {contact_email}) 已发送过或正在等待重试，跳过。")
+                continue
+            await deliver_message(outbox, sender, message, progress)
+
+    try:
+        outbox.recover_interrupted()
+        await asyncio.gather(*(consumer() for _ in range(sender.max_parallel if sender else 1)))
+        if sender:
+            await deliver_outbox(outbox, sender, progress=progress)
+    finally:
+        if sender:
+            await sender.close()
+        log_outbox_summary(outbox)
+        if owns_outbox:
+            outbox.close()
+
+    if review_queue:
+        logger.info(f"待人工复核: {len(review_queue)} 封")
+    return review_queue
 
 
 # --- 主程序入口 ---
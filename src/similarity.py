@@ -0,0 +1,176 @@
+import os
+import re
+import zlib
+from collections import defaultdict
+from logger import logger
+from metrics import get_metrics
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def _numpy():
+    import numpy  # pandas 的依赖，随 pandas 一起安装；只在启用相似度复用时才导入
+    return numpy
+
+
+def normalize_profile(text) -> str:
+    """规范化公司简介：小写、去掉标点、合并空白，使只有标点或大小写不同的简介得到相同的分片。"""
+    return _NON_WORD.sub(' ', str(text or '').lower()).strip()
+
+
+def shingles(text, k=5) -> set:
+    """
+    字符级 k-shingle 集合。按字符而不是按词切分，中文简介（没有空格分词）和英文简介都适用。
+    """
+    text = normalize_profile(text)
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+class MinHasher:
+    """
+    MinHash 签名：用 num_perm 个随机线性哈希 (a·x + b) mod p 近似随机排列，两段文本签名中相同位置取值相等的比例
+    是它们 shingle 集合 Jaccard 相似度的无偏估计。签名计算用 NumPy 对整组 shingle 向量化完成。
+    """
+
+    def __init__(self, num_perm=64, shingle_size=5, seed=1):
+        np = _numpy()
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        """返回长度为 num_perm 的 uint32 签名；文本为空时返回 None。"""
+        np = _numpy()
+        grams = shingles(text, self.shingle_size)
+        if not grams:
+            return None
+        values = np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+        # 按 (a·x + b) mod p 计算，x < 2^32、a < 2^61，乘积在 uint64 中回绕；回绕后仍是确定的哈希，不影响估计
+        hashed = (np.outer(self._a, values) + self._b[:, None]) % np.uint64(_MERSENNE_PRIME)
+        return (hashed & np.uint64(_MAX_HASH)).min(axis=1).astype(np.uint32)
+
+    @staticmethod
+    def similarity(sig_a, sig_b) -> float:
+        """由两个签名估计 Jaccard 相似度。"""
+        return _numpy().count_nonzero(sig_a == sig_b) / len(sig_a)
+
+
+class SimilarityIndex:
+    """
+    公司简介的近重复索引（MinHash + LSH）：签名切成 bands 段，每段整体作为哈希桶的键，
+    任意一段完全相同的两个签名成为候选，再用签名估计的相似度确认。建索引和查询都只访问 bands 个桶，
+    不与全部已有记录逐一比较，十万级联系人时单次查询的代价仍与名单长度基本无关。
+
+    索引中只放每个簇的"代表"（leader）：assign 找到相似度不低于 threshold 且未满员的代表时返回它，
+    否则把当前联系人登记为新的代表。
+    """
+
+    def __init__(self, threshold=0.8, num_perm=64, bands=16, max_cluster_size=50, min_profile_chars=40,
+                 max_candidates=50):
+        """
+        :param threshold: 判定为近重复的估计 Jaccard 相似度下限。
+        :param bands: LSH 分段数，num_perm 需能被整除；每段 num_perm / bands 行。
+                      默认 16×4 时相似度 0.8 的一对简介成为候选的概率约 99.9%，0.5 时约 65%，再由 threshold 过滤。
+        :param max_cluster_size: 每个代表最多被复用的次数，满员后相似的联系人另立代表，避免大量邮件出自同一份草稿。
+        :param min_profile_chars: 简介（规范化后）短于该长度时不参与聚类，信息太少，相似度没有意义。
+        :param max_candidates: 每次查询最多确认的候选数，防止大量相似度略低于阈值的简介挤在同一个桶里。
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) 必须能被 bands ({bands}) 整除")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_cluster_size = max_cluster_size
+        self.min_profile_chars = min_profile_chars
+        self.max_candidates = max_candidates
+        self.hasher = MinHasher(num_perm=num_perm)
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+        self._signatures = {}  # 代表 -> 签名
+        self.members = defaultdict(int)  # 代表 -> 已复用次数
+        self._released = set()
+        self.skipped = 0
+
+    def _band_keys(self, signature):
+        raw = signature.tobytes()
+        width = self.rows * signature.itemsize
+        return [raw[i * width:(i + 1) * width] for i in range(self.bands)]
+
+    def _candidates(self, band_keys):
+        seen = set()
+        for band, key in enumerate(band_keys):
+            for leader in self._buckets[band].get(key, ()):
+                if leader not in seen:
+                    seen.add(leader)
+                    yield leader
+                    if len(seen) >= self.max_candidates:
+                        return
+
+    def query(self, profile):
+        """返回与 profile 最相似且未满员的代表及其相似度 (key, similarity)，没有时返回 (None, 0.0)。不修改索引。"""
+        if len(normalize_profile(profile)) < self.min_profile_chars:
+            return None, 0.0
+        signature = self.hasher.signature(profile)
+        return self._best(signature, self._band_keys(signature))
+
+    def _best(self, signature, band_keys):
+        best, best_similarity = None, 0.0
+        for leader in self._candidates(band_keys):
+            if leader in self._released or self.members.get(leader, 0) >= self.max_cluster_size:
+                continue
+            similarity = MinHasher.similarity(signature, self._signatures[leader])
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = leader, similarity
+        return best, best_similarity
+
+    def assign(self, key, profile):
+        """
+        为联系人分配簇：找到近重复且未满员的代表时计为该簇成员并返回代表的 key；否则把该联系人登记为新代表，返回 None。
+        简介过短时不参与聚类，返回 None 且不登记。
+        """
+        if len(normalize_profile(profile)) < self.min_profile_chars:
+            self.skipped += 1
+            return None
+        signature = self.hasher.signature(profile)
+        band_keys = self._band_keys(signature)
+        leader, _ = self._best(signature, band_keys)
+        if leader is not None:
+            self.members[leader] += 1
+            return leader
+        self._signatures[key] = signature
+        for band, band_key in enumerate(band_keys):
+            self._buckets[band][band_key].append(key)
+        return None
+
+    def release(self, leader):
+        """代表的草稿不可用（生成失败或未通过质检）时调用，之后相似的联系人不再分配给它。"""
+        self._released.add(leader)
+
+    def is_leader(self, key) -> bool:
+        return key in self._signatures
+
+    @property
+    def leaders(self) -> int:
+        return len(self._signatures)
+
+    def log_summary(self):
+        reused = sum(self.members.values())
+        if reused:
+            logger.info(f"相似公司聚类：{self.leaders} 个簇，{reused} 个联系人分配到已有的簇。")
+        get_metrics().set_gauge('similarity_clusters', self.leaders)
+
+
+def create_similarity_index() -> SimilarityIndex:
+    """按环境变量 SIMILARITY_THRESHOLD（默认 0.8）和 SIMILARITY_MAX_CLUSTER（默认 50）创建相似度索引。"""
+    try:
+        threshold = float(os.getenv("SIMILARITY_THRESHOLD") or 0.8)
+        max_cluster_size = int(os.getenv("SIMILARITY_MAX_CLUSTER") or 50)
+    except ValueError:
+        logger.warning(".env 文件中的 SIMILARITY_THRESHOLD / SIMILARITY_MAX_CLUSTER 值无效，已使用默认值。")
+        threshold, max_cluster_size = 0.8, 50
+    return SimilarityIndex(threshold=threshold, max_cluster_size=max_cluster_size)
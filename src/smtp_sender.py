@@ -0,0 +1,206 @@
+import os
+import asyncio
+import smtplib
+import itertools
+from collections import OrderedDict
+from logger import logger
+from rate_limit import TokenBucket, SharedTokenBucket
+from metrics import get_metrics, stage_timer
+
+# 连接层面的异常：连接已断开或网络异常，丢弃该连接后重连重试即可
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+class NoSenderAccountError(RuntimeError):
+    """所有发件账户都已停用（登录失败），无法发送。"""
+
+
+def _open_connection(account):
+    """按账户配置建立并登录一个 SMTP 连接（阻塞操作，需在线程中调用）。"""
+    host = account.get('host') or 'smtp.gmail.com'
+    use_ssl = account.get('ssl', True)
+    port = account.get('port') or (465 if use_ssl else 587)
+    starttls = account.get('starttls')
+    if starttls is None:
+        starttls = not use_ssl
+
+    connection_class = smtplib.SMTP_SSL if use_ssl else smtplib.SMTP
+    smtp = connection_class(host, port, timeout=account.get('timeout', 30))
+    if starttls:
+        smtp.ehlo()
+        smtp.starttls()
+        smtp.ehlo()
+    if not account.get('skip_login'):
+        smtp.login(account['user'], account['password'])
+    return smtp
+
+
+def _close_connection(smtp):
+    try:
+        smtp.quit()
+    except Exception:
+        pass
+
+
+class SMTPConnectionPool:
+    """
+    单个发件账户的 SMTP 连接池：按需建立连接、复用空闲连接，连接断开时丢弃并重建。
+    """
+
+    def __init__(self, account, size=2):
+        self.account = account
+        self.size = size
+        self._idle = []
+        self._created = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._idle or self._created < self.size)
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        try:
+            return await asyncio.to_thread(_open_connection, self.account)
+        except Exception:
+            async with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    async def release(self, smtp, broken=False):
+        """归还连接；broken=True 表示连接已不可用，直接关闭并允许池中重建新连接。"""
+        if broken:
+            await asyncio.to_thread(_close_connection, smtp)
+        async with self._cond:
+            if broken:
+                self._created -= 1
+            else:
+                self._idle.append(smtp)
+            self._cond.notify()
+
+    async def close(self):
+        async with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for smtp in idle:
+            await asyncio.to_thread(_close_connection, smtp)
+
+
+class AsyncEmailSender:
+    """
+    异步并发发送引擎：多个发件账户轮流使用，每个账户维护一个 SMTP 连接池，
+    按发件账户和收件人域名分别限速，在限速范围内并发发送。
+
+    本地调试时可用 aiosmtpd 充当邮件服务器，例如
+    ``python -m aiosmtpd -n -l localhost:8025``，并在 .env 中设置
+    SMTP_SERVER=localhost、SMTP_PORT=8025、SMTP_SSL=false、SMTP_SKIP_LOGIN=true。
+    """
+
+    def __init__(self, accounts, max_parallel=4, domain_rate_per_minute=None, max_domain_buckets=10000):
+        """
+        :param accounts: 发件账户配置列表（见 send_email.load_sender_accounts）。
+        :param max_parallel: 同时进行的发送数上限。
+        :param domain_rate_per_minute: 每个收件人域名每分钟最多发送的邮件数，为 None 时不限制。
+        :param max_domain_buckets: 最多保留的域名令牌桶数，超出时淘汰最久未使用的域名。令牌桶容量为 1，
+                                   闲置超过一个发送间隔后本来就是满的，淘汰后重建不会放宽限速。
+
+        设置 RATE_LIMIT_DB 后，账户和域名的限速由使用同一文件的所有 worker 进程共享，
+        多进程发送时每个账户的实际速率仍不超过配置值。
+        """
+        if not accounts:
+            raise ValueError("至少需要配置一个发件账户")
+        self.accounts = accounts
+        self.pools = [SMTPConnectionPool(a, size=a.get('pool_size', 2)) for a in accounts]
+        # 每个账户的令牌桶容量为 1，使发送节奏均匀，不会在启动时突发
+        self.shared_db = os.getenv("RATE_LIMIT_DB") or None
+        self.sender_buckets = [self._bucket(f"smtp:account:{a['user']}", a.get('rate_per_minute')) for a in accounts]
+        import yagmail
+        # yagmail 只用于构造邮件内容（与原先 yag.send 的格式保持一致），不负责连接
+        self.formatters = [yagmail.SMTP(user=a['user'], password=a.get('password'), smtp_skip_login=True)
+                           for a in accounts]
+        self.domain_rate_per_minute = domain_rate_per_minute
+        self.domain_buckets = OrderedDict()
+        self.max_domain_buckets = max_domain_buckets
+        self.max_parallel = max_parallel
+        self._parallel = asyncio.Semaphore(max_parallel)
+        self._round_robin = itertools.cycle(range(len(accounts)))
+        self.disabled = set()  # 登录失败而停用的账户序号
+
+    @property
+    def available(self) -> bool:
+        """是否还有可用的发件账户。"""
+        return len(self.disabled) < len(self.accounts)
+
+    def _next_account(self) -> int:
+        for _ in range(len(self.accounts)):
+            index = next(self._round_robin)
+            if index not in self.disabled:
+                return index
+        raise NoSenderAccountError("所有发件账户均登录失败")
+
+    def _disable(self, index, error):
+        if index not in self.disabled:
+            self.disabled.add(index)
+            get_metrics().inc('smtp_accounts_disabled_total')
+            logger.error(f"发件账户 {self.accounts[index]['user']} 登录失败，已停用: {error}")
+
+    def _bucket(self, key, rate_per_minute):
+        if self.shared_db and rate_per_minute:
+            return SharedTokenBucket(self.shared_db, key, rate_per_minute, capacity=1)
+        return TokenBucket(rate_per_minute, capacity=1)
+
+    def _domain_bucket(self, to):
+        domain = str(to).rsplit('@', 1)[-1].strip().lower()
+        bucket = self.domain_buckets.get(domain)
+        if bucket is None:
+            bucket = self.domain_buckets[domain] = self._bucket(f"smtp:domain:{domain}", self.domain_rate_per_minute)
+            if len(self.domain_buckets) > self.max_domain_buckets:
+                self.domain_buckets.popitem(last=False)
+        else:
+            self.domain_buckets.move_to_end(domain)
+        return bucket
+
+    async def send(self, to, subject, contents):
+        """
+        发送一封邮件，连接断开时自动重连重试一次；发件账户登录失败时停用该账户并改用其他账户。
+
+        :return: 实际使用的发件账户地址。
+        :raises NoSenderAccountError: 所有发件账户都已停用。
+        :raises: 发送失败时抛出 smtplib 异常。
+        """
+        # 先等限速再占用并发名额：某个域名被限速时只有发往该域名的邮件在等待，不会挡住其他域名
+        await self._domain_bucket(to).acquire()
+        while True:
+            index = self._next_account()
+            await self.sender_buckets[index].acquire()
+            try:
+                async with self._parallel:
+                    return await self._send_with(index, to, subject, contents)
+            except smtplib.SMTPAuthenticationError as e:
+                self._disable(index, e)
+
+    async def _send_with(self, index, to, subject, contents):
+        recipients, message = self.formatters[index].prepare_send(to=to, subject=subject, contents=contents)
+        pool = self.pools[index]
+        for attempt in range(2):
+            smtp = await pool.acquire()
+            try:
+                with stage_timer('smtp_send'):
+                    await asyncio.to_thread(smtp.sendmail, self.accounts[index]['user'], recipients, message)
+            except CONNECTION_ERRORS as e:
+                await pool.release(smtp, broken=True)
+                if attempt == 0:
+                    get_metrics().inc('smtp_reconnects_total')
+                    logger.warning(f"SMTP 连接已断开 ({e})，正在重连...")
+                    continue
+                raise
+            except Exception:
+                await pool.release(smtp)  # 收件人被拒等协议层错误，连接本身仍可复用
+                raise
+            await pool.release(smtp)
+            return self.accounts[index]['user']
+
+    async def close(self):
+        for pool in self.pools:
+            await pool.close()
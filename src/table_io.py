@@ -0,0 +1,321 @@
+import os
+import csv
+import json
+import math
+from logger import logger
+from metrics import stage_timer
+
+# 按扩展名识别表格格式；Excel 读写较慢、内存占用大，大批量数据建议使用 CSV / JSONL / Parquet
+FORMATS = {
+    '.xlsx': 'xlsx',
+    '.xlsm': 'xlsx',
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+}
+
+
+def table_format(path) -> str:
+    """根据扩展名返回表格格式（xlsx / csv / jsonl / parquet），不支持时抛出 ValueError。"""
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"不支持的表格文件格式: {ext}（支持 {', '.join(sorted(FORMATS))}）")
+    return FORMATS[ext]
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("读写 Parquet 文件需要安装 pyarrow（pip install -e .[parquet]）") from e
+    return pyarrow
+
+
+def _cell(value):
+    """把单元格的值转换为可写入 CSV / Excel 的标量：None 和 NaN 写为空，列表和字典写为 JSON。"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return value
+
+
+# --- 读取 ---
+
+def _iter_xlsx_rows(filepath, batch_size):
+    """以 openpyxl 只读模式逐行读取 Excel，内存占用与文件行数无关。"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c).strip() if c is not None else '' for c in header]
+        for values in rows:
+            if values is None or all(v is None for v in values):
+                continue
+            yield dict(zip(columns, values))
+    finally:
+        workbook.close()
+
+
+def _iter_csv_rows(filepath, batch_size):
+    """逐行读取 CSV 文件（兼容带 BOM 的 UTF-8）。"""
+    with open(filepath, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f):
+            yield {(k or '').strip(): v for k, v in row.items()}
+
+
+def _iter_jsonl_rows(filepath, batch_size):
+    """逐行读取 JSONL 文件，跳过空行和写了一半的行。"""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"{filepath} 第 {line_no} 行不是有效的 JSON，已忽略。")
+
+
+def _iter_parquet_rows(filepath, batch_size):
+    """按批读取 Parquet 文件，每次只把一批行转换为字典。"""
+    pyarrow = _import_pyarrow()
+    parquet_file = pyarrow.parquet.ParquetFile(filepath)
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+_READERS = {
+    'xlsx': _iter_xlsx_rows,
+    'csv': _iter_csv_rows,
+    'jsonl': _iter_jsonl_rows,
+    'parquet': _iter_parquet_rows,
+}
+
+
+def iter_rows(filepath, batch_size=1000):
+    """
+    流式逐行读取表格文件，产出行字典，无需把整张表读入内存。
+
+    :param filepath: 表格文件路径，格式按扩展名识别（.xlsx / .csv / .jsonl / .parquet）。
+    :param batch_size: Parquet 每批读取的行数。
+    """
+    return _READERS[table_format(filepath)](filepath, batch_size)
+
+
+def iter_chunks(filepath, chunk_size=1000):
+    """
+    分块流式读取表格文件，每次产出一个由行字典组成的列表。
+
+    :param chunk_size: 每块的行数。
+    """
+    chunk = []
+    for row in iter_rows(filepath, batch_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+    logger.debug(f"表格文件 {filepath} 读取完毕。")
+
+
+# --- 写入 ---
+
+class TableWriter:
+    """
+    增量写入表格文件：逐条或逐批调用 write，数据随写随落盘（Excel 除外，关闭时才保存）。
+
+    列名取自 columns 参数，未指定时取第一条记录的键；之后记录中多出的键会被忽略。
+    用法::
+
+        with open_writer("generated.csv") as writer:
+            for record in records:
+                writer.write(record)
+    """
+
+    def __init__(self, path, columns=None, append=False):
+        self.path = path
+        self.columns = list(columns) if columns else None
+        self.append = append
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, record: dict):
+        self.write_many([record])
+
+    def write_many(self, records):
+        records = list(records)
+        if not records:
+            return
+        if self.columns is None:
+            self.columns = list(records[0].keys())
+        self._write(records)
+        self.count += len(records)
+
+    def _write(self, records):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+class CSVWriter(TableWriter):
+    """CSV 写入器；追加到已有文件时沿用其表头。新文件带 BOM，便于 Excel 直接打开。"""
+
+    def __init__(self, path, columns=None, append=False):
+        super().__init__(path, columns, append)
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        if exists and self.columns is None:
+            with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+                self.columns = next(csv.reader(f), None)
+        self._file = open(path, 'a' if exists else 'w', encoding='utf-8' if exists else 'utf-8-sig', newline='')
+        self._writer = None
+        self._needs_header = not exists
+
+    def _write(self, records):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._file, fieldnames=self.columns, extrasaction='ignore')
+            if self._needs_header:
+                self._writer.writeheader()
+        self._writer.writerows({k: _cell(record.get(k)) for k in self.columns} for record in records)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JSONLWriter(TableWriter):
+    """JSONL 写入器：每条记录一行，保留记录中的全部字段。"""
+
+    def __init__(self, path, columns=None, append=False):
+        super().__init__(path, columns, append)
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8')
+
+    def _write(self, records):
+        self._file.writelines(json.dumps(r, ensure_ascii=False, default=str) + '\n' for r in records)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter(TableWriter):
+    """
+    Parquet 写入器：缓存 row_group_size 行后写出一个 row group。
+
+    Parquet 文件不支持追加，append=True 时抛出 ValueError。列类型按第一批数据推断。
+    """
+
+    def __init__(self, path, columns=None, append=False, row_group_size=10000):
+        if append:
+            raise ValueError("Parquet 文件不支持追加写入，请改用 CSV 或 JSONL")
+        super().__init__(path, columns, append)
+        self.row_group_size = row_group_size
+        self._pyarrow = _import_pyarrow()
+        self._writer = None
+        self._buffer = []
+
+    def _write(self, records):
+        self._buffer.extend(records)
+        if len(self._buffer) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        rows = [{k: record.get(k) for k in self.columns} for record in self._buffer]
+        self._buffer = []
+        if self._writer is None:
+            pa = self._pyarrow
+            table = pa.Table.from_pylist(rows)
+            # 第一批中全为空的列无法推断类型，按字符串处理，避免后续批次写入时类型不匹配
+            schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                for field in table.schema])
+            table = table.cast(schema)
+            self._writer = pa.parquet.ParquetWriter(self.path, schema)
+        else:
+            table = self._pyarrow.Table.from_pylist(rows, schema=self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class ExcelWriter(TableWriter):
+    """
+    Excel 写入器：使用 openpyxl 的 write_only 模式逐行写入，比 pandas.to_excel 快且不需要构造 DataFrame。
+
+    Excel 只作为导出格式，不支持追加，关闭时才保存文件。
+    """
+
+    def __init__(self, path, columns=None, append=False):
+        if append:
+            raise ValueError("Excel 文件不支持追加写入，请改用 CSV 或 JSONL")
+        super().__init__(path, columns, append)
+        from openpyxl import Workbook
+
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet()
+        self._header_written = False
+
+    def _write(self, records):
+        if not self._header_written:
+            self._sheet.append(self.columns)
+            self._header_written = True
+        for record in records:
+            self._sheet.append([_cell(record.get(k)) for k in self.columns])
+
+    def close(self):
+        if not self._header_written and self.columns:
+            self._sheet.append(self.columns)
+        self._workbook.save(self.path)
+
+
+_WRITERS = {
+    'xlsx': ExcelWriter,
+    'csv': CSVWriter,
+    'jsonl': JSONLWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def open_writer(path, columns=None, append=False) -> TableWriter:
+    """
+    按扩展名创建对应格式的增量写入器。
+
+    :param columns: 列名列表，未指定时取第一条记录的键。
+    :param append: 追加到已有文件（仅 CSV 和 JSONL 支持）。
+    """
+    return _WRITERS[table_format(path)](path, columns=columns, append=append)
+
+
+def write_table(path, records, columns=None) -> int:
+    """
+    把一组记录写入表格文件，格式按扩展名识别。未指定 columns 时使用所有记录中出现过的键（按首次出现的顺序）。
+
+    :return: 写入的记录数。
+    """
+    records = list(records)
+    if columns is None:
+        columns = list(dict.fromkeys(k for record in records for k in record))
+    with stage_timer('table_write', format=table_format(path)):
+        with open_writer(path, columns=columns) as writer:
+            writer.write_many(records)
+    return writer.count
@@ -0,0 +1,36 @@
+from contact_hygiene import ContactHygiene, SuppressionList
+
+
+def test_clean_chunk_normalizes_and_filters(tmp_path):
+    suppression = SuppressionList(str(tmp_path / "suppression.sqlite"))
+    suppression.add(['gone@example.com', 'blocked-domain.com'])
+    hygiene = ContactHygiene(suppression, drop_role_accounts=True)
+    rows = [
+        {'邮箱': ' Mailto:<Anna@Example.com> '},
+        {'邮箱': 'anna@example.com'},
+        {'邮箱': 'info@example.com'},
+        {'邮箱': 'noreply@example.com'},
+        {'邮箱': 'not-an-email'},
+        {'邮箱': None},
+        {'邮箱': 'gone@example.com'},
+        {'邮箱': 'bob@blocked-domain.com'},
+        {'邮箱': 'bob+news@example.org'},
+    ]
+
+    kept = hygiene.clean_chunk(rows)
+
+    assert [(position, row['邮箱']) for position, row in kept] == [(0, 'anna@example.com'), (8, 'bob+news@example.org')]
+    assert hygiene.counts == {'duplicate': 1, 'role_account': 1, 'blocked': 1, 'invalid': 1, 'empty': 1,
+                              'suppressed': 2}
+    suppression.close()
+
+
+def test_clean_chunk_dedupes_across_chunks():
+    hygiene = ContactHygiene(drop_role_accounts=False)
+    assert len(hygiene.clean_chunk([{'邮箱': 'a@example.com'}, {'邮箱': 'info@example.com'}])) == 2
+    assert hygiene.clean_chunk([{'邮箱': 'A@example.com'}]) == []
+    assert hygiene.counts == {'duplicate': 1}
+
+
+def test_clean_chunk_empty():
+    assert ContactHygiene().clean_chunk([]) == []
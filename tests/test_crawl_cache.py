@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from crawl_cache import CachedCrawler, CrawlCache, CrawlCacheMiss, normalize_url
+
+
+class FakeResult:
+    def __init__(self, url, markdown, headers=None):
+        self.url = url
+        self.markdown = markdown
+        self.status_code = 200
+        self.response_headers = headers or {}
+        self.links = {}
+        self.success = True
+
+
+class FakeCrawler:
+    """代替 AsyncWebCrawler：记录启动次数和访问过的 URL，不访问网络。"""
+
+    def __init__(self, pages, headers=None):
+        self.pages = pages
+        self.headers = headers or {}
+        self.started = 0
+        self.fetched = []
+
+    def __call__(self):
+        return self
+
+    async def start(self):
+        self.started += 1
+
+    async def close(self):
+        pass
+
+    async def arun(self, url, **kwargs):
+        self.fetched.append(url)
+        return FakeResult(url, self.pages[url], self.headers.get(url))
+
+
+def crawl(cache, crawler, *urls):
+    async def main():
+        async with CachedCrawler(cache=cache, crawler_factory=crawler) as cached:
+            return [await cached.arun(url) for url in urls]
+    return asyncio.run(main())
+
+
+def test_normalize_url():
+    assert normalize_url(' HTTPS://Example.COM/products/#top ') == 'https://example.com/products'
+    assert normalize_url('https://example.com') == 'https://example.com/'
+
+
+def test_second_crawl_is_served_from_cache(tmp_path):
+    cache = CrawlCache(str(tmp_path / "crawl"), offline=False, bypass=False)
+    crawler = FakeCrawler({'https://a.com/': '# A home', 'https://a.com/products': '# A products'})
+
+    first = crawl(cache, crawler, 'https://a.com/', 'https://a.com/products')
+    assert [page.markdown for page in first] == ['# A home', '# A products']
+
+    crawler.started = 0
+    second = crawl(cache, crawler, 'https://A.com', 'https://a.com/products/')
+    assert all(page.from_cache for page in second)
+    assert crawler.started == 0  # 全部命中时不启动浏览器
+    assert crawler.fetched == ['https://a.com/', 'https://a.com/products']
+    assert cache.stats()['hits'] == 2
+
+
+def test_identical_bodies_are_stored_once(tmp_path):
+    cache = CrawlCache(str(tmp_path / "crawl"), offline=False, bypass=False)
+    cache.put('https://a.com/', 'same body')
+    cache.put('https://www.a.com/', 'same body')
+    stats = cache.stats()
+    assert stats['pages'] == 2 and stats['unique_bodies'] == 1
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    cache = CrawlCache(str(tmp_path / "crawl"), max_bytes=25, offline=False, bypass=False)
+    cache.put('https://a.com/', 'a' * 10)
+    cache.put('https://b.com/', 'b' * 10)
+    time.sleep(0.01)
+    cache.touch('https://a.com/')
+    cache.put('https://c.com/', 'c' * 10)
+    assert cache.get('https://a.com/') is not None
+    assert cache.get('https://b.com/') is None
+    assert cache.get('https://c.com/') is not None
+
+
+def test_offline_run_from_snapshot(tmp_path):
+    cache = CrawlCache(str(tmp_path / "crawl"), offline=False, bypass=False)
+    cache.put('https://a.com/', '# A home')
+    cache.snapshot(str(tmp_path / "snapshot"))
+
+    offline = CrawlCache(str(tmp_path / "snapshot"), ttl_seconds=0, offline=True, bypass=False)
+    crawler = FakeCrawler({})
+    [page] = crawl(offline, crawler, 'https://a.com/')
+    assert page.markdown == '# A home'
+    with pytest.raises(CrawlCacheMiss):
+        crawl(offline, crawler, 'https://b.com/')
+    assert crawler.started == 0 and crawler.fetched == []
+
+
+@pytest.fixture
+def etag_server():
+    """本地 HTTP 服务：If-None-Match 与当前 ETag 相同时返回 304。"""
+    state = {'etag': '"v1"', 'requests': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state['requests'] += 1
+            if self.headers.get('If-None-Match') == state['etag']:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', state['etag'])
+            self.end_headers()
+            self.wfile.write(b'changed')
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/", state
+    server.shutdown()
+    server.server_close()
+
+
+def test_stale_entry_is_revalidated_with_etag(tmp_path, etag_server):
+    url, state = etag_server
+    cache = CrawlCache(str(tmp_path / "crawl"), ttl_seconds=0, offline=False, bypass=False)
+    crawler = FakeCrawler({url: '# v1'}, headers={url: {'ETag': '"v1"'}})
+    crawl(cache, crawler, url)
+    time.sleep(0.01)
+
+    [page] = crawl(cache, crawler, url)  # 已过期，服务器返回 304
+    assert page.from_cache and cache.revalidated == 1
+    assert crawler.fetched == [url]
+
+    state['etag'] = '"v2"'
+    time.sleep(0.01)
+    crawler.pages[url] = '# v2'
+    [page] = crawl(cache, crawler, url)  # 页面已变化，重新爬取
+    assert page.markdown == '# v2' and crawler.fetched == [url, url]
+    assert state['requests'] == 2
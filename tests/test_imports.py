@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+@pytest.mark.parametrize('module', ['cli', 'generate_email', 'iterative_analysis', 'send_email', 'campaign'])
+def test_import_without_credentials(module, tmp_path):
+    """没有 API Key 时也能导入，导入时不创建 LLM 客户端、不退出进程。"""
+    env = {k: v for k, v in os.environ.items() if not k.endswith('_API_KEY')}
+    env['PYTHONPATH'] = SRC
+    result = subprocess.run([sys.executable, '-c', f'import {module}'], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,60 @@
+import time
+
+from job_queue import DONE, FAILED, LEASED, PENDING, JobQueue
+
+
+def states(queue, kind='generate'):
+    return queue.counts().get(kind, {})
+
+
+def test_claim_is_exclusive_until_lease_expires(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), lease_seconds=0.2)
+    queue.submit('c1', 'generate', {'shard': 0})
+
+    [job] = queue.claim('worker-a')
+    assert job['payload'] == {'shard': 0} and job['state'] == LEASED
+    assert queue.claim('worker-b') == []
+
+    time.sleep(0.3)
+    [reclaimed] = queue.claim('worker-b')
+    assert reclaimed['id'] == job['id'] and reclaimed['attempts'] == 2
+
+    queue.complete(job['id'], 'worker-a')  # 租约已被接管，原 worker 的结果不生效
+    assert states(queue) == {LEASED: 1}
+    queue.complete(job['id'], 'worker-b', result={'failed': 0})
+    assert states(queue) == {DONE: 1}
+    assert queue.finished_jobs('c1', 'generate')[0]['result'] == {'failed': 0}
+    queue.close()
+
+
+def test_heartbeat_extends_lease(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), lease_seconds=0.3)
+    queue.submit('c1', 'generate', {})
+    [job] = queue.claim('worker-a')
+    time.sleep(0.2)
+    assert queue.heartbeat('worker-a', [job['id']]) == 1
+    time.sleep(0.2)
+    assert queue.claim('worker-b') == []
+    queue.close()
+
+
+def test_expired_lease_fails_after_max_attempts(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), lease_seconds=0.05, max_attempts=2)
+    queue.submit('c1', 'send', {})
+    for worker in ('worker-a', 'worker-b'):
+        assert len(queue.claim(worker)) == 1
+        time.sleep(0.1)
+    assert queue.claim('worker-c') == []
+    assert states(queue, 'send') == {FAILED: 1}
+    assert queue.active_count() == 0
+    queue.close()
+
+
+def test_fail_requeues_until_max_attempts(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), max_attempts=2)
+    queue.submit('c1', 'generate', {})
+    [job] = queue.claim('worker-a')
+    assert queue.fail(job['id'], 'worker-a', RuntimeError("boom")) == PENDING
+    [job] = queue.claim('worker-a')
+    assert queue.fail(job['id'], 'worker-a', RuntimeError("boom")) == FAILED
+    queue.close()
@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from llm_router import RouterChatModel
+
+
+class FakeChatModel(BaseChatModel):
+    """按脚本返回结果的模型：先等待 delay 秒，再抛出 error 或返回 reply，并记录调用与取消情况。"""
+
+    rate_limiter_name: str
+    reply: str = "ok"
+    delay: float = 0.0
+    error: Exception | None = None
+    fail_after_chunks: int | None = None
+
+    _calls: int = PrivateAttr(default=0)
+    _cancelled: int = PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._calls += 1
+        if self.error:
+            raise self.error
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self._cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self._calls += 1
+        for i, word in enumerate(self.reply.split()):
+            if self.error and (self.fail_after_chunks or 0) == i:
+                raise self.error
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+def make_router(*models, **kwargs):
+    # 不随机探索，保证按配置顺序选择首个服务商
+    kwargs.setdefault('explore_ratio', 0)
+    return RouterChatModel(models=list(models), **kwargs)
+
+
+def collect(router, prompt="hi"):
+    async def run():
+        return "".join([chunk.content async for chunk in router.astream(prompt)])
+    return asyncio.run(run())
+
+
+def test_failing_primary_falls_through_to_next_model():
+    """首个服务商出错时转移到下一个服务商，并记录失败。"""
+    primary = FakeChatModel(rate_limiter_name="primary", error=ConnectionError("down"))
+    backup = FakeChatModel(rate_limiter_name="backup", reply="from backup")
+    router = make_router(primary, backup, hedge=False)
+
+    assert asyncio.run(router.ainvoke("hi")).content == "from backup"
+    assert (primary._calls, backup._calls) == (1, 1)
+    assert router.stats()['providers']['primary']['consecutive_errors'] == 1
+    assert router.stats()['providers']['backup']['consecutive_errors'] == 0
+
+
+def test_failed_primary_is_ranked_last_on_next_request():
+    """出错的服务商在冷却期内降权，下一次请求直接发给其他服务商。"""
+    primary = FakeChatModel(rate_limiter_name="primary", error=ConnectionError("down"))
+    backup = FakeChatModel(rate_limiter_name="backup", reply="from backup")
+    router = make_router(primary, backup, hedge=False)
+
+    asyncio.run(router.ainvoke("hi"))
+    asyncio.run(router.ainvoke("hi"))
+    assert (primary._calls, backup._calls) == (1, 2)
+
+
+def test_all_models_failing_raises_last_error():
+    """所有服务商都失败时抛出最后一个错误。"""
+    first = FakeChatModel(rate_limiter_name="first", error=ConnectionError("first down"))
+    second = FakeChatModel(rate_limiter_name="second", error=TimeoutError("second down"))
+    router = make_router(first, second, hedge=False)
+
+    with pytest.raises(TimeoutError, match="second down"):
+        asyncio.run(router.ainvoke("hi"))
+
+
+def test_hedge_wins_and_slow_primary_is_cancelled():
+    """首个请求超过对冲阈值时发出对冲请求，先返回的结果生效，慢的请求被取消。"""
+    slow = FakeChatModel(rate_limiter_name="slow", reply="slow", delay=5)
+    fast = FakeChatModel(rate_limiter_name="fast", reply="fast")
+    router = make_router(slow, fast, initial_hedge_delay=0.05, max_hedge_ratio=1)
+
+    assert asyncio.run(router.ainvoke("hi")).content == "fast"
+    assert router.stats()['hedges'] == 1
+    assert slow._cancelled == 1
+    assert fast._cancelled == 0
+
+
+def test_primary_returning_before_hedge_delay_sends_no_hedge():
+    """首个请求在对冲阈值内返回时不发出对冲请求。"""
+    primary = FakeChatModel(rate_limiter_name="primary", reply="primary")
+    backup = FakeChatModel(rate_limiter_name="backup")
+    router = make_router(primary, backup, initial_hedge_delay=1, max_hedge_ratio=1)
+
+    assert asyncio.run(router.ainvoke("hi")).content == "primary"
+    assert router.stats()['hedges'] == 0
+    assert backup._calls == 0
+
+
+def test_hedge_ratio_limits_hedges():
+    """对冲请求数不超过 max_hedge_ratio；超过比例后只等待首个请求。"""
+    slow = FakeChatModel(rate_limiter_name="slow", reply="slow", delay=0.1)
+    fast = FakeChatModel(rate_limiter_name="fast", reply="fast")
+    router = make_router(slow, fast, initial_hedge_delay=0.01, max_hedge_ratio=0)
+
+    assert asyncio.run(router.ainvoke("hi")).content == "slow"
+    assert router.stats()['hedges'] == 0
+    assert fast._calls == 0
+
+
+def test_stream_fails_over_before_first_chunk():
+    """流式请求在第一块输出之前出错时转移到下一个服务商。"""
+    primary = FakeChatModel(rate_limiter_name="primary", error=ConnectionError("down"), fail_after_chunks=0)
+    backup = FakeChatModel(rate_limiter_name="backup", reply="from backup")
+    router = make_router(primary, backup)
+
+    assert collect(router) == "from backup "
+    assert (primary._calls, backup._calls) == (1, 1)
+
+
+def test_stream_error_after_first_chunk_is_raised():
+    """已经输出内容之后出错时直接抛出，不再转移。"""
+    primary = FakeChatModel(rate_limiter_name="primary", reply="one two three", error=ConnectionError("cut"),
+                            fail_after_chunks=2)
+    backup = FakeChatModel(rate_limiter_name="backup", reply="from backup")
+    router = make_router(primary, backup)
+
+    with pytest.raises(ConnectionError, match="cut"):
+        collect(router)
+    assert backup._calls == 0
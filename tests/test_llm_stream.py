@@ -0,0 +1,58 @@
+from llm_stream import EmailStreamParser, IncrementalJSONParser, parse_email, parse_json
+
+
+def feed_in_chunks(parser, text, size=7):
+    for start in range(0, len(text), size):
+        parser.feed(text[start:start + size])
+    return parser
+
+
+def test_json_object_surrounded_by_prose():
+    text = 'Sure, here it is:\n{"company_summary": "makes {valves}", "pain_points": ["a", "b"]}\nHope this helps {'
+    parser = feed_in_chunks(IncrementalJSONParser(), text)
+    assert parser.done
+    assert parser.result() == {"company_summary": "makes {valves}", "pain_points": ["a", "b"]}
+
+
+def test_json_invalid_candidate_is_skipped():
+    assert parse_json('{not json} then {"ok": true}') == {"ok": True}
+
+
+def test_json_array_items_available_before_array_closes():
+    parser = IncrementalJSONParser(root='[')
+    parser.feed('[{"id": "1", "subject": "a"}, {"id": "2", "subj')
+    assert parser.items == [{"id": "1", "subject": "a"}]
+    assert not parser.done
+    assert parser.result() == [{"id": "1", "subject": "a"}]  # 输出被截断时退回已完整的元素
+    parser.feed('ect": "b]"}]')
+    assert parser.done
+    assert parser.result() == [{"id": "1", "subject": "a"}, {"id": "2", "subject": "b]"}]
+
+
+def test_email_stops_after_signature_block():
+    text = ("Subject: Quick question\n\nHi Anna,\n\nWe make valves.\n\nBest regards,\nChloe\nSales Manager\n\n"
+            "Note: this email was written to be concise.")
+    parser = feed_in_chunks(EmailStreamParser("Chloe"), text)
+    assert parser.done
+    subject, body = parser.result()
+    assert subject == "Quick question"
+    assert body.endswith("Best regards,\nChloe\nSales Manager")
+    assert "Note:" not in body
+
+
+def test_email_sign_off_without_sender_name_is_body_text():
+    text = "Subject: Hi\n\nThanks!\nThat was helpful.\n\nCheers\nthe end\n\nBest regards,\nChloe\n"
+    parser = feed_in_chunks(EmailStreamParser("Chloe"), text)
+    subject, body = parser.result()
+    assert "That was helpful." in body and "the end" in body
+    assert body.endswith("Best regards,\nChloe")
+
+
+def test_email_without_sender_name_never_stops_early():
+    parser = feed_in_chunks(EmailStreamParser(), "Subject: Hi\n\nBody\n\nBest regards,\nChloe\n\nP.S. more")
+    assert not parser.done
+    assert parser.result()[1].endswith("P.S. more")
+
+
+def test_parse_email_without_subject_line():
+    assert parse_email("Hello there\n\nBody text") == ("未生成主题", "Hello there\n\nBody text")
@@ -0,0 +1,99 @@
+import smtplib
+
+import pytest
+
+from outbox import DEFERRED, FAILED, PENDING, SENDING, SENT, Outbox, is_hard_bounce, is_transient_smtp_error
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.sqlite"), max_attempts=2, base_delay=0.05, max_delay=0.05)
+    yield box
+    box.close()
+
+
+def test_dedup_per_recipient_and_source(outbox):
+    key = outbox.enqueue('Anna@Example.com', 'Hi', 'body v1', source='spring')
+    assert outbox.enqueue(' anna@example.com', 'Hi', 'regenerated body v2', source='spring') == key
+    assert outbox.enqueue('anna@example.com', 'Hi', 'body', source='autumn') != key
+    assert outbox.enqueue_many([('anna@example.com', 'Hi', 'v3'), ('bob@example.com', 'Hi', 'b')], source='spring') == 1
+    assert outbox.counts() == {PENDING: 3}
+
+
+def test_send_success_transitions(outbox):
+    key = outbox.enqueue('a@example.com', 'Hi', 'body')
+    message = outbox.claim(key)
+    assert message['state'] == SENDING and message['attempts'] == 1
+    assert outbox.claim(key) is None  # 已被认领
+    outbox.mark_sent(key)
+    assert outbox.get(key)['state'] == SENT
+    assert outbox.claim_due() == []
+    assert outbox.seconds_until_next_due() is None
+
+
+def test_transient_error_defers_then_fails_after_max_attempts(outbox):
+    key = outbox.enqueue('a@example.com', 'Hi', 'body')
+    outbox.claim(key)
+    assert outbox.mark_failed(key, smtplib.SMTPResponseException(451, b'try later')) == DEFERRED
+    assert outbox.claim(key) is None  # 未到重试时间
+    assert 0 < outbox.seconds_until_next_due() <= 0.06
+
+    [message] = _wait_due(outbox)
+    assert message['attempts'] == 2
+    assert outbox.mark_failed(key, smtplib.SMTPServerDisconnected()) == FAILED
+    assert outbox.get(key)['last_error'].startswith('SMTPServerDisconnected')
+
+
+def test_permanent_error_fails_immediately(outbox):
+    key = outbox.enqueue('a@example.com', 'Hi', 'body')
+    outbox.claim(key)
+    error = smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'no such user')})
+    assert outbox.mark_failed(key, error) == FAILED
+
+
+def test_release_does_not_count_attempt(outbox):
+    key = outbox.enqueue('a@example.com', 'Hi', 'body')
+    outbox.claim(key)
+    outbox.release(key)
+    message = outbox.get(key)
+    assert message['state'] == PENDING and message['attempts'] == 0
+
+
+def test_interrupted_sends_need_manual_requeue(outbox):
+    key = outbox.enqueue('a@example.com', 'Hi', 'body')
+    outbox.claim(key)
+    assert outbox.recover_interrupted() == 1
+    assert outbox.get(key)['state'] == FAILED
+    assert outbox.requeue() == 1
+    assert outbox.get(key)['state'] == PENDING and outbox.get(key)['attempts'] == 0
+
+
+def _wait_due(outbox):
+    import time
+    time.sleep(outbox.seconds_until_next_due() + 0.01)
+    return outbox.claim_due()
+
+
+@pytest.mark.parametrize('error, transient', [
+    (smtplib.SMTPResponseException(421, b'busy'), True),
+    (smtplib.SMTPResponseException(554, b'rejected'), False),
+    (smtplib.SMTPRecipientsRefused({'a@x.com': (450, b'mailbox busy')}), True),
+    (smtplib.SMTPRecipientsRefused({'a@x.com': (550, b'unknown user')}), False),
+    (smtplib.SMTPServerDisconnected(), True),
+    (TimeoutError(), True),
+    (smtplib.SMTPAuthenticationError(535, b'bad credentials'), False),
+    (ValueError('invalid address'), False),
+])
+def test_is_transient_smtp_error(error, transient):
+    assert is_transient_smtp_error(error) is transient
+
+
+@pytest.mark.parametrize('error, bounce', [
+    (smtplib.SMTPRecipientsRefused({'a@x.com': (550, b'unknown user')}), True),
+    (smtplib.SMTPRecipientsRefused({'a@x.com': (550, b'unknown'), 'b@x.com': (451, b'later')}), False),
+    (smtplib.SMTPSenderRefused(550, b'sender rejected', 'me@x.com'), False),
+    (smtplib.SMTPDataError(550, b'spam'), False),
+    (smtplib.SMTPServerDisconnected(), False),
+])
+def test_is_hard_bounce(error, bounce):
+    assert is_hard_bounce(error) is bounce
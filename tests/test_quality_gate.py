@@ -0,0 +1,168 @@
+import asyncio
+import csv
+
+import pytest
+
+from quality_gate import QUALITY_FIELD, QualityGate
+from result_store import ResultStore
+
+BODY = ("We help mid-sized distributors cut lead times on stainless valves with local stock and "
+        "same-week shipping. ") * 3
+
+
+def email(to='anna@example.com', subject='Shorter lead times', body=BODY, **fields):
+    return {'邮箱': to, '开发信主题': subject, '开发信内容': body, **fields}
+
+
+@pytest.fixture
+def gate():
+    return QualityGate(min_words=10, max_words=100)
+
+
+def test_good_email_passes(gate):
+    assert gate.check(email()) == []
+
+
+@pytest.mark.parametrize('record, rule', [
+    (email(subject=''), 'missing_subject'),
+    (email(subject='未生成主题'), 'missing_subject'),
+    (email(body=''), 'missing_body'),
+    (email(body='Too short.'), 'word_count'),
+    (email(body=BODY * 3), 'word_count'),
+    (email(body=BODY + 'Dear nan,'), 'placeholder'),
+    (email(body=BODY + 'Dear NaN,'), 'placeholder'),
+    (email(body=BODY + 'Phone: N/A'), 'placeholder'),
+    (email(body=BODY + 'Best, [Your Name]'), 'placeholder'),
+    (email(body=BODY + 'Hi {contact_name}'), 'placeholder'),
+    (email(subject='Hi <First Name>'), 'placeholder'),
+    (email(body=BODY + '我们的产品质量很好'), 'language'),
+])
+def test_rule(gate, record, rule):
+    assert gate.check(record) == [rule]
+
+
+def test_contact_fields_are_not_flagged(gate):
+    """联系人自己的姓名、公司名不算占位符或外文。"""
+    record = email(body='Dear Nan, ' + BODY + 'Regards to everyone at 北京精密阀门有限公司.',
+                   姓名='Nan', 公司名称='北京精密阀门有限公司')
+    assert gate.check(record) == []
+
+
+def test_missing_name_does_not_hide_placeholder(gate):
+    assert gate.check(email(body='Dear nan, ' + BODY, 姓名=float('nan'))) == ['placeholder']
+
+
+def test_duplicate_body_for_another_contact(gate):
+    assert gate.check(email('anna@example.com')) == []
+    assert gate.check(email('bob@example.com', body=BODY.upper())) == ['duplicate']
+    assert gate.check(email('anna@example.com')) == []  # 同一联系人重新检查不算重复
+
+
+def test_release_frees_the_body_for_the_concurrent_duplicate(gate):
+    """先通过的邮件没有保存时注销指纹，并发生成出相同正文的另一封邮件随后可以通过。"""
+    first, second = email('anna@example.com'), email('bob@example.com')
+    assert gate.check(first) == []
+    assert gate.check(second) == ['duplicate']
+    gate.release(second)  # 不是指纹的登记者，不影响
+    assert gate.check(second) == ['duplicate']
+    gate.release(first)
+    assert gate.check(second) == []
+
+
+def test_accept_records_failures_and_stats(gate):
+    failing = gate.accept(email('anna@example.com', body='short'), ['word_count'])
+    passing = gate.accept(email('bob@example.com'), [], retried=True)
+    assert failing[QUALITY_FIELD] == 'word_count' and passing[QUALITY_FIELD] == ''
+    stats = gate.stats()
+    assert (stats['checked'], stats['passed'], stats['recovered']) == (2, 1, 1)
+    assert stats['rules']['word_count']['unrecovered'] == 1
+
+
+def test_per_contact_retry_budget():
+    gate = QualityGate(min_words=10, max_retries=2, min_budget=100)
+    assert gate.allow_retry(0) and gate.allow_retry(1)
+    assert not gate.allow_retry(2)
+    assert gate.regenerations == 2
+
+
+def test_global_retry_budget():
+    gate = QualityGate(min_words=10, max_retries=5, retry_ratio=0.5, min_budget=2)
+    assert gate.allow_retry(0) and gate.allow_retry(0)
+    assert not gate.allow_retry(0)  # 已质检 0 封时额度为 min_budget
+    assert gate.budget_exhausted == 1
+    gate.checked = 6
+    assert gate.allow_retry(0)  # 额度随已质检数增长到 0.5 × 6 = 3
+    assert not gate.allow_retry(0)
+
+
+def test_review_store_redoes_failing_latest_records(gate, tmp_path):
+    store = ResultStore(str(tmp_path / "store.jsonl"))
+    store.append(email('anna@example.com', body='short'))
+    store.append(email('anna@example.com'))  # 最后一条通过
+    store.append(email('bob@example.com', body=BODY + 'Hi [Name]'))
+    store.append(email('carol@example.com', body=BODY.replace('valves', 'pumps')))
+
+    passing, failing = gate.review_store(store)
+
+    assert passing == {'anna@example.com', 'carol@example.com'}
+    assert failing == {'bob@example.com'}
+    assert gate.resumed_failed == 1
+    assert gate.check(email('dave@example.com')) == ['duplicate']  # 通过的记录已登记到重复检测
+
+
+class ScriptedChain:
+    """按顺序返回预设输出的假生成链（没有 llm/prompt 属性，走普通调用）。"""
+
+    def __init__(self, outputs):
+        self.outputs = list(outputs)
+        self.calls = 0
+
+    async def ainvoke(self, inputs):
+        self.calls += 1
+        return {'text': self.outputs.pop(0) if len(self.outputs) > 1 else self.outputs[0]}
+
+
+@pytest.fixture
+def generation_env(tmp_path, monkeypatch):
+    import contact_hygiene
+    import generate_email
+    import llm_cache
+
+    monkeypatch.setenv('SUPPRESSION_DB', str(tmp_path / "suppression.sqlite"))
+    monkeypatch.setattr(contact_hygiene, '_default_suppression', None)
+    monkeypatch.setattr(llm_cache, '_default_cache', llm_cache.SQLiteLLMCache(str(tmp_path / "llm.sqlite")))
+    monkeypatch.setattr(generate_email, 'load_product_info', lambda: 'Valves')
+    monkeypatch.setattr(generate_email, 'load_my_info', lambda: 'name: Chloe')
+    contacts = tmp_path / "contacts.csv"
+    with open(contacts, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['公司名称', '姓名', '职务', '邮箱', '简介'])
+        writer.writeheader()
+        writer.writerow({'公司名称': 'Acme', '姓名': 'Anna', '职务': 'CEO', '邮箱': 'anna@acme.com', '简介': 'x'})
+    return generate_email, str(contacts), str(tmp_path / "store.jsonl")
+
+
+def test_failing_email_is_regenerated(generation_env):
+    generate_email, contacts, store_path = generation_env
+    chain = ScriptedChain(['Subject: Hi\n\nToo short.', f'Subject: Hi\n\n{BODY}'])
+
+    failed = asyncio.run(generate_email.process_contacts(
+        contacts, chain=chain, max_concurrency=1, store_path=store_path, output_filename=None,
+        quality_gate=QualityGate(min_words=10)))
+
+    assert failed == 0 and chain.calls == 2
+    [record] = ResultStore(store_path).latest_records().values()
+    assert record[QUALITY_FIELD] == '' and record['开发信内容'] == BODY.strip()
+
+
+def test_resume_regenerates_only_failing_records(generation_env):
+    generate_email, contacts, store_path = generation_env
+    store = ResultStore(store_path)
+    store.append(email('anna@acme.com', body='short', **{QUALITY_FIELD: 'word_count'}))
+    chain = ScriptedChain([f'Subject: Hi\n\n{BODY}'])
+
+    asyncio.run(generate_email.process_contacts(
+        contacts, chain=chain, max_concurrency=1, store_path=store_path, output_filename=None, resume=True,
+        quality_gate=QualityGate(min_words=10)))
+
+    assert chain.calls == 1
+    assert ResultStore(store_path).latest_records()['anna@acme.com'][QUALITY_FIELD] == ''
@@ -0,0 +1,249 @@
+import asyncio
+
+import pytest
+
+import rate_limit
+from rate_limit import AdaptiveConcurrency, RateLimiter, SharedTokenBucket, is_rate_limit_error, is_retryable_error
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.time, 'monotonic', clock)
+    monkeypatch.setattr(rate_limit.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """记录退避时间，不真正等待。"""
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay, *args, **kwargs):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(rate_limit.asyncio, 'sleep', fake_sleep)
+    return delays
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class APIError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.response = Response(status_code, headers)
+
+
+class RateLimitError(Exception):
+    pass
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_aimd_halves_on_overload_and_recovers(clock):
+    async def main():
+        concurrency = AdaptiveConcurrency(initial=4, max_limit=4, cooldown=5.0)
+        await concurrency.acquire()
+        await concurrency.release(overloaded=True)
+        assert concurrency.limit == 2
+        await concurrency.acquire()
+        await concurrency.release(overloaded=True)  # 冷却期内的同一波错误不再减半
+        assert concurrency.limit == 2
+        clock.now += 5
+        await concurrency.acquire()
+        await concurrency.release(overloaded=True)
+        assert concurrency.limit == 1  # 不低于 min_limit
+        clock.now += 5
+        await concurrency.acquire()
+        await concurrency.release(overloaded=True)
+        assert concurrency.limit == 1
+
+        for _ in range(20):
+            await concurrency.acquire()
+            await concurrency.release(latency=0.1)
+        assert concurrency.limit == 4  # 线性恢复到上限为止
+
+    run(main())
+
+
+def test_aimd_treats_slow_responses_as_overload(clock):
+    async def main():
+        concurrency = AdaptiveConcurrency(initial=4, max_limit=4, latency_target=2.0)
+        await concurrency.acquire()
+        await concurrency.release(latency=1.0)
+        assert concurrency.limit == 4
+        await concurrency.acquire()
+        await concurrency.release(latency=3.0)
+        assert concurrency.limit == 2
+
+    run(main())
+
+
+def test_aimd_blocks_above_limit():
+    async def main():
+        concurrency = AdaptiveConcurrency(initial=1, max_limit=1)
+        await concurrency.acquire()
+        waiter = asyncio.ensure_future(concurrency.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        await concurrency.release()
+        await asyncio.wait_for(waiter, 1)
+        assert concurrency.in_flight == 1
+
+    run(main())
+
+
+def test_shared_bucket_is_shared_between_instances(tmp_path, clock):
+    db = str(tmp_path / "limits.sqlite")
+    first = SharedTokenBucket(db, 'hunyuan:rpm', rate_per_minute=60, capacity=2)
+    second = SharedTokenBucket(db, 'hunyuan:rpm', rate_per_minute=60, capacity=2)
+    other = SharedTokenBucket(db, 'dashscope:rpm', rate_per_minute=60, capacity=2)
+
+    assert first._try_take(2) == 0
+    assert second._try_take(1) == pytest.approx(1.0)  # 另一个实例看到同一个桶已被取空
+    assert second.wait_time(1) == pytest.approx(1.0)
+    assert other._try_take(1) == 0  # 不同键互不影响
+    clock.now += 1
+    assert second._try_take(1) == 0
+    second.adjust(-1)  # 退还
+    assert first._try_take(1) == 0
+
+
+def test_limiters_with_shared_db_share_quota(tmp_path, clock):
+    db = str(tmp_path / "limits.sqlite")
+    worker_a = RateLimiter('hunyuan', rpm=60, shared_db=db)
+    worker_b = RateLimiter('hunyuan', rpm=60, shared_db=db)
+    assert worker_b.estimated_wait() == 0
+    assert worker_a.requests._try_take(60) == 0
+    assert worker_b.estimated_wait() == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize('error, rate_limited, retryable', [
+    (APIError(429), True, True),
+    (RateLimitError(), True, True),
+    (APIError(503), False, True),
+    (APIError(400), False, False),
+    (APIError(401), False, False),
+    (asyncio.TimeoutError(), False, True),
+    (ConnectionError(), False, True),
+    (ValueError('bad prompt'), False, False),
+])
+def test_error_classification(error, rate_limited, retryable):
+    assert is_rate_limit_error(error) is rate_limited
+    assert is_retryable_error(error) is retryable
+
+
+def test_call_honours_retry_after_and_halves_concurrency(sleeps):
+    attempts = []
+
+    async def request():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise APIError(429, {'retry-after': '3'})
+        return 'ok'
+
+    async def main():
+        limiter = RateLimiter('test', max_concurrency=4)
+        result = await limiter.call(request)
+        return result, limiter.concurrency.limit
+
+    result, limit = run(main())
+    assert result == 'ok' and len(attempts) == 2
+    assert sleeps == [3.0]
+    assert limit < 4
+
+
+def test_call_zero_retry_after_retries_immediately(sleeps):
+    attempts = []
+
+    async def request():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise APIError(429, {'retry-after': '0'})
+        return 'ok'
+
+    assert run(RateLimiter('test', base_delay=10).call(request)) == 'ok'
+    assert sleeps == [0.0]
+
+
+def test_call_does_not_retry_client_errors(sleeps):
+    attempts = []
+
+    async def request():
+        attempts.append(1)
+        raise APIError(400)
+
+    with pytest.raises(APIError):
+        run(RateLimiter('test').call(request))
+    assert len(attempts) == 1 and sleeps == []
+
+
+def test_call_gives_up_after_max_retries(sleeps):
+    attempts = []
+
+    async def request():
+        attempts.append(1)
+        raise APIError(503)
+
+    with pytest.raises(APIError):
+        run(RateLimiter('test', max_retries=4).call(request, max_retries=2))
+    assert len(attempts) == 3 and len(sleeps) == 2
+
+
+def test_call_usage_corrects_token_bucket():
+    async def main():
+        limiter = RateLimiter('test', tpm=1000)
+        await limiter.call(lambda: asyncio.sleep(0, result={'tokens': 300}), estimated_tokens=100,
+                           usage_getter=lambda result: result['tokens'])
+        return limiter.tokens.tokens
+
+    assert run(main()) == pytest.approx(700, abs=1)
+
+
+def test_stream_retries_only_before_first_chunk(sleeps):
+    streams = []
+
+    async def stream(fail_before=False, fail_after=False):
+        if fail_before:
+            raise APIError(429)
+        yield 'Hello'
+        if fail_after:
+            raise APIError(503)
+        yield ' world'
+
+    def factory_failing_first():
+        streams.append(1)
+        return stream(fail_before=len(streams) == 1)
+
+    async def collect(limiter, factory):
+        return [chunk async for chunk in limiter.stream(factory)]
+
+    async def main():
+        limiter = RateLimiter('test')
+        assert await collect(limiter, factory_failing_first) == ['Hello', ' world']
+        assert len(streams) == 2
+        received = []
+        with pytest.raises(APIError):
+            async for chunk in limiter.stream(lambda: stream(fail_after=True)):
+                received.append(chunk)
+        assert received == ['Hello']  # 已输出内容后出错不重试
+        assert limiter.concurrency.in_flight == 0
+
+    run(main())
+    assert len(sleeps) == 1
@@ -0,0 +1,39 @@
+import json
+
+from result_store import ResultStore
+
+
+def test_resume_keeps_completed_keys(tmp_path):
+    path = tmp_path / "store.jsonl"
+    store = ResultStore(str(path))
+    store.reset()
+    store.append({'邮箱': 'A@Example.com', '开发信内容': 'first'})
+    store.append({'邮箱': 'b@example.com', '开发信内容': 'second'})
+
+    resumed = ResultStore(str(path))
+    assert resumed.completed_keys() == {'a@example.com', 'b@example.com'}
+
+
+def test_latest_record_wins(tmp_path):
+    store = ResultStore(str(tmp_path / "store.jsonl"))
+    store.append({'邮箱': 'a@example.com', '开发信内容': 'old'})
+    store.append({'邮箱': 'A@example.com ', '开发信内容': 'new'})
+    assert store.latest_records() == {'a@example.com': {'邮箱': 'A@example.com ', '开发信内容': 'new'}}
+
+
+def test_torn_last_line_is_skipped_and_next_append_survives(tmp_path):
+    """上次中断时写了一半的最后一行被忽略，续跑追加的记录不会拼接到这一行上。"""
+    path = tmp_path / "store.jsonl"
+    path.write_text(json.dumps({'邮箱': 'a@example.com'}) + '\n{"邮箱": "b@exa', encoding='utf-8')
+
+    store = ResultStore(str(path))
+    assert store.completed_keys() == {'a@example.com'}
+    store.append({'邮箱': 'c@example.com'})
+    assert ResultStore(str(path)).completed_keys() == {'a@example.com', 'c@example.com'}
+
+
+def test_reset_clears_previous_run(tmp_path):
+    store = ResultStore(str(tmp_path / "store.jsonl"))
+    store.append({'邮箱': 'a@example.com'})
+    store.reset()
+    assert store.completed_keys() == set()
@@ -0,0 +1,69 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import contact_hygiene
+import send_email
+from outbox import PENDING, Outbox
+from result_store import ResultStore
+from send_email import load_outbox, send_emails_from_queue
+
+
+@pytest.fixture(autouse=True)
+def suppression_db(tmp_path, monkeypatch):
+    monkeypatch.setenv('SUPPRESSION_DB', str(tmp_path / "suppression.sqlite"))
+    monkeypatch.setattr(contact_hygiene, '_default_suppression', None)
+
+
+def test_store_uses_latest_record_per_contact(tmp_path):
+    """resume 时重新生成并通过质检的邮件要进入发件箱，不能被先前未通过质检的旧记录挡住。"""
+    store = ResultStore(str(tmp_path / "store.jsonl"))
+    store.append({'邮箱': 'anna@example.com', '开发信主题': 'Hi', '开发信内容': 'too short', '质检问题': 'word_count'})
+    store.append({'邮箱': 'anna@example.com', '开发信主题': 'Hi', '开发信内容': 'fixed body', '质检问题': ''})
+    store.append({'邮箱': 'bob@example.com', '开发信主题': 'Hi', '开发信内容': 'good', '质检问题': ''})
+    store.append({'邮箱': 'bob@example.com', '开发信主题': 'Hi', '开发信内容': 'bad', '质检问题': 'placeholder'})
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+
+    assert load_outbox(store.path, outbox, source='c1', from_store=True)
+
+    assert outbox.counts() == {PENDING: 1}
+    [message] = outbox.claim_due()
+    assert (message['recipient'], message['content']) == ('anna@example.com', 'fixed body')
+    outbox.close()
+
+
+def test_missing_store(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    assert not load_outbox(str(tmp_path / "missing.jsonl"), outbox, from_store=True)
+    outbox.close()
+
+
+def drain(outbox=None):
+    """发送阶段不可用（sender=False）时消费一个空队列。"""
+    queue = asyncio.Queue()
+    queue.put_nowait(None)
+    return asyncio.run(send_emails_from_queue(queue, sender=False, outbox=outbox))
+
+
+def test_queue_sender_closes_outbox_it_opened(tmp_path, monkeypatch):
+    """未传入发件箱时，函数自己打开的发件箱在结束时关闭。"""
+    opened = []
+
+    def make_outbox():
+        opened.append(Outbox(str(tmp_path / "outbox.sqlite")))
+        return opened[-1]
+
+    monkeypatch.setattr(send_email, 'Outbox', make_outbox)
+    assert drain() == []
+    [outbox] = opened
+    with pytest.raises(sqlite3.ProgrammingError):
+        outbox.counts()
+
+
+def test_queue_sender_leaves_passed_outbox_open(tmp_path):
+    """调用方传入的发件箱由调用方关闭。"""
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"))
+    drain(outbox)
+    assert outbox.counts() == {}
+    outbox.close()
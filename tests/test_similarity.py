@@ -0,0 +1,40 @@
+from similarity import SimilarityIndex
+
+VALVES = ("We are a leading manufacturer of industrial stainless steel ball valves, gate valves and pipe fittings "
+          "for the oil and gas industry, exporting to more than forty countries since 1998.")
+VALVES_REWORDED = VALVES.replace("leading", "Leading").replace("1998.", "1998!")
+BAKERY = ("Family owned artisan bakery in Lyon producing sourdough bread, croissants and seasonal pastries for "
+          "local cafes, hotels and restaurants, with daily deliveries across the city.")
+
+
+def test_near_duplicate_joins_existing_leader():
+    index = SimilarityIndex()
+    assert index.assign('a@valves.com', VALVES) is None
+    assert index.is_leader('a@valves.com')
+    assert index.assign('b@valves.com', VALVES_REWORDED) == 'a@valves.com'
+    assert index.assign('c@bakery.fr', BAKERY) is None
+    assert index.leaders == 2
+    assert index.members == {'a@valves.com': 1}
+
+
+def test_short_profile_is_not_clustered():
+    index = SimilarityIndex()
+    assert index.assign('a@x.com', 'Valves') is None
+    assert not index.is_leader('a@x.com')
+    assert index.skipped == 1
+
+
+def test_full_cluster_starts_new_leader():
+    index = SimilarityIndex(max_cluster_size=1)
+    index.assign('a@valves.com', VALVES)
+    assert index.assign('b@valves.com', VALVES) == 'a@valves.com'
+    assert index.assign('c@valves.com', VALVES) is None
+    assert index.is_leader('c@valves.com')
+
+
+def test_released_leader_is_not_reused():
+    index = SimilarityIndex()
+    index.assign('a@valves.com', VALVES)
+    index.release('a@valves.com')
+    assert index.assign('b@valves.com', VALVES) is None
+    assert index.is_leader('b@valves.com')
@@ -0,0 +1,128 @@
+import asyncio
+import socket
+
+import pytest
+
+pytest.importorskip('aiosmtpd')
+pytest.importorskip('yagmail')
+
+from aiosmtpd.controller import Controller  # noqa: E402
+from aiosmtpd.smtp import AuthResult  # noqa: E402
+
+from smtp_sender import AsyncEmailSender, NoSenderAccountError  # noqa: E402
+
+
+class Recorder:
+    def __init__(self):
+        self.recipients = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.recipients.extend(envelope.rcpt_tos)
+        return '250 OK'
+
+
+def authenticate(server, session, envelope, mechanism, auth_data):
+    return AuthResult(success=auth_data.password == b'secret', handled=False)  # handled=False 时由服务器回复 535
+
+
+@pytest.fixture
+def smtp_server():
+    """本地 aiosmtpd 服务器，明文、允许不加密的 AUTH，只接受密码 secret。"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    handler = Recorder()
+    controller = Controller(handler, hostname='127.0.0.1', port=port, authenticator=authenticate,
+                            auth_require_tls=False)
+    controller.start()
+    yield port, handler
+    controller.stop()
+
+
+def account(port, user, password='secret', **extra):
+    return {'user': user, 'password': password, 'host': '127.0.0.1', 'port': port, 'ssl': False,
+            'starttls': False, **extra}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_parallel_sends_reach_server(smtp_server):
+    port, handler = smtp_server
+
+    async def main():
+        sender = AsyncEmailSender([account(port, 'me@example.com', pool_size=2)], max_parallel=3)
+        try:
+            return await asyncio.gather(*(sender.send(f'user{i}@example.com', 'Hi', 'body') for i in range(6)))
+        finally:
+            await sender.close()
+
+    assert run(main()) == ['me@example.com'] * 6
+    assert sorted(handler.recipients) == sorted(f'user{i}@example.com' for i in range(6))
+
+
+def test_failed_login_disables_account_and_uses_the_next(smtp_server):
+    port, handler = smtp_server
+
+    async def main():
+        sender = AsyncEmailSender([account(port, 'bad@example.com', password='wrong'),
+                                   account(port, 'good@example.com')])
+        try:
+            used = [await sender.send(f'user{i}@example.com', 'Hi', 'body') for i in range(3)]
+            return used, sender.disabled, sender.available
+        finally:
+            await sender.close()
+
+    used, disabled, available = run(main())
+    assert used == ['good@example.com'] * 3
+    assert disabled == {0} and available
+    assert len(handler.recipients) == 3
+
+
+def test_all_accounts_disabled(smtp_server):
+    port, handler = smtp_server
+
+    async def main():
+        sender = AsyncEmailSender([account(port, 'bad@example.com', password='wrong')])
+        try:
+            with pytest.raises(NoSenderAccountError):
+                await sender.send('user@example.com', 'Hi', 'body')
+            assert not sender.available
+        finally:
+            await sender.close()
+
+    run(main())
+    assert handler.recipients == []
+
+
+def test_reconnects_after_dropped_connection(smtp_server):
+    port, handler = smtp_server
+
+    async def main():
+        sender = AsyncEmailSender([account(port, 'me@example.com', pool_size=1)])
+        try:
+            await sender.send('a@example.com', 'Hi', 'body')
+            sender.pools[0]._idle[0].close()  # 模拟空闲连接被服务器断开
+            await sender.send('b@example.com', 'Hi', 'body')
+        finally:
+            await sender.close()
+
+    run(main())
+    assert handler.recipients == ['a@example.com', 'b@example.com']
+
+
+def test_domain_buckets_are_bounded(smtp_server):
+    port, handler = smtp_server
+
+    async def main():
+        sender = AsyncEmailSender([account(port, 'me@example.com')], domain_rate_per_minute=6000,
+                                  max_domain_buckets=2)
+        try:
+            for domain in ('a.com', 'b.com', 'c.com', 'b.com'):
+                await sender.send(f'user@{domain}', 'Hi', 'body')
+            return list(sender.domain_buckets)
+        finally:
+            await sender.close()
+
+    assert run(main()) == ['c.com', 'b.com']